@@ -0,0 +1,142 @@
+"""baseline schema
+
+The tables as they existed before migrations were introduced. Databases that
+already have them are marked as migrated with `alembic stamp 0001`.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17 09:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'tbl_100_telegram_config',
+        sa.Column('pk_bot', sa.Integer(), primary_key=True),
+        sa.Column('bot_name', sa.String(100)),
+        sa.Column('bot_short_name', sa.String(100)),
+        sa.Column('bot_description', sa.String(4000)),
+        sa.Column('bot_token', sa.String(4000)),
+        sa.Column('bot_voice_id', sa.String(4000)),
+        sa.Column('bot_assistant_prompt', sa.String(4000)),
+        sa.Column('bot_pre_prompt', sa.String(4000)),
+        sa.Column('bot_greeting_msg', sa.String(4000)),
+        sa.Column('bot_temperature', sa.Integer()),
+        sa.Column('bot_presence_penalty', sa.Integer()),
+        sa.Column('bot_frequency_penalty', sa.Integer()),
+        sa.Column('bot_default_reply', sa.String(4000)),
+        sa.Column('created_by', sa.String(1000)),
+        sa.Column('created_on', sa.DateTime()),
+        sa.Column('updated_by', sa.String(1000)),
+        sa.Column('updated_on', sa.DateTime()),
+    )
+    op.create_index('ix_tbl_100_telegram_config_pk_bot', 'tbl_100_telegram_config', ['pk_bot'])
+
+    op.create_table(
+        'tbl_150_user_info',
+        sa.Column('pk_user_id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('id', sa.BigInteger(), nullable=False),
+        sa.Column('chat_id', sa.BigInteger(), nullable=False),
+        sa.Column('is_bot', sa.Boolean(), nullable=False),
+        sa.Column('first_name', sa.String(255), nullable=False),
+        sa.Column('last_name', sa.String(255)),
+        sa.Column('username', sa.String(255)),
+        sa.Column('language_code', sa.String(10)),
+        sa.Column('is_premium', sa.Boolean()),
+        sa.Column('created_on', sa.TIMESTAMP(timezone=True), server_default=sa.func.now()),
+        sa.Column('is_banned', sa.Boolean(), nullable=False),
+        sa.Column('pk_bot', sa.Integer()),
+        sa.Column('channel', sa.String(100)),
+    )
+
+    op.create_table(
+        'tbl_200_messages',
+        sa.Column('pk_messages', sa.Integer(), primary_key=True),
+        sa.Column('channel', sa.String(100)),
+        sa.Column('bot_id', sa.BigInteger(), nullable=False),
+        sa.Column('chat_id', sa.BigInteger()),
+        sa.Column('user_id', sa.BigInteger()),
+        sa.Column('type', sa.String(100)),
+        sa.Column('role', sa.String(100)),
+        sa.Column('content_text', sa.String(4000)),
+        sa.Column('file_id', sa.String(4000)),
+        sa.Column('message_date', sa.DateTime()),
+        sa.Column('update_id', sa.BigInteger()),
+        sa.Column('message_id', sa.BigInteger()),
+        sa.Column('is_processed', sa.String(1)),
+        sa.Column('is_reset', sa.String(1)),
+        sa.Column('created_by', sa.String(1000)),
+        sa.Column('created_on', sa.DateTime()),
+        sa.Column('updated_by', sa.String(1000)),
+        sa.Column('updated_on', sa.DateTime()),
+    )
+    op.create_index('ix_tbl_200_messages_pk_messages', 'tbl_200_messages', ['pk_messages'])
+
+    op.create_table(
+        'tbl_300_awaiting_user_input',
+        sa.Column('pk_user_status', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('channel', sa.String(100)),
+        sa.Column('bot_id', sa.BigInteger()),
+        sa.Column('user_id', sa.BigInteger()),
+        sa.Column('chat_id', sa.BigInteger()),
+        sa.Column('awaiting_type', sa.String(100)),
+        sa.Column('status', sa.String(100)),
+    )
+
+    op.create_table(
+        'tbl_400_payments',
+        sa.Column('pk_payment', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('update_id', sa.BigInteger(), nullable=False),
+        sa.Column('message_id', sa.BigInteger(), nullable=False),
+        sa.Column('user_id', sa.BigInteger(), nullable=False),
+        sa.Column('user_is_bot', sa.Boolean()),
+        sa.Column('user_first_name', sa.String(100)),
+        sa.Column('user_language_code', sa.String(10)),
+        sa.Column('chat_id', sa.BigInteger(), nullable=False),
+        sa.Column('chat_first_name', sa.String(100)),
+        sa.Column('chat_type', sa.String(50), nullable=False),
+        sa.Column('payment_date', sa.DateTime()),
+        sa.Column('currency', sa.String(10)),
+        sa.Column('total_amount', sa.DECIMAL(precision=10, scale=2)),
+        sa.Column('invoice_payload', sa.String(4000)),
+        sa.Column('telegram_payment_charge_id', sa.String(400)),
+        sa.Column('provider_payment_charge_id', sa.String(400)),
+        sa.Column('created_on', sa.DateTime()),
+        sa.Column('updated_on', sa.DateTime()),
+    )
+
+    op.create_table(
+        'tbl_450_user_credits',
+        sa.Column('pk_credit', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('channel', sa.String(100)),
+        sa.Column('pk_bot', sa.BigInteger(), nullable=False),
+        sa.Column('user_id', sa.BigInteger(), nullable=False),
+        sa.Column('chat_id', sa.BigInteger(), nullable=False),
+        sa.Column('credits', sa.DECIMAL(precision=10, scale=2)),
+        sa.Column('transaction_type', sa.String(100)),
+        sa.Column('transaction_date', sa.DateTime()),
+        sa.Column('pk_payment', sa.BigInteger()),
+        sa.Column('total_credits', sa.DECIMAL(precision=10, scale=2)),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('tbl_450_user_credits')
+    op.drop_table('tbl_400_payments')
+    op.drop_table('tbl_300_awaiting_user_input')
+    op.drop_index('ix_tbl_200_messages_pk_messages', table_name='tbl_200_messages')
+    op.drop_table('tbl_200_messages')
+    op.drop_table('tbl_150_user_info')
+    op.drop_index('ix_tbl_100_telegram_config_pk_bot', table_name='tbl_100_telegram_config')
+    op.drop_table('tbl_100_telegram_config')
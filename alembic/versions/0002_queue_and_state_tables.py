@@ -0,0 +1,88 @@
+"""job queue, update dedup, balances, chat resets and chat activity
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 09:10:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'tbl_110_processed_updates',
+        sa.Column('bot_short_name', sa.String(100), nullable=False),
+        sa.Column('update_id', sa.BigInteger(), nullable=False),
+        sa.Column('received_on', sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now()),
+        sa.PrimaryKeyConstraint('bot_short_name', 'update_id', name='pk_110_processed_updates'),
+    )
+    op.create_index('ix_110_processed_updates_received_on', 'tbl_110_processed_updates', ['received_on'])
+
+    op.create_table(
+        'tbl_210_chat_resets',
+        sa.Column('bot_id', sa.BigInteger(), nullable=False),
+        sa.Column('chat_id', sa.BigInteger(), nullable=False),
+        sa.Column('reset_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('bot_id', 'chat_id', name='pk_210_chat_resets'),
+    )
+
+    op.create_table(
+        'tbl_230_chat_activity',
+        sa.Column('bot_id', sa.BigInteger(), nullable=False),
+        sa.Column('chat_id', sa.BigInteger(), nullable=False),
+        sa.Column('user_id', sa.BigInteger()),
+        sa.Column('last_activity_at', sa.DateTime(), nullable=False),
+        sa.Column('reengage_due_at', sa.DateTime()),
+        sa.PrimaryKeyConstraint('bot_id', 'chat_id', name='pk_230_chat_activity'),
+    )
+    op.create_index('ix_230_chat_activity_due', 'tbl_230_chat_activity', ['reengage_due_at'],
+                    postgresql_where=sa.text("reengage_due_at IS NOT NULL"))
+
+    op.create_table(
+        'tbl_460_user_balances',
+        sa.Column('pk_bot', sa.BigInteger(), nullable=False),
+        sa.Column('user_id', sa.BigInteger(), nullable=False),
+        sa.Column('total_credits', sa.DECIMAL(precision=10, scale=2), nullable=False),
+        sa.Column('updated_on', sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now()),
+        sa.PrimaryKeyConstraint('pk_bot', 'user_id', name='pk_460_user_balances'),
+    )
+
+    op.create_table(
+        'tbl_500_jobs',
+        sa.Column('pk_job', sa.BigInteger(), primary_key=True, autoincrement=True),
+        sa.Column('job_type', sa.String(100), nullable=False),
+        sa.Column('bot_id', sa.BigInteger(), nullable=False),
+        sa.Column('chat_id', sa.BigInteger(), nullable=False),
+        sa.Column('payload', postgresql.JSONB(), nullable=False),
+        sa.Column('status', sa.String(20), nullable=False),
+        sa.Column('priority', sa.Integer(), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('max_attempts', sa.Integer(), nullable=False),
+        sa.Column('run_at', sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now()),
+        sa.Column('locked_by', sa.String(200)),
+        sa.Column('locked_until', sa.DateTime(timezone=True)),
+        sa.Column('last_error', sa.String(4000)),
+        sa.Column('created_on', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column('updated_on', sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_index('ix_500_jobs_claim', 'tbl_500_jobs', ['priority', 'pk_job'],
+                    postgresql_where=sa.text("status = 'QUEUED'"))
+    op.create_index('ix_500_jobs_chat', 'tbl_500_jobs', ['bot_id', 'chat_id', 'status'])
+
+
+def downgrade() -> None:
+    op.drop_table('tbl_500_jobs')
+    op.drop_table('tbl_460_user_balances')
+    op.drop_table('tbl_230_chat_activity')
+    op.drop_table('tbl_210_chat_resets')
+    op.drop_table('tbl_110_processed_updates')
@@ -0,0 +1,63 @@
+"""indexes for the hot queries and the unique keys the upserts rely on
+
+The indexes on the two large tables (messages and the credit ledger) are built
+CONCURRENTLY so the upgrade does not block webhook traffic.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 09:20:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # The user upsert needs (id, pk_bot, channel) to be unique; keep the oldest row of any duplicates
+    op.execute("""
+        DELETE FROM tbl_150_user_info newer
+        USING tbl_150_user_info older
+        WHERE newer.id = older.id
+          AND newer.pk_bot IS NOT DISTINCT FROM older.pk_bot
+          AND newer.channel IS NOT DISTINCT FROM older.channel
+          AND newer.pk_user_id > older.pk_user_id
+    """)
+    op.create_index('ux_150_user_info_user', 'tbl_150_user_info', ['id', 'pk_bot', 'channel'],
+                    unique=True, if_not_exists=True)
+
+    # get_bot_config_by_short_name_full reads one_or_none(), a duplicate short name is a bug
+    op.create_index('ux_100_telegram_config_short_name', 'tbl_100_telegram_config', ['bot_short_name'],
+                    unique=True, if_not_exists=True)
+
+    # Pending awaiting state per chat, read with every user context
+    op.create_index('ix_300_awaiting_pending', 'tbl_300_awaiting_user_input', ['chat_id', 'awaiting_type'],
+                    postgresql_where=sa.text("status = 'AWAITING'"), if_not_exists=True)
+
+    with op.get_context().autocommit_block():
+        # Conversation history of a (bot, chat) in date order
+        op.create_index('ix_200_messages_history', 'tbl_200_messages', ['bot_id', 'chat_id', 'message_date'],
+                        postgresql_concurrently=True, if_not_exists=True)
+        # Messages still waiting for process_queue, a small fraction of the table
+        op.create_index('ix_200_messages_unprocessed', 'tbl_200_messages', ['chat_id', 'message_date'],
+                        postgresql_where=sa.text("is_processed = 'N'"), postgresql_concurrently=True, if_not_exists=True)
+        # Latest ledger row per (user, bot), seeds tbl_460_user_balances
+        op.create_index('ix_450_user_credits_latest', 'tbl_450_user_credits', ['user_id', 'pk_bot', sa.text('pk_credit DESC')],
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_450_user_credits_latest', table_name='tbl_450_user_credits', postgresql_concurrently=True)
+        op.drop_index('ix_200_messages_unprocessed', table_name='tbl_200_messages', postgresql_concurrently=True)
+        op.drop_index('ix_200_messages_history', table_name='tbl_200_messages', postgresql_concurrently=True)
+    op.drop_index('ix_300_awaiting_pending', table_name='tbl_300_awaiting_user_input')
+    op.drop_index('ux_100_telegram_config_short_name', table_name='tbl_100_telegram_config')
+    op.drop_index('ux_150_user_info_user', table_name='tbl_150_user_info')
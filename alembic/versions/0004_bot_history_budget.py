@@ -0,0 +1,27 @@
+"""per-bot character budget of the conversation history sent to the LLM
+
+NULL keeps the HISTORY_BUDGET_CHARS default.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 11:05:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '0004'
+down_revision: Union[str, None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('tbl_100_telegram_config', sa.Column('bot_history_budget_chars', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('tbl_100_telegram_config', 'bot_history_budget_chars')
@@ -0,0 +1,158 @@
+"""monthly range partitions for tbl_200_messages and the tbl_205 message archive
+
+The existing rows are not copied. The old table becomes the partition holding
+everything before the cutover month, attached behind a validated CHECK
+constraint so that neither SET NOT NULL nor ATTACH PARTITION has to scan it under
+an exclusive lock. Later months get their own partitions, created ahead of time
+by app/utils/message_archive.py, which also drains the old partition into the archive.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17 14:10:00
+
+"""
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '0005'
+down_revision: Union[str, None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+PARTITIONS_AHEAD = 3
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def upgrade() -> None:
+    # Messages keep arriving during the upgrade, so the old table covers up to the start of
+    # next month, or of the month after when the upgrade runs on the last day of a month
+    now = datetime.utcnow()
+    cutover = add_months(datetime(now.year, now.month, 1), 1)
+    if (cutover - now).days < 1:
+        cutover = add_months(cutover, 1)
+
+    # Range partitions have no room for a NULL key
+    op.execute("UPDATE tbl_200_messages SET message_date = coalesce(created_on, updated_on, '1970-01-01') "
+               "WHERE message_date IS NULL")
+
+    with op.get_context().autocommit_block():
+        op.create_index('ux_200_messages_p_legacy_pk', 'tbl_200_messages', ['pk_messages', 'message_date'],
+                        unique=True, postgresql_concurrently=True, if_not_exists=True)
+        op.execute(f"ALTER TABLE tbl_200_messages ADD CONSTRAINT ck_200_messages_p_legacy_range "
+                   f"CHECK (message_date IS NOT NULL AND message_date < '{cutover:%Y-%m-%d}') NOT VALID")
+        # VALIDATE only takes SHARE UPDATE EXCLUSIVE, writes go on while it scans
+        op.execute("ALTER TABLE tbl_200_messages VALIDATE CONSTRAINT ck_200_messages_p_legacy_range")
+
+    # From here on every statement is catalog-only, the swap holds its locks for milliseconds
+    op.rename_table('tbl_200_messages', 'tbl_200_messages_p_legacy')
+    op.execute("ALTER INDEX ix_200_messages_history RENAME TO ix_200_messages_p_legacy_history")
+    op.execute("ALTER INDEX ix_200_messages_unprocessed RENAME TO ix_200_messages_p_legacy_unprocessed")
+    op.execute("ALTER INDEX ix_tbl_200_messages_pk_messages RENAME TO ix_200_messages_p_legacy_pk_messages")
+    op.execute("ALTER TABLE tbl_200_messages_p_legacy ALTER COLUMN message_date SET NOT NULL")
+    op.execute("ALTER TABLE tbl_200_messages_p_legacy DROP CONSTRAINT tbl_200_messages_pkey")
+    op.execute("ALTER TABLE tbl_200_messages_p_legacy ADD CONSTRAINT tbl_200_messages_p_legacy_pkey "
+               "PRIMARY KEY USING INDEX ux_200_messages_p_legacy_pk")
+
+    op.create_table(
+        'tbl_200_messages',
+        sa.Column('pk_messages', sa.Integer(), nullable=False,
+                  server_default=sa.text("nextval('tbl_200_messages_pk_messages_seq')")),
+        sa.Column('channel', sa.String(100)),
+        sa.Column('bot_id', sa.BigInteger(), nullable=False),
+        sa.Column('chat_id', sa.BigInteger()),
+        sa.Column('user_id', sa.BigInteger()),
+        sa.Column('type', sa.String(100)),
+        sa.Column('role', sa.String(100)),
+        sa.Column('content_text', sa.String(4000)),
+        sa.Column('file_id', sa.String(4000)),
+        sa.Column('message_date', sa.DateTime(), nullable=False),
+        sa.Column('update_id', sa.BigInteger()),
+        sa.Column('message_id', sa.BigInteger()),
+        sa.Column('is_processed', sa.String(1)),
+        sa.Column('is_reset', sa.String(1)),
+        sa.Column('created_by', sa.String(1000)),
+        sa.Column('created_on', sa.DateTime()),
+        sa.Column('updated_by', sa.String(1000)),
+        sa.Column('updated_on', sa.DateTime()),
+        sa.PrimaryKeyConstraint('pk_messages', 'message_date', name='tbl_200_messages_pkey'),
+        postgresql_partition_by='RANGE (message_date)',
+    )
+    op.execute("ALTER SEQUENCE tbl_200_messages_pk_messages_seq OWNED BY tbl_200_messages.pk_messages")
+    op.execute(f"ALTER TABLE tbl_200_messages ATTACH PARTITION tbl_200_messages_p_legacy "
+               f"FOR VALUES FROM (MINVALUE) TO ('{cutover:%Y-%m-%d}')")
+    op.execute("ALTER TABLE tbl_200_messages_p_legacy DROP CONSTRAINT ck_200_messages_p_legacy_range")
+
+    for months in range(PARTITIONS_AHEAD):
+        start = add_months(cutover, months)
+        op.execute(f"CREATE TABLE tbl_200_messages_p{start:%Y%m} PARTITION OF tbl_200_messages "
+                   f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{add_months(start, 1):%Y-%m-%d}')")
+
+    # Created on the parent these adopt the renamed indexes of the old table and build
+    # on the new, empty partitions
+    op.create_index('ix_tbl_200_messages_pk_messages', 'tbl_200_messages', ['pk_messages'])
+    op.create_index('ix_200_messages_history', 'tbl_200_messages', ['bot_id', 'chat_id', 'message_date'])
+    op.create_index('ix_200_messages_unprocessed', 'tbl_200_messages', ['chat_id', 'message_date'],
+                    postgresql_where=sa.text("is_processed = 'N'"))
+
+    op.create_table(
+        'tbl_205_messages_archive',
+        sa.Column('pk_messages', sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column('channel', sa.String(100)),
+        sa.Column('bot_id', sa.BigInteger(), nullable=False),
+        sa.Column('chat_id', sa.BigInteger()),
+        sa.Column('user_id', sa.BigInteger()),
+        sa.Column('type', sa.String(100)),
+        sa.Column('role', sa.String(100)),
+        sa.Column('content_text', sa.String(4000)),
+        sa.Column('file_id', sa.String(4000)),
+        sa.Column('message_date', sa.DateTime(), nullable=False),
+        sa.Column('update_id', sa.BigInteger()),
+        sa.Column('message_id', sa.BigInteger()),
+        sa.Column('is_processed', sa.String(1)),
+        sa.Column('is_reset', sa.String(1)),
+        sa.Column('created_by', sa.String(1000)),
+        sa.Column('created_on', sa.DateTime()),
+        sa.Column('updated_by', sa.String(1000)),
+        sa.Column('updated_on', sa.DateTime()),
+        sa.Column('archived_on', sa.DateTime(), nullable=False, server_default=sa.func.now()),
+    )
+    op.create_index('ix_205_messages_archive_chat', 'tbl_205_messages_archive', ['bot_id', 'chat_id', 'message_date'])
+    # Compress rows from 128 bytes up instead of the default 2 kB, with lz4 where the server has it
+    op.execute("ALTER TABLE tbl_205_messages_archive SET (toast_tuple_target = 128)")
+    op.execute("""
+        DO $$
+        BEGIN
+            IF current_setting('server_version_num')::int >= 140000 THEN
+                EXECUTE 'ALTER TABLE tbl_205_messages_archive ALTER COLUMN content_text SET COMPRESSION lz4';
+            END IF;
+        EXCEPTION WHEN OTHERS THEN
+            RAISE NOTICE 'lz4 unavailable, tbl_205_messages_archive keeps pglz';
+        END
+        $$
+    """)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_205_messages_archive_chat', table_name='tbl_205_messages_archive')
+    op.drop_table('tbl_205_messages_archive')
+
+    op.execute("ALTER TABLE tbl_200_messages DETACH PARTITION tbl_200_messages_p_legacy")
+    op.execute("INSERT INTO tbl_200_messages_p_legacy SELECT * FROM tbl_200_messages")
+    op.execute("ALTER SEQUENCE tbl_200_messages_pk_messages_seq OWNED BY tbl_200_messages_p_legacy.pk_messages")
+    op.drop_table('tbl_200_messages')
+
+    op.rename_table('tbl_200_messages_p_legacy', 'tbl_200_messages')
+    op.execute("ALTER TABLE tbl_200_messages DROP CONSTRAINT tbl_200_messages_p_legacy_pkey")
+    op.execute("ALTER TABLE tbl_200_messages ADD CONSTRAINT tbl_200_messages_pkey PRIMARY KEY (pk_messages)")
+    op.execute("ALTER TABLE tbl_200_messages ALTER COLUMN message_date DROP NOT NULL")
+    op.execute("ALTER INDEX ix_200_messages_p_legacy_history RENAME TO ix_200_messages_history")
+    op.execute("ALTER INDEX ix_200_messages_p_legacy_unprocessed RENAME TO ix_200_messages_unprocessed")
+    op.execute("ALTER INDEX ix_200_messages_p_legacy_pk_messages RENAME TO ix_tbl_200_messages_pk_messages")
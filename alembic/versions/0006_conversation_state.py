@@ -0,0 +1,58 @@
+"""one tbl_300_awaiting_user_input row per (bot, chat) with an expiry
+
+The table held a row per request ever made, PROCESSED ones included. It now holds
+the state of the chats that are not IDLE (AWAITING or GENERATING) and rows are
+deleted when the conversation goes back to IDLE or expires_at passes.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17 16:30:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '0006'
+down_revision: Union[str, None] = '0005'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# CONVERSATION_AWAITING_TTL_SECONDS at the time of the upgrade
+AWAITING_TTL_SECONDS = 900
+
+
+def upgrade() -> None:
+    op.execute("DELETE FROM tbl_300_awaiting_user_input WHERE status IS DISTINCT FROM 'AWAITING'")
+    # Keep the newest pending request of each chat, AUDIO first as awaiting_type_query did
+    op.execute("""
+        DELETE FROM tbl_300_awaiting_user_input doomed
+        USING (
+            SELECT pk_user_status, row_number() OVER (
+                PARTITION BY bot_id, chat_id
+                ORDER BY awaiting_type = 'AUDIO' DESC, pk_user_status DESC
+            ) AS position
+            FROM tbl_300_awaiting_user_input
+        ) ranked
+        WHERE doomed.pk_user_status = ranked.pk_user_status AND ranked.position > 1
+    """)
+
+    op.add_column('tbl_300_awaiting_user_input', sa.Column('expires_at', sa.DateTime(), nullable=True))
+    op.add_column('tbl_300_awaiting_user_input',
+                  sa.Column('updated_on', sa.DateTime(), nullable=True, server_default=sa.func.now()))
+    # Requests pending at the upgrade get a full TTL from now; expiries are stored in UTC like message_date
+    op.execute(f"UPDATE tbl_300_awaiting_user_input SET expires_at = timezone('utc', now()) + interval '{AWAITING_TTL_SECONDS} seconds'")
+
+    op.drop_index('ix_300_awaiting_pending', table_name='tbl_300_awaiting_user_input', if_exists=True)
+    op.create_index('ux_300_awaiting_chat', 'tbl_300_awaiting_user_input', ['bot_id', 'chat_id'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ux_300_awaiting_chat', table_name='tbl_300_awaiting_user_input')
+    op.execute("DELETE FROM tbl_300_awaiting_user_input WHERE status <> 'AWAITING'")
+    op.create_index('ix_300_awaiting_pending', 'tbl_300_awaiting_user_input', ['chat_id', 'awaiting_type'],
+                    postgresql_where=sa.text("status = 'AWAITING'"))
+    op.drop_column('tbl_300_awaiting_user_input', 'updated_on')
+    op.drop_column('tbl_300_awaiting_user_input', 'expires_at')
@@ -0,0 +1,81 @@
+"""bot_id leads ix_200_messages_unprocessed
+
+process_queue reads the unprocessed messages of a (bot, chat); the partial index only
+had chat_id and message_date, so a chat shared by several bots scanned all of them.
+
+A plain CREATE INDEX on the partitioned table would scan every partition, the large
+legacy one included, under a SHARE lock that blocks inserts. So the new index is built
+CONCURRENTLY on each partition, tied together under an index created ON ONLY the parent,
+and the old index is dropped only once the new one is valid, which keeps process_queue
+indexed throughout.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17 21:00:00
+
+"""
+from typing import List, Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+revision: str = '0007'
+down_revision: Union[str, None] = '0006'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEX = 'ix_200_messages_unprocessed'
+PREDICATE = "is_processed = 'N'"
+
+
+def partitions() -> List[str]:
+    if context.is_offline_mode():
+        # CREATE INDEX CONCURRENTLY cannot run in a DO block either, so there is no static script
+        raise RuntimeError("0007 builds an index per partition of tbl_200_messages and needs a live database, "
+                           "it cannot be rendered with --sql")
+    return op.get_bind().execute(sa.text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'tbl_200_messages'::regclass ORDER BY c.relname"
+    )).scalars().all()
+
+
+def partition_index(partition: str, suffix: str = '') -> str:
+    # tbl_200_messages_p202611 -> ix_200_messages_p202611_unprocessed, as 0005 named the legacy one
+    return f"ix_200_messages_{partition[len('tbl_200_messages_'):]}_unprocessed{suffix}"
+
+
+def rebuild(columns: str) -> None:
+    """Replaces INDEX with one on columns, without a lock that blocks writes for longer than a catalog update."""
+    building = f"{INDEX}_new"
+    with op.get_context().autocommit_block():
+        for partition in partitions():
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {partition_index(partition, '_new')}")
+            op.execute(f"CREATE INDEX CONCURRENTLY {partition_index(partition, '_new')} "
+                       f"ON {partition} ({columns}) WHERE {PREDICATE}")
+
+    # Catalog-only from here: the parent index is created invalid and becomes valid
+    # once every partition has its index attached
+    op.execute(f"CREATE INDEX {building} ON ONLY tbl_200_messages ({columns}) WHERE {PREDICATE}")
+    for partition in partitions():
+        op.execute(f"ALTER INDEX {building} ATTACH PARTITION {partition_index(partition, '_new')}")
+    valid = op.get_bind().execute(sa.text(
+        "SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"
+    ), {"name": building}).scalar_one()
+    if not valid:
+        raise RuntimeError(f"{building} is missing a partition's index, a partition was added during the upgrade")
+
+    # Partitioned indexes cannot be dropped CONCURRENTLY; with the data already indexed
+    # the drop and the renames only hold the table's lock for the catalog update
+    op.drop_index(INDEX, table_name='tbl_200_messages')
+    op.execute(f"ALTER INDEX {building} RENAME TO {INDEX}")
+    for partition in partitions():
+        op.execute(f"ALTER INDEX {partition_index(partition, '_new')} RENAME TO {partition_index(partition)}")
+
+
+def upgrade() -> None:
+    rebuild('bot_id, chat_id, message_date')
+
+
+def downgrade() -> None:
+    rebuild('chat_id, message_date')
@@ -25,20 +25,137 @@ B2_APPLICATION_KEY_ID = os.getenv("B2_APPLICATION_KEY_ID")
 B2_APPLICATION_KEY = os.getenv("B2_APPLICATION_KEY")
 B2_BUCKET_NAME = os.getenv("B2_BUCKET_NAME")
 
+# Webhook ingestion: "queue" acknowledges Telegram immediately and hands the update
+# to the in-process worker pool, "inline" processes it before responding.
+WEBHOOK_INGEST_MODE = os.getenv("WEBHOOK_INGEST_MODE", "queue")
+UPDATE_QUEUE_MAXSIZE = int(os.getenv("UPDATE_QUEUE_MAXSIZE", "1000"))
+UPDATE_QUEUE_WORKERS = int(os.getenv("UPDATE_QUEUE_WORKERS", "8"))
 
-import logging
+# Durable job queue (tbl_500_jobs) shared by every process connected to the database
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "120"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "5"))
+JOB_RETRY_MAX_SECONDS = float(os.getenv("JOB_RETRY_MAX_SECONDS", "300"))
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", "10"))
+PROCESS_QUEUE_DEBOUNCE_SECONDS = float(os.getenv("PROCESS_QUEUE_DEBOUNCE_SECONDS", "3"))
 
-logger = logging.getLogger(__name__)
+# Telegram redelivers an update_id when we answer slowly, these bound the dedup layer
+UPDATE_DEDUP_CACHE_SIZE = int(os.getenv("UPDATE_DEDUP_CACHE_SIZE", "10000"))
+UPDATE_DEDUP_RETENTION_HOURS = int(os.getenv("UPDATE_DEDUP_RETENTION_HOURS", "48"))
 
-bot_config = {
-    "bot_id": None,
-    "bot_token": None,
-    "bot_short_name": None,
-    "bot_voice_id": None,
-    "bot_assistant_prompt": None,
-    "bot_greeting_msg": None
-}
+# Bot configs are cached per process; NOTIFY eiei_bot_config or the admin endpoint invalidates them early
+BOT_CONFIG_TTL_SECONDS = float(os.getenv("BOT_CONFIG_TTL_SECONDS", "300"))
+BOT_CONFIG_NEGATIVE_TTL_SECONDS = float(os.getenv("BOT_CONFIG_NEGATIVE_TTL_SECONDS", "30"))
 
-def initialize_bot_config(bot_config_data):
-    bot_config.update(bot_config_data)
-    logger.debug(f"Initialized bot_config succesfully")
\ No newline at end of file
+# Re-engagement of idle chats, driven by tbl_230_chat_activity
+AUTO_REPLY_IDLE_MINUTES = int(os.getenv("AUTO_REPLY_IDLE_MINUTES", "1440"))
+AUTO_REPLY_BATCH_SIZE = int(os.getenv("AUTO_REPLY_BATCH_SIZE", "100"))
+AUTO_REPLY_MAX_SLEEP_SECONDS = float(os.getenv("AUTO_REPLY_MAX_SLEEP_SECONDS", "300"))
+KEEP_ALIVE_INTERVAL_SECONDS = float(os.getenv("KEEP_ALIVE_INTERVAL_SECONDS", "30"))
+# Re-engagements are fed in-process at the lowest priority and spread over a window.
+# AUTO_REPLY_CONCURRENCY caps the synthetic updates being ingested at once, not the replies:
+# those run later as process_queue jobs at JOB_PRIORITY_BACKGROUND, so JOB_WORKERS bounds
+# how many LLM calls they make concurrently
+AUTO_REPLY_SPREAD_SECONDS = float(os.getenv("AUTO_REPLY_SPREAD_SECONDS", "60"))
+AUTO_REPLY_CONCURRENCY = int(os.getenv("AUTO_REPLY_CONCURRENCY", "4"))
+
+# Conversation history sent to the LLM: read newest first in pages until the character
+# budget (tbl_100_telegram_config.bot_history_budget_chars, or this default) is spent
+HISTORY_BUDGET_CHARS = int(os.getenv("HISTORY_BUDGET_CHARS", "8192"))
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "50"))
+# Recent turns per (bot, chat) kept in memory and written through by this process's
+# message writes. Off by default: the job queue hands a chat's jobs to any worker process,
+# whose cache then misses writes made elsewhere. Only enable it (e.g. 33554432 for 32MB)
+# when a single process both ingests updates and runs every job
+HISTORY_CACHE_MAX_BYTES = int(os.getenv("HISTORY_CACHE_MAX_BYTES", "0"))
+HISTORY_CACHE_CHAT_TURNS = int(os.getenv("HISTORY_CACHE_CHAT_TURNS", "200"))
+
+# tbl_200_messages is partitioned by month; app/utils/message_archive.py keeps partitions
+# created ahead and moves reset or aged-out rows to tbl_205_messages_archive
+MESSAGE_PARTITIONS_AHEAD = int(os.getenv("MESSAGE_PARTITIONS_AHEAD", "3"))
+MESSAGE_ARCHIVE_AFTER_DAYS = int(os.getenv("MESSAGE_ARCHIVE_AFTER_DAYS", "180"))
+MESSAGE_ARCHIVE_BATCH_SIZE = int(os.getenv("MESSAGE_ARCHIVE_BATCH_SIZE", "1000"))
+MESSAGE_ARCHIVE_PAUSE_SECONDS = float(os.getenv("MESSAGE_ARCHIVE_PAUSE_SECONDS", "0.1"))
+MESSAGE_ARCHIVE_INTERVAL_SECONDS = float(os.getenv("MESSAGE_ARCHIVE_INTERVAL_SECONDS", "21600"))
+# Unprocessed messages older than this are not picked up again, which keeps the lookup on the newest partitions
+MESSAGE_UNPROCESSED_LOOKBACK_HOURS = int(os.getenv("MESSAGE_UNPROCESSED_LOOKBACK_HOURS", "48"))
+
+# Connection pools (app/database.py): the web pool serves webhook traffic, the background
+# pool job workers, schedulers, maintenance and the LISTEN connections
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "0"))
+DB_BACKGROUND_POOL_SIZE = int(os.getenv("DB_BACKGROUND_POOL_SIZE", "8"))
+DB_BACKGROUND_MAX_OVERFLOW = int(os.getenv("DB_BACKGROUND_MAX_OVERFLOW", "4"))
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "30"))
+DB_POOL_RECYCLE_SECONDS = int(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+# Prepared statements cached per connection by the asyncpg dialect; 0 behind a transaction-mode pgbouncer
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+
+# Optional read replica. Bot configs, balances, awaiting states and conversation history are
+# read from it unless this process wrote the same chat or user within REPLICA_MAX_LAG_SECONDS.
+# Two local instances with streaming replication are enough to try it out.
+SQLALCHEMY_REPLICA_URL = os.getenv("SQLALCHEMY_REPLICA_URL")
+DB_REPLICA_POOL_SIZE = int(os.getenv("DB_REPLICA_POOL_SIZE", "10"))
+DB_REPLICA_MAX_OVERFLOW = int(os.getenv("DB_REPLICA_MAX_OVERFLOW", "0"))
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5"))
+
+# Conversation state per (bot, chat) in tbl_300_awaiting_user_input, see
+# app/utils/conversation_state.py. A request for audio or a photo is dropped when the user
+# does not answer within the awaiting TTL; a generation that never finishes frees the chat
+# after the generating TTL. Expired rows are deleted every purge interval.
+CONVERSATION_AWAITING_TTL_SECONDS = int(os.getenv("CONVERSATION_AWAITING_TTL_SECONDS", "900"))
+CONVERSATION_GENERATING_TTL_SECONDS = int(os.getenv("CONVERSATION_GENERATING_TTL_SECONDS", "600"))
+CONVERSATION_STATE_PURGE_INTERVAL_SECONDS = float(os.getenv("CONVERSATION_STATE_PURGE_INTERVAL_SECONDS", "600"))
+
+# Group commit of small background writes (message status flips, placeholder content,
+# ledger rows) in app/utils/write_batcher.py: a batch is flushed in one transaction once
+# WRITE_BATCH_MAX_ITEMS are queued or the oldest write has waited WRITE_BATCH_MAX_DELAY_MS
+WRITE_BATCH_MAX_ITEMS = int(os.getenv("WRITE_BATCH_MAX_ITEMS", "100"))
+WRITE_BATCH_MAX_DELAY_MS = float(os.getenv("WRITE_BATCH_MAX_DELAY_MS", "5"))
+
+# Outbound HTTP (app/utils/http_clients.py): one pooled client per upstream, connected at
+# startup. HTTP/2 is used for Telegram and OpenRouter when the h2 package is installed.
+HTTP_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("HTTP_KEEPALIVE_EXPIRY_SECONDS", "60"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() in ("1", "true", "yes")
+HTTP_WARMUP_ON_STARTUP = os.getenv("HTTP_WARMUP_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+TELEGRAM_HTTP_MAX_CONNECTIONS = int(os.getenv("TELEGRAM_HTTP_MAX_CONNECTIONS", "50"))
+OPENROUTER_HTTP_MAX_CONNECTIONS = int(os.getenv("OPENROUTER_HTTP_MAX_CONNECTIONS", "20"))
+OPENROUTER_READ_TIMEOUT_SECONDS = float(os.getenv("OPENROUTER_READ_TIMEOUT_SECONDS", "120"))
+
+# Text replies are streamed from OpenRouter and each sentence is sent to Telegram as soon as
+# it is complete; the buffered completion is used when this is off or the stream fails early
+COMPLETION_STREAMING = os.getenv("COMPLETION_STREAMING", "true").lower() in ("1", "true", "yes")
+
+# Completion targets behind send_payload_to_openrouter (app/utils/llm_router.py). LLM_TARGETS is a
+# JSON list of {"name", "url", "model", "token_env"}; when unset the OPENROUTER_* settings are the
+# only target. Targets failing more than LLM_TARGET_MAX_ERROR_RATE of their recent requests are
+# skipped for LLM_TARGET_COOLDOWN_SECONDS. With LLM_HEDGE_ENABLED a request still unanswered after
+# the p95 latency of its target (at least LLM_HEDGE_MIN_DELAY_SECONDS) is also sent to the next one
+LLM_TARGETS = os.getenv("LLM_TARGETS", "")
+LLM_ROUTER_WINDOW = int(os.getenv("LLM_ROUTER_WINDOW", "200"))
+LLM_ROUTER_EXPLORE_RATE = float(os.getenv("LLM_ROUTER_EXPLORE_RATE", "0.05"))
+LLM_TARGET_MAX_ERROR_RATE = float(os.getenv("LLM_TARGET_MAX_ERROR_RATE", "0.5"))
+LLM_TARGET_COOLDOWN_SECONDS = float(os.getenv("LLM_TARGET_COOLDOWN_SECONDS", "30"))
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")
+LLM_HEDGE_MIN_DELAY_SECONDS = float(os.getenv("LLM_HEDGE_MIN_DELAY_SECONDS", "2"))
+
+# Upstream retries (app/utils/resilience.py): exponential backoff with full jitter between attempts;
+# a circuit breaker per upstream fails calls fast for BREAKER_RECOVERY_SECONDS once
+# BREAKER_FAILURE_THRESHOLD calls in a row failed; retries of all upstreams together may add at
+# most RETRY_BUDGET_RATIO extra calls per first attempt, plus RETRY_BUDGET_MIN_PER_SECOND
+RETRY_BASE_DELAY_SECONDS = float(os.getenv("RETRY_BASE_DELAY_SECONDS", "0.5"))
+RETRY_MAX_DELAY_SECONDS = float(os.getenv("RETRY_MAX_DELAY_SECONDS", "30"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RECOVERY_SECONDS = float(os.getenv("BREAKER_RECOVERY_SECONDS", "30"))
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.2"))
+RETRY_BUDGET_MIN_PER_SECOND = float(os.getenv("RETRY_BUDGET_MIN_PER_SECOND", "1"))
+
+# Prompt caching (app/utils/prompt_cache.py): static prompt parts are sent first so the prefix is
+# the same on every call. Models starting with one of PROMPT_CACHE_BREAKPOINT_MODELS get
+# cache_control breakpoints once the prefix is PROMPT_CACHE_MIN_CHARS long (shorter prefixes are
+# not cached by those providers); the others cache stable prefixes by themselves
+PROMPT_CACHE_ENABLED = os.getenv("PROMPT_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+PROMPT_CACHE_BREAKPOINT_MODELS = [prefix.strip() for prefix in os.getenv("PROMPT_CACHE_BREAKPOINT_MODELS", "anthropic/,google/gemini").split(",") if prefix.strip()]
+PROMPT_CACHE_MIN_CHARS = int(os.getenv("PROMPT_CACHE_MIN_CHARS", "4000"))
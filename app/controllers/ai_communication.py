@@ -1,16 +1,16 @@
 # ./app/controllers/ai_communication.py
 from sqlalchemy.ext.asyncio import AsyncSession
 import httpx
+import json
 import logging
 import asyncio
 from app.models.message import tbl_msg
-from typing import Optional
-from app.config import OPENROUTER_TOKEN, OPENROUTER_MODEL, OPENROUTER_URL
+from app.database_operations import get_chat_history
+from typing import AsyncIterator, Optional
+from app.config import OPENROUTER_MODEL, HISTORY_BUDGET_CHARS
 from httpx import HTTPError
 from sqlalchemy.future import select
-from app.database_operations import get_bot_assistant_prompt 
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.util import get_remote_address
+from app.utils.bot_registry import BotContext
 from fastapi import Request, HTTPException
 from starlette.status import HTTP_429_TOO_MANY_REQUESTS
 from starlette.responses import PlainTextResponse
@@ -19,27 +19,24 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from app.database import get_db
 
 from app.utils.file_list_cache import get_cached_file_list
+from app.utils.http_clients import http_clients
+from app.utils.llm_router import llm_router
+from app.utils.prompt_cache import message, cacheable, prepare_payload, prompt_cache_stats
+from app.utils.resilience import call_with_retries, is_transient, CircuitOpenError
+from app.utils.job_queue import is_retryable
 
 # Create a logger
 logger = logging.getLogger(__name__)
 
-MAX_PAYLOAD_SIZE_CHARS = 8 * 1024
 MAX_TOKENS = 4024
 MAX_ATTEMPTS = 3
 
-limiter = Limiter(key_func=get_remote_address)
-
-@limiter.limit("10/10 seconds")
-async def send_payload_to_openrouter(api_payload: dict, request: Request) -> dict:
+async def send_payload_to_openrouter(api_payload: dict) -> dict:
     try:
         #logger.debug(f"Sending payload to OpenRouter: {api_payload}")
         logger.debug(f"Sending payload to OpenRouter")
-        logger.debug(f"OPENROUTER_MODEL: {OPENROUTER_MODEL}")
-        async with httpx.AsyncClient() as client:
-            response = await client.post(OPENROUTER_URL, json=api_payload, headers={"Authorization": f"Bearer {OPENROUTER_TOKEN}"})
-        response.raise_for_status()
-        logger.debug(f"Response received from OpenRouter: {response.text}")
-        response_data = response.json()
+        # The router picks the endpoint and model
+        response_data = await llm_router.complete(api_payload)
         logger.debug(f"Parsed response data: {response_data}")
         if (
             isinstance(response_data, dict)
@@ -66,6 +63,54 @@ async def send_payload_to_openrouter(api_payload: dict, request: Request) -> dic
         logger.error(f"Unexpected error in OpenRouter request: {str(e)}")
         raise
 
+async def stream_openrouter(api_payload: dict) -> AsyncIterator[str]:
+    """
+    Sends the payload with "stream": true and yields the content deltas as the
+    server-sent events arrive. Raises like send_payload_to_openrouter on HTTP errors.
+    """
+    # Not hedged and no failover (the buffered fallback has both); only the outcome is
+    # reported to the router, a stream's duration depends on the reply length
+    target = llm_router.pick()
+    breaker = llm_router.breaker(target)
+    if not breaker.allow():
+        raise CircuitOpenError(breaker.name)
+    # Usage arrives in a last chunk of its own
+    payload = {**prepare_payload(api_payload, target.model), "stream": True, "stream_options": {"include_usage": True}}
+    client = http_clients.get(target.client)
+    try:
+        async with client.stream("POST", target.url, json=payload, headers=llm_router.headers(target)) as response:
+            if response.status_code == HTTP_429_TOO_MANY_REQUESTS:
+                raise HTTPException(status_code=429, detail="Too Many Requests")
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                # Blank lines separate events; lines starting with ":" are keep-alive comments
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                if "error" in chunk:
+                    raise RuntimeError(f"OpenRouter stream error: {chunk['error']}")
+                if chunk.get("usage"):
+                    prompt_cache_stats.record(target.model, chunk["usage"])
+                choices = chunk.get("choices") or []
+                delta = choices[0].get("delta", {}).get("content") if choices else None
+                if delta:
+                    yield delta
+    except (asyncio.CancelledError, GeneratorExit):
+        breaker.release()
+        raise
+    except Exception as e:
+        llm_router.record(target, ok=False)
+        if is_transient(e):
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        raise
+    llm_router.record(target, ok=True)
+    breaker.record_success()
+
 async def rate_limit_exceeded_handler(request: Request, exc: HTTPException) -> PlainTextResponse:
     """Custom rate limit exceeded handler."""
     response = PlainTextResponse(str(exc.detail), status_code=exc.status_code)
@@ -73,54 +118,79 @@ async def rate_limit_exceeded_handler(request: Request, exc: HTTPException) -> P
     return response
 
 
-async def get_chat_completion(chat_id: int, bot_id: int, request: Request, db: AsyncSession = Depends(get_db)) -> Optional[str]:
-    
-    assistant_prompt = await get_bot_assistant_prompt(bot_id, db)
+def chat_completion_payload(assistant_prompt: str, messages: list) -> dict:
+    # The system prompt is the same on every call and the history only grows at its end, so
+    # both are prefixes the next call repeats; the newest turn marks where the next one can reuse
+    history = list(messages)
+    if history:
+        history[-1] = message(history[-1]["role"], cacheable(history[-1]["content"] or ""))
+    return {
+        "model": OPENROUTER_MODEL,
+        "max_tokens": MAX_TOKENS,
+        "temperature": 0.9,  # Encourages predictability with minimal variability
+        "top_p": 1,  # Keeps a broad token choice
+        "frequency_penalty": 0.7,  # Discourages frequent token repetition
+        "repetition_penalty": 1,  # Prevents input token repetition
+        "messages": [message("system", cacheable(assistant_prompt))] + history
+    }
+
+
+async def stream_chat_completion(bot: BotContext, chat_id: int, db: AsyncSession) -> AsyncIterator[str]:
+    """The reply of get_chat_completion as it is generated, in text deltas. A single attempt, errors are raised."""
+    if not bot.bot_assistant_prompt:
+        raise ValueError(f"No assistant prompt found for bot_id {bot.bot_id}")
+    messages = await get_chat_history(db, bot.bot_id, chat_id, bot.bot_history_budget_chars or HISTORY_BUDGET_CHARS)
+    async for delta in stream_openrouter(chat_completion_payload(bot.bot_assistant_prompt, messages)):
+        yield delta
+
+
+async def get_chat_completion(bot: BotContext, chat_id: int, db: AsyncSession = Depends(get_db),
+                              raise_retryable: bool = False) -> Optional[str]:
+    """
+    The bot's reply to the chat history, or None when it could not be had. With
+    raise_retryable, errors job_queue.is_retryable accepts (and open breakers) are raised
+    instead, for a job to run again later.
+    """
+    bot_id = bot.bot_id
+    assistant_prompt = bot.bot_assistant_prompt
     if not assistant_prompt:
         logger.error(f"No assistant prompt found for bot_id {bot_id}. Using default prompt.")
         return None
     
-    retries = 3
-    for attempt in range(retries + 1):
-        try:
-            messages = await db.execute(select(tbl_msg).filter(tbl_msg.chat_id == chat_id, tbl_msg.bot_id == bot_id, tbl_msg.is_processed != 'S', tbl_msg.is_reset != 'Y').order_by(tbl_msg.message_date))
-            messages = messages.scalars().all()
-
-            while len(str(messages)) > MAX_PAYLOAD_SIZE_CHARS:
-                messages.pop(0)
-
-            payload = {
-                "model": OPENROUTER_MODEL,
-                "max_tokens": MAX_TOKENS,
-                "temperature": 0.9,  # Encourages predictability with minimal variability
-                "top_p": 1,  # Keeps a broad token choice
-                "frequency_penalty": 0.7,  # Discourages frequent token repetition
-                "repetition_penalty": 1,  # Prevents input token repetition
-                "messages": [{"role": "system", "content": assistant_prompt}] + [{"role": message.role.lower(), "content": message.content_text} for message in messages]
-            }
-
-            response_data = await send_payload_to_openrouter(payload, request)
-
-            if isinstance(response_data, dict) and response_data.get("error") == "429":
-                return response_data  # Return the error response directly
-
-            if isinstance(response_data, dict) and "error" in response_data:
-                logger.error(f"Error in OpenRouter response: {response_data['error']}")
-                return None
-
-            response_text = response_data["choices"][0]["message"]["content"]
-            if response_text:
-                return response_text
-            elif attempt < retries:
-                await asyncio.sleep(60)
-
-        except asyncio.TimeoutError:
-            logger.error(f"get_chat_completion timed out for chat_id {chat_id}, attempt {attempt + 1}")
-        except Exception as e:
-            logger.error(f"Error in get_chat_completion: {str(e)}")
-    return None
+    try:
+        # Read once, the retries below only resend the same payload
+        messages = await get_chat_history(db, bot_id, chat_id, bot.bot_history_budget_chars or HISTORY_BUDGET_CHARS)
+        payload = chat_completion_payload(assistant_prompt, messages)
+        # The router fails over between targets and keeps a breaker for each of them
+        response_data = await call_with_retries(
+            "llm", lambda: send_payload_to_openrouter(payload),
+            attempts=MAX_ATTEMPTS, retry_result=is_empty_completion, with_breaker=False
+        )
+    except CircuitOpenError as e:
+        if raise_retryable:
+            raise
+        logger.error(f"get_chat_completion for chat_id {chat_id} not attempted: {e}")
+        return None
+    except Exception as e:
+        if raise_retryable and is_retryable(e):
+            raise
+        logger.error(f"Error in get_chat_completion: {str(e)}")
+        return None
+
+    if isinstance(response_data, dict) and "error" in response_data:
+        logger.error(f"Error in OpenRouter response: {response_data['error']}")
+        return None
+
+    return response_data["choices"][0]["message"]["content"] or None
+
+
+def is_empty_completion(response_data) -> bool:
+    """A well-formed answer without text; error answers are returned as they are."""
+    if not isinstance(response_data, dict) or "error" in response_data:
+        return False
+    return not response_data["choices"][0]["message"]["content"]
 
-async def get_photo_filename(requested_photo: str, request: Request) -> Optional[str]:
+async def get_photo_filename(requested_photo: str) -> Optional[str]:
     file_info = await get_cached_file_list()
     logger.debug(f"File info: {file_info}")
     
@@ -134,47 +204,41 @@ async def get_photo_filename(requested_photo: str, request: Request) -> Optional
         "top_p": 1,  # Keeps a broad token choice
         "frequency_penalty": 0.7,  # Discourages frequent token repetition
         "repetition_penalty": 1,  # Prevents input token repetition
-        "messages": [{"role": "system", "content": await construct_photo_finder_prompt(requested_photo, list_of_files)}]
+        "messages": [await construct_photo_finder_prompt(requested_photo, list_of_files)]
     }
 
-    for attempt in range(1, MAX_ATTEMPTS + 1):
-        try:
-            logger.debug(f"Attempt {attempt}: Sending payload to OpenRouter: {payload}")
-            response_data = await send_payload_to_openrouter(payload, request)
-            logger.debug(f"Attempt {attempt}: Response received from OpenRouter: {response_data}")
-            
-            choices = response_data.get("choices", [])
-            logger.debug(f"Attempt {attempt}: Choices: {choices}")
-            
-            if choices:
-                message = choices[0].get("message", {})
-                logger.debug(f"Attempt {attempt}: Message: {message}")
-                
-                content = message.get("content", "").strip().replace(" ", "_")
-                logger.debug(f"Attempt {attempt}: Content: {content}")
-                
-                if content:
-                    logger.debug(f"Attempt {attempt}: Received valid response")
-                    return content
-                else:
-                    logger.warning(f"Attempt {attempt}: Received empty content. Retrying...")
-            else:
-                logger.warning(f"Attempt {attempt}: No choices in response. Retrying...")
-            
-            await asyncio.sleep(1)
-
-        except HTTPError:
-            return None
-    
+    def file_name(response_data) -> str:
+        choices = response_data.get("choices", [])
+        message = choices[0].get("message", {}) if choices else {}
+        return (message.get("content") or "").strip().replace(" ", "_")
+
+    try:
+        logger.debug(f"Sending payload to OpenRouter: {payload}")
+        response_data = await call_with_retries(
+            "llm", lambda: send_payload_to_openrouter(payload),
+            attempts=MAX_ATTEMPTS, retry_result=lambda data: not file_name(data), with_breaker=False
+        )
+    except (HTTPError, CircuitOpenError) as e:
+        logger.error(f"Photo file name lookup failed: {e}")
+        return None
+
+    content = file_name(response_data)
+    if content:
+        logger.debug(f"Received valid response: {content}")
+        return content
     logger.error("Failed to receive a valid response after maximum attempts.")
     return None
 
-async def construct_photo_finder_prompt(requested_photo: str, file_list: str) -> str:
-    """Constructs and returns a prompt string for the photo finder."""
+async def construct_photo_finder_prompt(requested_photo: str, file_list: str) -> dict:
+    """
+    Constructs the system message for the photo finder. The instructions and the file list
+    are the same for every request until the file list is refreshed, so they come first as
+    a cacheable prefix and the description follows them.
+    """
     logger.debug(f"Requested photo: {requested_photo}")
     logger.debug(f"File list: {file_list}")
 
-    prompt = (
+    instructions = (
         "###Instruction###\n"
         "You are the most advanced photo selection AI, specialized in matching descriptive texts with the most suitable file names from a given list. Your task is to analyze a description and identify the file name that best corresponds to it. Precision and attention to detail are paramount.\n\n"
         "###Task Instructions###\n"
@@ -183,9 +247,6 @@ async def construct_photo_finder_prompt(requested_photo: str, file_list: str) ->
         "3. Match Description to File Names: Select the file name that best aligns with the description. If the description matches multiple files, order them by relevance, from the highest to the lowest match.\n"
         "4. Handling Ambiguities: If no file perfectly matches but multiple could fit based on some description aspects, list them by their degree of relevance. If no file closely matches, choose the one that is most loosely related.\n"
         "5. Response Format: Your response should consist solely of the file name(s), exactly as listed, without any additional text or explanation. Separate multiple file names with a semicolon.\n\n"
-        "###Question###\n"
-        f"Description: {requested_photo}\n"
-        f"List of Files:\n{file_list}\n\n"
         "###Important Notes###\n"
         "- Precision in matching the description to the file names is crucial. Always strive for the most accurate match.\n"
         "- Always return at least one file name, even if the match is not perfect. Choose the closest option available.\n"
@@ -193,17 +254,22 @@ async def construct_photo_finder_prompt(requested_photo: str, file_list: str) ->
         "###Your Task###\n"
         "You MUST analyze the description and the list of files, then provide the most suitable file name(s) based on the given criteria. Ensure that your answer is unbiased and avoids relying on stereotypes.\n\n"
         "###Response Primer###\n"
-        "Your response should be the file name(s) perfectly written as it will be input in another function. Separate multiple file names with a semicolon.\n"
+        "Your response should be the file name(s) perfectly written as it will be input in another function. Separate multiple file names with a semicolon.\n\n"
+        f"###List of Files###\n{file_list}\n\n"
+    )
+    question = (
+        "###Question###\n"
+        f"Description: {requested_photo}\n"
     )
 
-    return prompt
+    return message("system", cacheable(instructions), question)
 
 
-async def generate_photo_reaction(photo_caption: str, file_name: str, bot_id: int, request: Request, db: AsyncSession) -> str:
+async def generate_photo_reaction(photo_caption: str, file_name: str, bot: BotContext, db: AsyncSession) -> str:
     """Generate a reaction to a given photo caption and file name."""
 
     try:
-        assistant_prompt = await get_bot_assistant_prompt(bot_id, db)
+        assistant_prompt = bot.bot_assistant_prompt
         logger.debug(f"assistant_prompt: {assistant_prompt}")
 
         logger.debug(f"reaction to caption: {photo_caption} filename {file_name}")
@@ -214,12 +280,15 @@ async def generate_photo_reaction(photo_caption: str, file_name: str, bot_id: in
             "top_p": 1,  # Keeps a broad token choice
             "frequency_penalty": 0.7,  # Discourages frequent token repetition
             "repetition_penalty": 1,  # Prevents input token repetition
-            "messages": [{
-                "role": "system",
-                "content": f"{assistant_prompt} FIRSTS TASKS: [SYSTEM MSG: REPLY SHORT MAX 50 CHARACTERS] React to this photo of yours caption: '{photo_caption}' and its file name: '{file_name}',  be creative, dont put the caption or the filename just say what you think about it staying in the character [SYSTEM MSG: REPLY SHORT MAX 50 CHARACTERS]"
-            }]
+            # The bot's prompt is the cacheable prefix, the task about this photo follows it
+            "messages": [message(
+                "system",
+                cacheable(assistant_prompt),
+                f" FIRSTS TASKS: [SYSTEM MSG: REPLY SHORT MAX 50 CHARACTERS] React to this photo of yours caption: '{photo_caption}' and its file name: '{file_name}',  be creative, dont put the caption or the filename just say what you think about it staying in the character [SYSTEM MSG: REPLY SHORT MAX 50 CHARACTERS]"
+            )]
         }
-        response_data = await send_payload_to_openrouter(payload, request)
+        # A single attempt; the router fails fast while every target is down
+        response_data = await send_payload_to_openrouter(payload)
         reaction = response_data.get("choices", [{}])[0].get("message", {}).get("content", "").strip()
         
         logger.debug(f"reaction response: {reaction}")
@@ -1,14 +1,20 @@
 # ./app/controllers/message_processing.py
 import logging
 from datetime import datetime
+from typing import List, Optional
+import time
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.database_operations import (
    update_user_credits,
-   update_message,
-   check_if_chat_is_awaiting,
-   manage_awaiting_status,
+   try_debit_credits,
+   transition_messages,
+   get_awaiting_type,
+   start_generating,
+   finish_generating,
+   release_claimed_messages,
+   unprocessed_messages_query,
 )
-from app.controllers.ai_communication import get_chat_completion, generate_photo_reaction
+from app.controllers.ai_communication import get_chat_completion, stream_chat_completion, generate_photo_reaction
 from app.controllers.telegram_integration import (
    send_typing_action,
    update_telegram_message,
@@ -23,37 +29,82 @@ from app.utils.generate_audio import (
 )
 from app.utils.generate_photo import generate_photo_from_text
 from app.utils.caption_photo import get_caption_for_local_photo
-from fastapi import APIRouter, Request, Depends
-from app.config import CREDIT_COST_PHOTO, CREDIT_COST_AUDIO, CREDIT_COST_TEXT
+from app.config import CREDIT_COST_PHOTO, CREDIT_COST_AUDIO, CREDIT_COST_TEXT, PROCESS_QUEUE_DEBOUNCE_SECONDS, COMPLETION_STREAMING, JOB_MAX_ATTEMPTS
 from app.utils.error_handler import send_error_notification
 from app.utils.request_classifier import check_intent
-from app.config import bot_config
+from app.utils.bot_registry import bot_registry, BotContext
+from app.utils.job_queue import register_job_handler, enqueue_job, is_retryable
+from app.utils.reply_latency import reply_latency
 import asyncio
 import regex as re
 
 logger = logging.getLogger(__name__)
 
-async def process_queue(
+class ReplyProgress:
+    """
+    How far process_message got with a batch. Once part of the reply has been sent,
+    running the job again would send it a second time, so a later failure finishes
+    the batch instead of handing its messages back.
+    """
+
+    def __init__(self):
+        self.message_pks: List[int] = []
+        self.sent = False
+        self.reply_text: Optional[str] = None
+
+    def mark_sent(self, reply_text: Optional[str]) -> None:
+        self.sent = True
+        self.reply_text = reply_text
+
+async def enqueue_process_queue(
+    db: AsyncSession,
     chat_id: int,
     bot_id: int,
     user_id: int,
     message_pk: int,
     ai_placeholder_pk: int,
+    awaiting_type: Optional[str] = None,
+    priority: int = 0,
+    ) -> int:
+    params = {
+        'chat_id': chat_id,
+        'bot_id': bot_id,
+        'user_id': user_id,
+        'message_pk': message_pk,
+        'ai_placeholder_pk': ai_placeholder_pk,
+        'awaiting_type': awaiting_type,
+        'enqueued_at': datetime.utcnow().isoformat(),
+    }
+    return await enqueue_job(
+        db, "process_queue", bot_id=bot_id, chat_id=chat_id, payload=params,
+        delay=PROCESS_QUEUE_DEBOUNCE_SECONDS, priority=priority
+    )
+
+async def process_queue(
+    chat_id: int,
+    bot: BotContext,
+    user_id: int,
+    message_pk: int,
+    ai_placeholder_pk: int,
     db: AsyncSession,
-    request: Request,
+    enqueued_at: str,
+    awaiting_type: Optional[str] = None,
+    may_retry: bool = False,
     ):
+    """
+    Answers the chat's unprocessed messages. With may_retry, a transient error is raised
+    for the job queue to run the job again; otherwise the user is told it failed. An
+    error after the reply started going out is only logged, as a retry would resend it.
+    """
+    progress = ReplyProgress()
     try:
-        timestamp = datetime.utcnow()
-        await asyncio.sleep(3)
+        # The job was scheduled PROCESS_QUEUE_DEBOUNCE_SECONDS after enqueued_at, so anything
+        # newer than that arrived during the wait and has its own job queued behind this one
+        timestamp = datetime.fromisoformat(enqueued_at)
         logger.info(f"Processing queue for chat_id {chat_id} as of {timestamp}")
 
-        stmt = (
-            select(tbl_msg)
-            .where(tbl_msg.chat_id == chat_id, tbl_msg.is_processed == "N")
-            .order_by(tbl_msg.message_date.desc())
-        )
         async with db:
-            result = await db.execute(stmt)
+            result = await db.execute(unprocessed_messages_query(bot.bot_id, chat_id))
             unprocessed_messages = result.scalars().all()
 
         logger.debug(f"Unprocessed messages: {unprocessed_messages}")
@@ -65,7 +116,8 @@ async def process_queue(
 
             if unprocessed_messages[0].message_date <= timestamp:
                 await process_message(
-                    unprocessed_messages, db, chat_id, bot_id, user_id, ai_placeholder_pk, request
+                    unprocessed_messages, db, chat_id, bot, user_id, ai_placeholder_pk, awaiting_type,
+                    progress=progress, may_retry=may_retry
                 )
             else:
                 logger.info(
@@ -75,48 +127,103 @@ async def process_queue(
     except Exception as e:
         logger.error(f"Error processing queue: {e}")
         await db.rollback()
+        if progress.sent:
+            await finish_sent_reply(db, chat_id, ai_placeholder_pk, progress)
+            return
+        try:
+            # Back to 'N', for the retry or the chat's next job to answer them
+            await release_claimed_messages(db, chat_id=chat_id, bot_id=bot.bot_id)
+        except Exception as release_error:
+            # A retry releases them before it starts
+            logger.error(f"Failed to release the messages claimed for chat_id {chat_id}: {release_error}")
+        if may_retry and is_retryable(e):
+            # The placeholder stays hidden ('S') and is filled by the retry
+            raise
         await send_error_notification(
             chat_id,
-            bot_config["bot_token"],
+            bot.bot_token,
             "Error: e001",
         )
     finally:
         await db.close()
 
+async def finish_sent_reply(db: AsyncSession, chat_id: int, ai_placeholder_pk: int, progress: ReplyProgress) -> None:
+    """
+    Best-effort transitions for a batch whose reply reached the user before an error.
+    Written directly rather than through write_batcher, whose flush may be what failed.
+    """
+    for pks, from_status, content in (
+        ([ai_placeholder_pk], "S", progress.reply_text or None),
+        (progress.message_pks, "P", None),
+    ):
+        try:
+            # Compare-and-set, so a transition the failed flush did commit is skipped
+            await transition_messages(db, pks, from_status, "Y", content=content)
+        except Exception as e:
+            logger.error(f"Failed to finish the sent reply for chat_id {chat_id}, messages {pks}: {e}")
+
+async def resolve_job_bot(bot_id: int) -> BotContext:
+    bot = await bot_registry.get_by_id(bot_id)
+    if bot is None:
+        raise RuntimeError(f"No bot config found for bot_id {bot_id}")
+    return bot
+
+async def process_queue_job(db: AsyncSession, attempts: int, bot_id: int, **params):
+    bot = await resolve_job_bot(bot_id)
+    if attempts > 1:
+        # A previous attempt died mid-flight, hand the messages it had claimed back
+        await release_claimed_messages(db, chat_id=params['chat_id'], bot_id=bot_id)
+    if 'awaiting_type' not in params:
+        # Enqueued before the awaiting state was carried in the payload
+        params['awaiting_type'] = await get_awaiting_type(db, bot_id, params['chat_id'])
+    await process_queue(db=db, bot=bot, may_retry=attempts < JOB_MAX_ATTEMPTS, **params)
+
+register_job_handler("process_queue", process_queue_job)
+
 async def process_message(
-    messages, db, chat_id, bot_id, user_id, ai_placeholder_pk: int, request: Request
+    messages, db, chat_id, bot: BotContext, user_id, ai_placeholder_pk: int, awaiting_type: Optional[str] = None,
+    progress: Optional[ReplyProgress] = None, may_retry: bool = False
     ):
     logger.debug(f"Messages to process: {messages}")
 
-    bot_token = bot_config["bot_token"]
-    bot_id = bot_config["bot_id"]
+    bot_token = bot.bot_token
+    bot_id = bot.bot_id
 
     logger.debug(f"messages[0].bot_id new catch: {bot_id}")
     logger.debug(f"bot_token new catch: {bot_token}")
 
-    await send_typing_action(chat_id, bot_token)
+    # Claim the batch; whatever another worker already took is left to it
+    claimed = set(await transition_messages(db, [message.pk_messages for message in messages], "N", "P"))
+    if not claimed:
+        logger.info(f"Messages for chat_id {chat_id} were already claimed, nothing to process")
+        return
+    messages = [message for message in messages if message.pk_messages in claimed]
+    progress = progress or ReplyProgress()
+    progress.message_pks = [message.pk_messages for message in messages]
 
-    for message in messages:
-        await update_message(db, message_pk=message.pk_messages, new_status="P")
+    await send_typing_action(chat_id, bot_token)
 
     response_text = None
-    
-    if await check_if_chat_is_awaiting(db=db, chat_id=chat_id, awaiting_type="AUDIO"):
+    charge_text = True
+
+    # Only the worker that moves the request to GENERATING fulfils it; an expired or
+    # already fulfilled request is answered as a normal message
+    if awaiting_type and not await start_generating(db, bot_id, chat_id, awaiting_type):
+        awaiting_type = None
+
+    if awaiting_type == "AUDIO":
         success, generating_message_id = await send_telegram_message(
             chat_id=chat_id, text="Generating audio, please wait.", bot_token=bot_token
         )
 
         if success:
             logger.debug(f"user is awaiting audio generation")
-            await manage_awaiting_status(
-                db, chat_id=chat_id, channel="TELEGRAM", action="REMOVE"
-            )
 
-            response_text = await get_chat_completion(chat_id, bot_id, request, db)
+            response_text = await get_chat_completion(bot, chat_id, db)
             
             logger.debug(f"Chat completion response: {response_text}")
 
-            voice_id = bot_config["bot_voice_id"]
+            voice_id = bot.bot_voice_id
 
             audio_generation_task = asyncio.create_task(
                 
@@ -143,6 +250,7 @@ async def process_message(
                 await send_voice_note(
                     chat_id=chat_id, audio_file_path=audio_file_path, bot_token=bot_token
                 )
+                progress.mark_sent(response_text)
 
                 user_credit_info = {
                     "channel": "TELEGRAM",
@@ -155,7 +263,7 @@ async def process_message(
                     "pk_payment": None,
                 }
 
-                await update_user_credits(db, user_credit_info)
+                await update_user_credits(db, user_credit_info, batched=True)
 
                 await update_telegram_message(
                     chat_id, generating_message_id, "💕 Here you go! 💕", bot_token
@@ -167,19 +275,16 @@ async def process_message(
                 )
                 logger.error("Failed to generate audio")
 
-    elif await check_if_chat_is_awaiting(db=db, chat_id=chat_id, awaiting_type="PHOTO"):
+    elif awaiting_type == "PHOTO":
         success, generating_message_id = await send_telegram_message(
             chat_id=chat_id, text="Selecting exclusive photo, please wait.", bot_token=bot_token
         )
 
         if success:
             logger.debug("User is awaiting photo generation")
-            await manage_awaiting_status(
-                db, chat_id=chat_id, channel="TELEGRAM", action="REMOVE"
-            )
             logger.debug("Before calling generate_photo_from_text")
             photo_generation_task = asyncio.create_task(
-                generate_photo_from_text(text=messages[0].content_text, request=request)
+                generate_photo_from_text(text=messages[0].content_text)
             )
             logger.debug("After calling generate_photo_from_text")
 
@@ -206,11 +311,12 @@ async def process_message(
             if photo_temp_path:
                 
                 caption = await get_caption_for_local_photo(photo_file_path=photo_temp_path)
-                response_text = await generate_photo_reaction(photo_caption=caption, file_name=photo_temp_path, bot_id=bot_id, request=request, db=db)
+                response_text = await generate_photo_reaction(photo_caption=caption, file_name=photo_temp_path, bot=bot, db=db)
 
                 await send_photo_message(
                 chat_id=chat_id, photo_temp_path=photo_temp_path, bot_token=bot_token, caption=response_text
                 )
+                progress.mark_sent(response_text)
 
                 user_credit_info = {
                 "channel": "TELEGRAM",
@@ -223,7 +329,7 @@ async def process_message(
                 "pk_payment": None,
                 }
 
-                await update_user_credits(db, user_credit_info)
+                await update_user_credits(db, user_credit_info, batched=True)
 
                 await update_telegram_message(
                 chat_id, generating_message_id, "💕 Here you go! 💕", bot_token
@@ -238,50 +344,139 @@ async def process_message(
     else:
 
 
-        await check_intent(content_text=messages[0].content_text,bot_token=bot_token,chat_id=chat_id)
+        offered = await check_intent(content_text=messages[0].content_text,bot_token=bot_token,chat_id=chat_id)
 
-        response_text = await get_chat_completion(chat_id, bot_id, request, db)
+        response_text = None
+        if COMPLETION_STREAMING:
+            response_text = await stream_reply(bot, chat_id, db, progress)
 
-        # Check if response_text is None and handle it
         if response_text is None:
-            logger.error("Received None from get_chat_completion, generating default response.")
-            response_text = "Sorry, I couldn't understand that. Could you please rephrase?"
-        else:
-            # Check for the 429 error
-            if isinstance(response_text, dict) and response_text.get("error") == "429":
-                error_message = "Sorry, I'm experiencing high traffic at the moment. Please try again later."
-                await send_telegram_message(chat_id, error_message, bot_token)
-                return  # Exit the function without updating user credits
-            
-        logger.debug(f"Chat completion response: {response_text}")
+            started = time.perf_counter()
+            # A transient failure is left to the job retry while nothing has been sent yet
+            response_text = await get_chat_completion(bot, chat_id, db, raise_retryable=may_retry and not offered)
 
+            # Check if response_text is None and handle it
+            if response_text is None:
+                logger.error("Received None from get_chat_completion, generating default response.")
+                charge_text = False
+                response_text = "Sorry, I couldn't understand that. Could you please rephrase?"
 
-        humanized_response = humanize_response(response_text)
-
-        for chunk in humanized_response:
-            await send_telegram_message(chat_id, chunk, bot_token)
+            logger.debug(f"Chat completion response: {response_text}")
 
-    await update_message(db, message_pk=ai_placeholder_pk, new_content=response_text)
-    await update_message(db, message_pk=ai_placeholder_pk, new_status="Y")
 
-    for message in messages:
-        await update_message(db, message_pk=message.pk_messages, new_status="Y")
+            humanized_response = humanize_response(response_text)
+
+            for i, chunk in enumerate(humanized_response):
+                await send_telegram_message(chat_id, chunk, bot_token)
+                progress.mark_sent(response_text)
+                if i == 0:
+                    reply_latency.record("buffered", "time_to_first_message", time.perf_counter() - started)
+            reply_latency.count("buffered")
+            reply_latency.record("buffered", "total", time.perf_counter() - started)
+
+    if awaiting_type:
+        # Back to IDLE; a generation that raised is released by its expiry instead
+        await finish_generating(db, bot_id, chat_id)
+
+    # Submitted together so the reply and the batch it answers are committed in one flush
+    await asyncio.gather(
+        transition_messages(db, [ai_placeholder_pk], "S", "Y", content=response_text or None, batched=True),
+        transition_messages(db, [message.pk_messages for message in messages], "P", "Y", batched=True),
+    )
+
+    if charge_text:
+        # One TEXT_GEN charge per processed batch, taken once the reply went out. The
+        # conditional debit never drives the balance below zero.
+        user_credit_info = {
+            "channel": "TELEGRAM",
+            "pk_bot": bot_id,
+            "user_id": user_id,
+            "chat_id": chat_id,
+            "credits": CREDIT_COST_TEXT,
+            "transaction_type": "TEXT_GEN",
+            "transaction_date": datetime.utcnow(),
+            "pk_payment": None,
+        }
+        try:
+            await try_debit_credits(db, user_credit_info)
+        except Exception as e:
+            # The reply is out; failing the job now would only send it again
+            logger.error(f"Failed to charge the text cost for chat_id {chat_id}: {e}")
 
-    user_credit_info = {
-        "channel": "TELEGRAM",
-        "pk_bot": bot_id,
-        "user_id": user_id,
-        "chat_id": chat_id,
-        "credits": CREDIT_COST_TEXT,
-        "transaction_type": "TEXT_GEN",
-        "transaction_date": datetime.utcnow(),
-        "pk_payment": None,
-    }
+    logger.info(f"{len(messages)} messages processed for chat_id {chat_id}")
 
-    await update_user_credits(db, user_credit_info)
-    
+async def stream_reply(bot: BotContext, chat_id: int, db: AsyncSession, progress: ReplyProgress) -> Optional[str]:
+    """
+    Streams the completion and sends each sentence as soon as it is complete. Returns the
+    text that was sent, or None when the stream failed before anything was, in which case
+    the caller falls back to the buffered completion.
+    """
+    started = time.perf_counter()
+    sentences = SentenceStream()
+    sent = []
+    try:
+        async for delta in stream_chat_completion(bot, chat_id, db):
+            if not sentences.text:
+                reply_latency.record("streamed", "time_to_first_token", time.perf_counter() - started)
+            for sentence in sentences.feed(delta):
+                await send_streamed_sentence(bot, chat_id, sentence, sent, started, progress)
+        for sentence in sentences.flush():
+            await send_streamed_sentence(bot, chat_id, sentence, sent, started, progress)
+    except Exception as e:
+        if not sent:
+            reply_latency.count("stream_fallbacks")
+            logger.warning(f"Streamed completion for chat_id {chat_id} failed, using the buffered one: {e}")
+            return None
+        # What the user already got is the reply; the rest of the stream is lost
+        reply_latency.count("stream_interrupted")
+        logger.error(f"Streamed completion for chat_id {chat_id} broke off after {len(sent)} messages: {e}")
+        return " ".join(sent)
+
+    if not sent:
+        reply_latency.count("stream_fallbacks")
+        logger.warning(f"Streamed completion for chat_id {chat_id} was empty, using the buffered one")
+        return None
+    reply_latency.count("streamed")
+    reply_latency.record("streamed", "total", time.perf_counter() - started)
+    logger.debug(f"Streamed chat completion response: {sentences.text}")
+    return sentences.text
+
+
+async def send_streamed_sentence(bot: BotContext, chat_id: int, sentence: str, sent: list, started: float,
+                                 progress: ReplyProgress) -> None:
+    await send_telegram_message(chat_id, sentence, bot.bot_token)
+    if not sent:
+        reply_latency.record("streamed", "time_to_first_message", time.perf_counter() - started)
+    sent.append(sentence)
+    progress.mark_sent(" ".join(sent))
+
+
+class SentenceStream:
+    """Cuts streamed text into the messages humanize_response would make of the whole, as each one completes."""
+
+    # A sentence is complete once the text after its punctuation and spaces has started;
+    # cutting at the first space would leave the rest of a run of spaces on the next one
+    boundary = re.compile(r"(?<=[.!?]) +(?=\S)")
+
+    def __init__(self):
+        self.text = ""
+        self.pending = ""
+
+    def feed(self, delta: str) -> List[str]:
+        self.text += delta
+        self.pending += delta
+        last = None
+        for last in self.boundary.finditer(self.pending):
+            pass
+        if last is None:
+            return []
+        complete, self.pending = self.pending[:last.start()], self.pending[last.end():]
+        return humanize_response(complete)
+
+    def flush(self) -> List[str]:
+        rest, self.pending = self.pending, ""
+        return humanize_response(rest)
 
-    logger.info(f"{len(messages)} messages processed for chat_id {chat_id}")
 
 def humanize_response(paragraph):
     if paragraph is None:
@@ -3,6 +3,7 @@ import httpx
 import logging
 from app.config import TELEGRAM_API_URL, STRIPE_API_KEY, CREDIT_COST_PHOTO, CREDIT_COST_AUDIO
 from app.database_operations import get_latest_total_credits
+from app.utils.http_clients import http_clients
 from decimal import Decimal
 import asyncio
 import os
@@ -294,13 +295,12 @@ async def send_invoice(
 
 async def send_telegram_request(url, payload, get_message_id=False):
    try:
-       async with httpx.AsyncClient() as client:
-           response = await client.post(url, json=payload)
-           response.raise_for_status()
-           if get_message_id:
-               message_id = response.json().get('result', {}).get('message_id', 0)
-               return True, message_id
-           return True
+       response = await http_clients.get("telegram").post(url, json=payload)
+       response.raise_for_status()
+       if get_message_id:
+           message_id = response.json().get('result', {}).get('message_id', 0)
+           return True, message_id
+       return True
    except httpx.HTTPStatusError as e:
        logger.error(f"HTTP error: {e}")
        logger.error(f"Request payload: {payload}")
@@ -312,10 +312,9 @@ async def send_telegram_request(url, payload, get_message_id=False):
 
 async def send_telegram_request_with_file(url, files, data=None):
    try:
-       async with httpx.AsyncClient() as client:
-           response = await client.post(url, files=files, data=data)
-           response.raise_for_status()
-           return True
+       response = await http_clients.get("telegram").post(url, files=files, data=data)
+       response.raise_for_status()
+       return True
    except httpx.HTTPStatusError as e:
        logger.error(f"HTTP error: {e}")
    except Exception as e:
@@ -1,10 +1,176 @@
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+from sqlalchemy import exc
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, AsyncEngine
 from sqlalchemy.orm import sessionmaker
-from app.config import SQLALCHEMY_DATABASE_URL
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from app.config import (
+    SQLALCHEMY_DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT_SECONDS, DB_POOL_RECYCLE_SECONDS,
+    DB_POOL_PRE_PING, DB_STATEMENT_CACHE_SIZE, DB_BACKGROUND_POOL_SIZE, DB_BACKGROUND_MAX_OVERFLOW,
+    SQLALCHEMY_REPLICA_URL, DB_REPLICA_POOL_SIZE, DB_REPLICA_MAX_OVERFLOW, REPLICA_MAX_LAG_SECONDS
+)
+from app.utils.metrics import register_collector
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that also counts the coroutines waiting for a connection and how long they waited."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.waiting = 0
+        self.wait_stats = {"checkouts": 0, "waits": 0, "wait_seconds_total": 0.0, "wait_seconds_max": 0.0, "timeouts": 0}
+
+    def _do_get(self):
+        started = time.perf_counter()
+        self.waiting += 1
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.wait_stats["timeouts"] += 1
+            raise
+        finally:
+            self.waiting -= 1
+            waited = time.perf_counter() - started
+            self.wait_stats["checkouts"] += 1
+            # Creating a connection takes a few ms too, only count a real wait on the queue
+            if waited > 0.001:
+                self.wait_stats["waits"] += 1
+                self.wait_stats["wait_seconds_total"] += waited
+                self.wait_stats["wait_seconds_max"] = max(self.wait_stats["wait_seconds_max"], waited)
+
+    def recreate(self):
+        # Invalidation swaps the pool for a fresh one; keep the counters across it
+        new_pool = super().recreate()
+        new_pool.wait_stats = self.wait_stats
+        return new_pool
 
-engine = create_async_engine(SQLALCHEMY_DATABASE_URL, pool_size=20, max_overflow=0)
+    def get_stats(self) -> dict:
+        return {
+            "size": self.size(),
+            "checked_out": self.checkedout(),
+            "checked_in": self.checkedin(),
+            "overflow": self.overflow(),
+            "waiting": self.waiting,
+            **self.wait_stats,
+            "wait_seconds_total": round(self.wait_stats["wait_seconds_total"], 3),
+            "wait_seconds_max": round(self.wait_stats["wait_seconds_max"], 3),
+        }
+
+
+def make_engine(pool_size: int, max_overflow: int, url: str = SQLALCHEMY_DATABASE_URL) -> AsyncEngine:
+    return create_async_engine(
+        url,
+        poolclass=InstrumentedQueuePool,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=DB_POOL_TIMEOUT_SECONDS,
+        pool_recycle=DB_POOL_RECYCLE_SECONDS,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        connect_args={"prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE},
+    )
+
+
+# Webhook handling and everything it awaits
+engine = make_engine(DB_POOL_SIZE, DB_MAX_OVERFLOW)
 AsyncSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, class_=AsyncSession)
 
+# Job workers, schedulers, maintenance and LISTEN connections, so they can never take the webhook's connections
+background_engine = make_engine(DB_BACKGROUND_POOL_SIZE, DB_BACKGROUND_MAX_OVERFLOW)
+BackgroundSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=background_engine, class_=AsyncSession)
+
+engines: Dict[str, AsyncEngine] = {"web": engine, "background": background_engine}
+
+# Optional streaming replica for the reads routed through read_router
+replica_engine = make_engine(DB_REPLICA_POOL_SIZE, DB_REPLICA_MAX_OVERFLOW, SQLALCHEMY_REPLICA_URL) if SQLALCHEMY_REPLICA_URL else None
+ReplicaSessionLocal = (
+    sessionmaker(autocommit=False, autoflush=False, bind=replica_engine, class_=AsyncSession) if replica_engine else None
+)
+if replica_engine is not None:
+    engines["replica"] = replica_engine
+
+
+class ReadRouter:
+    """
+    Runs designated read-only operations on the replica. A key (a chat, a user's balance,
+    the bot configs) written by this process in the last max_lag seconds is read from the
+    primary instead, so a read that follows our own write sees it. Replica connection
+    errors fall back to the primary.
+    """
+
+    def __init__(self, session_factory, max_lag: float):
+        self.session_factory = session_factory
+        self.max_lag = max_lag
+        self._fences: Dict[tuple, float] = {}
+        self._stats = {"replica_reads": 0, "primary_reads": 0, "fenced_reads": 0, "replica_errors": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.session_factory is not None
+
+    def note_write(self, *key) -> None:
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        self._fences[key] = now + self.max_lag
+        if len(self._fences) > 10000:
+            self._fences = {fenced: until for fenced, until in self._fences.items() if until > now}
+
+    def is_fenced(self, *key) -> bool:
+        until = self._fences.get(key)
+        return until is not None and until > time.monotonic()
+
+    async def run(self, primary: AsyncSession, key: tuple, operation: Callable[[AsyncSession], Awaitable[T]]) -> T:
+        """Calls operation(session) with a replica session when key allows it, else with primary."""
+        if not self.enabled:
+            self._stats["primary_reads"] += 1
+            return await operation(primary)
+        if self.is_fenced(*key):
+            self._stats["fenced_reads"] += 1
+            return await operation(primary)
+        try:
+            async with self.session_factory() as replica:
+                result = await operation(replica)
+            self._stats["replica_reads"] += 1
+            return result
+        except (DBAPIError, OSError) as e:
+            self._stats["replica_errors"] += 1
+            logger.warning(f"Replica read for {key} failed, using the primary: {e}")
+            return await operation(primary)
+
+    def get_stats(self) -> dict:
+        return {**self._stats, "enabled": self.enabled, "fences": len(self._fences)}
+
+
+read_router = ReadRouter(ReplicaSessionLocal, REPLICA_MAX_LAG_SECONDS)
+
 async def get_db():
     async with AsyncSessionLocal() as session:
-        yield session
\ No newline at end of file
+        yield session
+
+async def add_notify_listener(channel: str, callback):
+    """
+    LISTENs on a Postgres channel through a dedicated connection. The callback is
+    called as callback(connection, pid, channel, payload). Returns the connection,
+    which the caller closes on shutdown.
+    """
+    conn = await background_engine.connect()
+    raw = await conn.get_raw_connection()
+    await raw.driver_connection.add_listener(channel, callback)
+    return conn
+
+async def dispose_engines():
+    for registered in engines.values():
+        await registered.dispose()
+
+def get_pool_stats() -> dict:
+    return {name: registered.pool.get_stats() for name, registered in engines.items()}
+
+register_collector("db_pools", get_pool_stats)
+register_collector("read_router", read_router.get_stats)
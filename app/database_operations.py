@@ -3,210 +3,493 @@ from sqlalchemy.orm import Session
 from sqlalchemy.future import select
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import update, and_, func
+from sqlalchemy import values as values_list
+from sqlalchemy import Row, update, insert, delete, column, and_, or_, exists, func, literal, literal_column, any_, bindparam, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from decimal import Decimal
-from typing import List, Union, Type
+from typing import List
 from typing import Tuple, Optional
-from app.config import bot_config 
+from sqlalchemy.types import ARRAY, BigInteger, Integer, DECIMAL, DateTime, String
 
 
 from app.models import (
-    tbl_msg, TelegramConfig, tbl_300_awaiting_user_input,
-    Payment, UserCredit, tbl_150_user_info
+    tbl_msg, ChatReset, ChatActivity, TelegramConfig, tbl_300_awaiting_user_input,
+    Payment, UserCredit, UserBalance, tbl_150_user_info
 )
 from app.schemas import TextMessage
+from app.config import (
+    AUTO_REPLY_IDLE_MINUTES, HISTORY_PAGE_SIZE, MESSAGE_UNPROCESSED_LOOKBACK_HOURS,
+    CONVERSATION_AWAITING_TTL_SECONDS, CONVERSATION_GENERATING_TTL_SECONDS
+)
+from app.utils.history_cache import history_cache, Turn, budget_turns
+from app.utils.conversation_state import AWAITING, GENERATING
+from app.utils.write_batcher import write_batcher
+from app.database import read_router
 
 import logging
 
 logger = logging.getLogger(__name__)
 
+bot_config_columns = (
+    TelegramConfig.pk_bot,
+    TelegramConfig.bot_token,
+    TelegramConfig.bot_short_name,
+    TelegramConfig.bot_voice_id,
+    TelegramConfig.bot_assistant_prompt,
+    TelegramConfig.bot_greeting_msg,
+    TelegramConfig.bot_history_budget_chars
+)
+
+def bot_config_row_to_dict(bot_config_data) -> dict:
+    return {
+        "bot_id": bot_config_data.pk_bot,
+        "bot_token": bot_config_data.bot_token,
+        "bot_short_name": bot_config_data.bot_short_name,
+        "bot_voice_id": bot_config_data.bot_voice_id,
+        "bot_assistant_prompt": bot_config_data.bot_assistant_prompt,
+        "bot_greeting_msg": bot_config_data.bot_greeting_msg,
+        "bot_history_budget_chars": bot_config_data.bot_history_budget_chars
+    }
+
 async def get_bot_config_by_short_name_full(db: AsyncSession, bot_short_name: str) -> Optional[dict]:
-    query = select(
-        TelegramConfig.pk_bot,
-        TelegramConfig.bot_token,
-        TelegramConfig.bot_short_name,
-        TelegramConfig.bot_voice_id,
-        TelegramConfig.bot_assistant_prompt,
-        TelegramConfig.bot_greeting_msg
-    ).where(TelegramConfig.bot_short_name == bot_short_name)
+    query = select(*bot_config_columns).where(TelegramConfig.bot_short_name == bot_short_name)
     result = await db.execute(query)
     bot_config_data = result.one_or_none()
     if bot_config_data:
-        bot_config_dict = {
-            "bot_id": bot_config_data.pk_bot,
-            "bot_token": bot_config_data.bot_token,
-            "bot_short_name": bot_config_data.bot_short_name,
-            "bot_voice_id": bot_config_data.bot_voice_id,
-            "bot_assistant_prompt": bot_config_data.bot_assistant_prompt,
-            "bot_greeting_msg": bot_config_data.bot_greeting_msg
-        }
         logger.debug(f"Retrieved bot_config succesfully")
-        return bot_config_dict
+        return bot_config_row_to_dict(bot_config_data)
     
     return None 
 
-async def add_messages(db: AsyncSession, messages_info: List[dict]) -> List[Type[tbl_msg]]:
-    new_messages = []
+async def get_bot_config_by_id_full(db: AsyncSession, bot_id: int) -> Optional[dict]:
+    query = select(*bot_config_columns).where(TelegramConfig.pk_bot == bot_id)
+    result = await db.execute(query)
+    bot_config_data = result.one_or_none()
+    if bot_config_data:
+        logger.debug(f"Retrieved bot_config for bot_id {bot_id} succesfully")
+        return bot_config_row_to_dict(bot_config_data)
+
+    return None
+
+async def add_messages(db: AsyncSession, messages_info: List[dict]) -> List[Row]:
+    """
+    Inserts any number of messages in one round trip. Returns one row per message,
+    in input order, carrying its pk_messages.
+    """
+    if not messages_info:
+        return []
+
+    message_date = datetime.utcnow()
+    rows = []
     for message_info in messages_info:
         message_data = message_info['message_data']
-        role = message_info['role']
-        message_type = message_info.get('type', 'TEXT')
-        is_processed = message_info.get('is_processed', 'N')
-
-        new_message = tbl_msg(
-            chat_id=message_data.chat_id,
-            user_id=message_data.user_id,
-            bot_id=message_data.bot_id,
-            content_text=message_data.message_text,
-            message_id=message_data.message_id,
-            channel=message_data.channel,
-            update_id=message_data.update_id,
-            message_date=datetime.utcnow(),
-            type=message_type,
-            is_processed=is_processed,
-            is_reset='N',
-            role=role
-        )
-        db.add(new_message)
-        new_messages.append(new_message)
-
+        rows.append({
+            'chat_id': message_data.chat_id,
+            'user_id': message_data.user_id,
+            'bot_id': message_data.bot_id,
+            'content_text': message_data.message_text,
+            'message_id': message_data.message_id,
+            'channel': message_data.channel,
+            'update_id': message_data.update_id,
+            'message_date': message_date,
+            'type': message_info.get('type', 'TEXT'),
+            'is_processed': message_info.get('is_processed', 'N'),
+            'is_reset': 'N',
+            'role': message_info['role'],
+        })
+
+    # Sent as a single multi-row INSERT ... RETURNING; sort_by_parameter_order keeps the
+    # returned pks aligned with messages_info
+    result = await db.execute(
+        insert(tbl_msg).returning(tbl_msg.pk_messages, sort_by_parameter_order=True),
+        rows
+    )
+    new_messages = result.all()
+    await touch_chat_activity(db, rows)
     await db.commit()
-    for new_message in new_messages:
-        await db.refresh(new_message)
+
+    for row, message in zip(rows, new_messages):
+        read_router.note_write('chat', row['bot_id'], row['chat_id'])
+        history_cache.append(row['bot_id'], row['chat_id'], Turn(
+            message.pk_messages, row['message_date'], row['role'], row['content_text'], row['is_processed']
+        ))
 
     logger.debug(f"Messages added: {[message.pk_messages for message in new_messages]}")
     return new_messages
 
 
 
-async def update_message(db: AsyncSession, message_pk: int, new_content: str = None, new_status: str = None):
+async def touch_chat_activity(db: AsyncSession, rows: List[dict]) -> None:
+    """
+    Records the latest activity of every (bot, chat) in rows and pushes its
+    re-engagement out to AUTO_REPLY_IDLE_MINUTES from now. Runs in the caller's transaction.
+    """
+    activity = {}
+    for row in rows:
+        activity[(row['bot_id'], row['chat_id'])] = {
+            'bot_id': row['bot_id'],
+            'chat_id': row['chat_id'],
+            'user_id': row['user_id'],
+            'last_activity_at': row['message_date'],
+            'reengage_due_at': row['message_date'] + timedelta(minutes=AUTO_REPLY_IDLE_MINUTES),
+        }
+    stmt = pg_insert(ChatActivity).values(list(activity.values()))
+    await db.execute(
+        stmt.on_conflict_do_update(
+            index_elements=['bot_id', 'chat_id'],
+            set_={
+                'user_id': func.coalesce(stmt.excluded.user_id, ChatActivity.user_id),
+                'last_activity_at': func.greatest(stmt.excluded.last_activity_at, ChatActivity.last_activity_at),
+                # greatest() skips NULL, so a chat that was already re-engaged is scheduled again
+                'reengage_due_at': func.greatest(stmt.excluded.reengage_due_at, ChatActivity.reengage_due_at),
+            }
+        )
+    )
+
+
+async def update_message(db: AsyncSession, message_pk: int, new_content: str = None, new_status: str = None, batched: bool = False):
+    """Sets the content and/or status of a message. batched=True commits it with other writes through write_batcher."""
+    values = {}
+    if new_content:
+        values['content_text'] = new_content
+    if new_status:
+        values['is_processed'] = new_status
+    if not values:
+        return
+    if batched:
+        updated = await write_batcher.submit("messages", MessageWrite([message_pk], None, new_status or None, new_content or None))
+        if not updated:
+            logger.warning(f"No message found with pk {message_pk}")
+        return
     try:
-        query = select(tbl_msg).where(tbl_msg.pk_messages == message_pk)
-        result = await db.execute(query)
-        message = result.scalar_one_or_none()
-        if message:
-            if new_content:
-                message.content_text = new_content
-                logger.info(f"Updated content_text for message with pk {message_pk}")
-            if new_status:
-                message.is_processed = new_status
-                logger.info(f"Message with pk {message_pk} marked as {new_status}")
-            await db.commit()
-        else:
+        result = await db.execute(
+            update(tbl_msg)
+            .where(tbl_msg.pk_messages == message_pk)
+            .values(**values)
+            .returning(tbl_msg.pk_messages, tbl_msg.bot_id, tbl_msg.chat_id)
+        )
+        updated = result.one_or_none()
+        await db.commit()
+        if updated is None:
             logger.warning(f"No message found with pk {message_pk}")
+        else:
+            read_router.note_write('chat', updated.bot_id, updated.chat_id)
+            history_cache.update([updated.pk_messages], content_text=values.get('content_text'), is_processed=values.get('is_processed'))
+            logger.info(f"Updated message with pk {message_pk}: {', '.join(values)}")
     except SQLAlchemyError as e:
         logger.error(f"Database error in update_message: {e}")
         raise
 
 
-async def reset_messages_by_chat_id(db: AsyncSession, chat_id: int) -> None:
+async def transition_messages(db: AsyncSession, pks: List[int], from_status: str, to_status: str, content: str = None,
+                              batched: bool = False) -> List[int]:
+    """
+    Compare-and-set of is_processed for a set of messages in one statement. Only rows
+    still in from_status move, so two workers can never both claim the same message.
+    Returns the pks that were transitioned. batched=True commits it with other writes
+    through write_batcher, for transitions nothing waits on but the caller.
+    """
+    if not pks:
+        return []
+    if batched:
+        rows = await write_batcher.submit("messages", MessageWrite(list(pks), from_status, to_status, content))
+        transitioned = [row.pk_messages for row in rows]
+        logger.debug(f"Messages {transitioned} moved from {from_status} to {to_status} ({len(pks) - len(transitioned)} skipped)")
+        return transitioned
+    values = {'is_processed': to_status}
+    if content is not None:
+        values['content_text'] = content
     try:
-        query = select(tbl_msg).where(tbl_msg.chat_id == chat_id)
-        result = await db.execute(query)
-        messages = result.scalars().all()
-
-        if messages:
-            for message in messages:
-                message.is_reset = 'Y'
-            await db.commit()
-            logger.info(f"All messages for chat_id {chat_id} have been marked as reset")
+        result = await db.execute(
+            update(tbl_msg)
+            .where(
+                tbl_msg.pk_messages == any_(bindparam('pks', list(pks), type_=ARRAY(Integer))),
+                tbl_msg.is_processed == from_status
+            )
+            .values(**values)
+            .returning(tbl_msg.pk_messages, tbl_msg.bot_id, tbl_msg.chat_id)
+        )
+        rows = result.all()
+        await db.commit()
+        transitioned = [row.pk_messages for row in rows]
+        for bot_id, chat_id in {(row.bot_id, row.chat_id) for row in rows}:
+            read_router.note_write('chat', bot_id, chat_id)
+        history_cache.update(transitioned, content_text=content, is_processed=to_status)
+    except SQLAlchemyError as e:
+        logger.error(f"Database error in transition_messages: {e}")
+        await db.rollback()
+        raise
+    logger.debug(f"Messages {transitioned} moved from {from_status} to {to_status} ({len(pks) - len(transitioned)} skipped)")
+    return transitioned
+
+
+@dataclass
+class MessageWrite:
+    """One write_batcher "messages" write: the pks move to to_status (when from_status matches) and/or get content."""
+    pks: List[int]
+    from_status: Optional[str]
+    to_status: Optional[str]
+    content: Optional[str]
+
+
+def unique_key_rounds(rows: list, key) -> List[list]:
+    """
+    Splits rows into rounds in which no key repeats, later rows of a key in later rounds.
+    UPDATE ... FROM applies a single source row to each target row.
+    """
+    rounds: List[list] = []
+    keys: List[set] = []
+    for row in rows:
+        for round_rows, round_keys in zip(rounds, keys):
+            if key(row) not in round_keys:
+                round_rows.append(row)
+                round_keys.add(key(row))
+                break
         else:
-            logger.warning(f"No messages found for chat_id {chat_id}")
+            rounds.append([row])
+            keys.append({key(row)})
+    return rounds
+
+
+def message_writes_statement(rows: List[tuple]):
+    """UPDATE tbl_200_messages ... FROM (VALUES ...) applying (write_no, pk, from_status, to_status, content) rows."""
+    batch = values_list(
+        column('write_no', Integer), column('pk', Integer), column('from_status', String),
+        column('to_status', String), column('content', String),
+        name='batch'
+    ).data(rows)
+    return (
+        update(tbl_msg)
+        .where(
+            tbl_msg.pk_messages == batch.c.pk,
+            or_(batch.c.from_status.is_(None), tbl_msg.is_processed == batch.c.from_status)
+        )
+        .values(
+            is_processed=func.coalesce(batch.c.to_status, tbl_msg.is_processed),
+            content_text=func.coalesce(batch.c.content, tbl_msg.content_text)
+        )
+        .returning(batch.c.write_no, tbl_msg.pk_messages, tbl_msg.bot_id, tbl_msg.chat_id)
+    )
+
+
+async def apply_message_writes(db: AsyncSession, writes: List[MessageWrite]) -> List[List[Row]]:
+    """All the message writes of a batch in one multi-row UPDATE (more when a pk is written twice)."""
+    rows = [(i, pk, write.from_status, write.to_status, write.content) for i, write in enumerate(writes) for pk in write.pks]
+    updated: List[List[Row]] = [[] for _ in writes]
+    for round_rows in unique_key_rounds(rows, key=lambda row: row[1]):
+        for row in (await db.execute(message_writes_statement(round_rows))).all():
+            updated[row.write_no].append(row)
+    return updated
+
 
+def after_message_writes(writes: List[MessageWrite], updated: List[List[Row]]) -> None:
+    for write, rows in zip(writes, updated):
+        for bot_id, chat_id in {(row.bot_id, row.chat_id) for row in rows}:
+            read_router.note_write('chat', bot_id, chat_id)
+        history_cache.update([row.pk_messages for row in rows], content_text=write.content, is_processed=write.to_status)
+
+
+write_batcher.register("messages", apply_message_writes, after_message_writes)
+
+
+async def release_claimed_messages(db: AsyncSession, chat_id: int, bot_id: int) -> None:
+    """Puts messages left in 'P' by an interrupted run back to 'N' so they get processed again."""
+    try:
+        await db.execute(
+            update(tbl_msg)
+            .where(tbl_msg.chat_id == chat_id, tbl_msg.bot_id == bot_id, tbl_msg.is_processed == 'P')
+            .values(is_processed='N')
+        )
+        await db.commit()
     except SQLAlchemyError as e:
-        logger.error(f"Database error in reset_messages_by_chat_id: {e}")
+        logger.error(f"Database error in release_claimed_messages: {e}")
         raise
 
-async def manage_awaiting_status(db: AsyncSession, channel: str, chat_id: int, bot_id: int = None, user_id: int = None,
-                                 awaiting_type: str = None, status: str = "AWAITING", action: str = "INSERT"):
-    try:
-        if action == "REMOVE":
-            # Update all records with the given chat_id to "PROCESSED" status
-            update_stmt = (
-                update(tbl_300_awaiting_user_input)
-                .where(tbl_300_awaiting_user_input.chat_id == chat_id)
-                .values(status="PROCESSED")
-            )
-            await db.execute(update_stmt)
-            await db.commit()
-            return True
 
-        existing_query = select(tbl_300_awaiting_user_input).where(
-            tbl_300_awaiting_user_input.channel == channel,
-            tbl_300_awaiting_user_input.chat_id == chat_id,
-            tbl_300_awaiting_user_input.bot_id == bot_id,
-            tbl_300_awaiting_user_input.user_id == user_id,
-            tbl_300_awaiting_user_input.awaiting_type == awaiting_type,
-            tbl_300_awaiting_user_input.status == status
+async def reset_messages_by_chat_id(db: AsyncSession, chat_id: int, bot_id: int) -> None:
+    """Moves the (bot, chat) reset watermark to now, a single row write however long the history is."""
+    reset_at = datetime.utcnow()
+    try:
+        await db.execute(
+            pg_insert(ChatReset)
+            .values(bot_id=bot_id, chat_id=chat_id, reset_at=reset_at)
+            .on_conflict_do_update(index_elements=['bot_id', 'chat_id'], set_={'reset_at': reset_at})
         )
-        existing_record = await db.execute(existing_query)
-        existing_record = existing_record.scalar_one_or_none()
-
-        if action == "INSERT" and not existing_record:
-            new_awaiting_input = tbl_300_awaiting_user_input(
-                channel=channel,
-                chat_id=chat_id,
-                bot_id=bot_id,
-                user_id=user_id,
-                awaiting_type=awaiting_type,
-                status=status
-            )
-            db.add(new_awaiting_input)
-            await db.commit()
-            return True
-        elif action == "UPDATE" and existing_record:
-            existing_record.status = "PROCESSED"
-            await db.commit()
-            return True
-        else:
-            return False
+        await db.commit()
+        read_router.note_write('chat', bot_id, chat_id)
+        history_cache.reset(bot_id, chat_id)
+        logger.info(f"Conversation of chat_id {chat_id} with bot_id {bot_id} reset at {reset_at}")
     except SQLAlchemyError as e:
-        logger.error(f"Database error in manage_awaiting_status: {e}")
-        return False
+        logger.error(f"Database error in reset_messages_by_chat_id: {e}")
+        raise
 
 
-async def check_if_chat_is_awaiting(db: AsyncSession, chat_id: int, awaiting_type: str) -> bool:
-    query = select(tbl_300_awaiting_user_input).where(
-        tbl_300_awaiting_user_input.chat_id == chat_id,
-        tbl_300_awaiting_user_input.awaiting_type == awaiting_type,
-        tbl_300_awaiting_user_input.status == "AWAITING"
+def unprocessed_messages_query(bot_id: int, chat_id: int):
+    """Messages of the (bot, chat) still waiting for process_queue, newest first."""
+    since = datetime.utcnow() - timedelta(hours=MESSAGE_UNPROCESSED_LOOKBACK_HOURS)
+    return (
+        select(tbl_msg)
+        .where(tbl_msg.bot_id == bot_id, tbl_msg.chat_id == chat_id, tbl_msg.is_processed == "N", tbl_msg.message_date >= since)
+        .order_by(tbl_msg.message_date.desc())
     )
-    result = await db.execute(query)
-    return result.scalar_one_or_none() is not None
 
 
-async def get_bot_assistant_prompt(bot_id: int, db: AsyncSession) -> str:
-    try:
-        query = select(TelegramConfig.bot_assistant_prompt).where(TelegramConfig.pk_bot == bot_id)
-        result = await db.execute(query)
-        bot_assistant_prompt = result.scalar_one_or_none()
+def chat_history_query(bot_id: int, chat_id: int, limit: int = HISTORY_PAGE_SIZE, before: Tuple[datetime, int] = None,
+                       include_pending: bool = False):
+    """
+    One page of the conversation sent to the LLM, newest first: messages since the last
+    reset, without pending placeholders unless include_pending. before is the
+    (message_date, pk_messages) of the oldest row of the previous page.
+    """
+    query = (
+        select(tbl_msg.pk_messages, tbl_msg.message_date, tbl_msg.role, tbl_msg.content_text, tbl_msg.is_processed)
+        .where(tbl_msg.chat_id == chat_id, tbl_msg.bot_id == bot_id, not_reset(bot_id, chat_id))
+        .order_by(tbl_msg.message_date.desc(), tbl_msg.pk_messages.desc())
+        .limit(limit)
+    )
+    if not include_pending:
+        query = query.where(tbl_msg.is_processed != 'S')
+    if before is not None:
+        query = query.where(tuple_(tbl_msg.message_date, tbl_msg.pk_messages) < tuple_(*before))
+    return query
 
-        if bot_assistant_prompt:
-            logger.info(f"Retrieved bot_assistant_prompt for bot_id {bot_id}")
-        else:
-            logger.warning(f"No bot_assistant_prompt found for bot_id {bot_id}")
 
-        return bot_assistant_prompt
-    except SQLAlchemyError as e:
-        logger.error(f"Database error in get_bot_assistant_prompt: {e}")
-        return ''
+async def get_chat_history(db: AsyncSession, bot_id: int, chat_id: int, budget_chars: int) -> List[dict]:
+    """
+    Newest turns of the conversation whose content fits in budget_chars, oldest first, as
+    {"role", "content"} dicts. A warm chat is answered by history_cache; otherwise pages
+    are read only until the budget is spent, so the cost does not grow with the length
+    of the chat. The newest turn is always kept.
+    """
+    turns = history_cache.get(bot_id, chat_id, budget_chars)
+    if turns is not None:
+        return turns
+
+    # Placeholders are loaded too so that the cache sees their reply land
+    async def load(session: AsyncSession) -> Tuple[List[Turn], bool]:
+        loaded = []
+        used = 0
+        before = None
+        while True:
+            rows = (await session.execute(chat_history_query(bot_id, chat_id, before=before, include_pending=True))).all()
+            loaded.extend(Turn(row.pk_messages, row.message_date, row.role, row.content_text, row.is_processed) for row in rows)
+            used += sum(len(row.content_text or '') for row in rows if row.is_processed != 'S')
+            complete = len(rows) < HISTORY_PAGE_SIZE
+            if complete or used > budget_chars:
+                return loaded, complete
+            before = (rows[-1].message_date, rows[-1].pk_messages)
+
+    loaded, complete = await read_router.run(db, ('chat', bot_id, chat_id), load)
+    history_cache.load(bot_id, chat_id, loaded, complete)
+    turns, _ = budget_turns(loaded, budget_chars)
+    return turns
+
+
+def not_reset(bot_id: int, chat_id: int):
+    """
+    Filter on tbl_msg keeping the messages sent after the last reset of the (bot, chat).
+    The watermark is a lower bound on message_date, so partitions before it are pruned.
+    """
+    reset_at = (
+        select(ChatReset.reset_at)
+        .where(ChatReset.bot_id == bot_id, ChatReset.chat_id == chat_id)
+        .scalar_subquery()
+    )
+    return and_(
+        tbl_msg.is_reset != 'Y',  # Rows reset before the watermark existed
+        tbl_msg.message_date > func.coalesce(reset_at, literal_column("'-infinity'::timestamp"))
+    )
 
-async def get_bot_greeting_msg(bot_id: int, db: AsyncSession) -> str:
+async def request_input(db: AsyncSession, channel: str, bot_id: int, chat_id: int, user_id: int, awaiting_type: str) -> bool:
+    """
+    Any state -> AWAITING awaiting_type ('AUDIO' or 'PHOTO') for CONVERSATION_AWAITING_TTL_SECONDS.
+    A request made while a generation runs replaces it; the generation then ends without touching it.
+    """
+    expires_at = datetime.utcnow() + timedelta(seconds=CONVERSATION_AWAITING_TTL_SECONDS)
+    values = dict(channel=channel, user_id=user_id, awaiting_type=awaiting_type, status=AWAITING, expires_at=expires_at)
     try:
-        query = select(TelegramConfig.bot_greeting_msg).where(TelegramConfig.pk_bot == bot_id)
-        result = await db.execute(query)
-        bot_assistant_prompt = result.scalar_one_or_none()
+        await db.execute(
+            pg_insert(tbl_300_awaiting_user_input)
+            .values(bot_id=bot_id, chat_id=chat_id, **values)
+            .on_conflict_do_update(index_elements=['bot_id', 'chat_id'], set_={**values, 'updated_on': func.now()})
+        )
+        await db.commit()
+    except SQLAlchemyError as e:
+        await db.rollback()
+        logger.error(f"Database error in request_input: {e}")
+        return False
+    read_router.note_write('awaiting', bot_id, chat_id)
+    return True
 
-        if bot_assistant_prompt:
-            logger.info(f"Retrieved bot_greeting_msg for bot_id {bot_id}")
-        else:
-            logger.warning(f"No bot_greeting_msg found for bot_id {bot_id}")
 
-        return bot_assistant_prompt
+async def start_generating(db: AsyncSession, bot_id: int, chat_id: int, awaiting_type: str) -> bool:
+    """
+    AWAITING awaiting_type -> GENERATING, as a compare-and-set on the row. Returns False when
+    the request expired, changed type or another worker already started generating it.
+    """
+    now = datetime.utcnow()
+    expires_at = now + timedelta(seconds=CONVERSATION_GENERATING_TTL_SECONDS)
+    result = await db.execute(
+        update(tbl_300_awaiting_user_input)
+        .where(
+            tbl_300_awaiting_user_input.bot_id == bot_id,
+            tbl_300_awaiting_user_input.chat_id == chat_id,
+            tbl_300_awaiting_user_input.status == AWAITING,
+            tbl_300_awaiting_user_input.awaiting_type == awaiting_type,
+            tbl_300_awaiting_user_input.expires_at > now
+        )
+        .values(status=GENERATING, expires_at=expires_at, updated_on=func.now())
+        .returning(tbl_300_awaiting_user_input.pk_user_status)
+    )
+    claimed = result.scalar_one_or_none() is not None
+    await db.commit()
+    read_router.note_write('awaiting', bot_id, chat_id)
+    if not claimed:
+        logger.info(f"{awaiting_type} request of chat_id {chat_id} expired or was already taken")
+    return claimed
+
+
+async def finish_generating(db: AsyncSession, bot_id: int, chat_id: int) -> None:
+    """GENERATING -> IDLE, whether the generation succeeded or not."""
+    try:
+        await db.execute(
+            delete(tbl_300_awaiting_user_input)
+            .where(
+                tbl_300_awaiting_user_input.bot_id == bot_id,
+                tbl_300_awaiting_user_input.chat_id == chat_id,
+                tbl_300_awaiting_user_input.status == GENERATING
+            )
+        )
+        await db.commit()
     except SQLAlchemyError as e:
-        logger.error(f"Database error in get_greeting_msg: {e}")
-        return ''
+        # The row expires on its own after CONVERSATION_GENERATING_TTL_SECONDS
+        await db.rollback()
+        logger.error(f"Database error in finish_generating: {e}")
+        return
+    read_router.note_write('awaiting', bot_id, chat_id)
+
+
+def awaiting_state_query(bot_id: int, chat_id: int):
+    """The unexpired pending request of a chat, at most one row through ux_300_awaiting_chat."""
+    return (
+        select(tbl_300_awaiting_user_input.awaiting_type, tbl_300_awaiting_user_input.expires_at)
+        .where(
+            tbl_300_awaiting_user_input.bot_id == bot_id,
+            tbl_300_awaiting_user_input.chat_id == chat_id,
+            tbl_300_awaiting_user_input.status == AWAITING,
+            tbl_300_awaiting_user_input.expires_at > datetime.utcnow()
+        )
+    )
+
+
+async def get_awaiting_type(db: AsyncSession, bot_id: int, chat_id: int) -> Optional[str]:
+    """Returns 'AUDIO', 'PHOTO' or None when the chat is not awaiting any input."""
+    async def read(session: AsyncSession):
+        return (await session.execute(awaiting_state_query(bot_id, chat_id))).one_or_none()
+    row = await read_router.run(db, ('awaiting', bot_id, chat_id), read)
+    return row.awaiting_type if row else None
 
 
 async def add_payment_details(db: AsyncSession, payment_info: dict) -> int:
@@ -218,146 +501,321 @@ async def add_payment_details(db: AsyncSession, payment_info: dict) -> int:
     return new_payment.pk_payment
 
 
+def latest_ledger_total(user_id: int, bot_id: int):
+    # Balance as last written to the ledger, seeds tbl_460_user_balances for users from before it existed
+    return (
+        select(UserCredit.total_credits)
+        .where(UserCredit.user_id == user_id, UserCredit.pk_bot == bot_id)
+        .order_by(UserCredit.pk_credit.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+
+
+def current_balance(user_id: int, bot_id: int):
+    balance = (
+        select(UserBalance.total_credits)
+        .where(UserBalance.user_id == user_id, UserBalance.pk_bot == bot_id)
+        .scalar_subquery()
+    )
+    return func.coalesce(balance, latest_ledger_total(user_id, bot_id), 0)
+
+
 async def get_latest_total_credits(db: AsyncSession, user_id: int, bot_id: int) -> Decimal:
     try:
-        latest_credit = await db.execute(
-            select(UserCredit.total_credits)
-            .where(UserCredit.user_id == user_id, UserCredit.pk_bot == bot_id)
-            .order_by(UserCredit.pk_credit.desc())
-            .limit(1)
-        )
-        latest_credit_value = latest_credit.scalar_one_or_none()
+        async def read(session: AsyncSession):
+            return (await session.execute(select(current_balance(user_id, bot_id)))).scalar_one_or_none()
+        latest_credit_value = await read_router.run(db, ('user', bot_id, user_id), read)
         logger.debug(f"For user_id={user_id}, pk_bot={bot_id}. latest_credit_value: {latest_credit_value}")
         return Decimal(latest_credit_value) if latest_credit_value is not None else Decimal(0)
     except SQLAlchemyError as e:
         logger.error(f"Database error in get_latest_total_credits: {e}")
         return Decimal(0)
 
-async def update_user_credits(db: AsyncSession, user_credit_info: dict) -> None:
-    try:
-        user_id = user_credit_info['user_id']
-        pk_bot = user_credit_info['pk_bot']
-        credits_to_add = Decimal(user_credit_info['credits'])
 
-        logger.debug(f"Updating credits for user_id={user_id}, pk_bot={pk_bot}. Adding credits: {credits_to_add}")
+def credit_transaction_ctes(user_credit_info: dict, only_if=None, refuse_negative: bool = False, name: str = 'credit'):
+    """
+    Builds the two data-modifying CTEs of a credit transaction: the upsert that moves the
+    balance row and the ledger insert that records it with the resulting total. Nothing
+    is written when only_if (a CTE) has no rows, or, with refuse_negative, when the
+    balance would drop below zero.
+    """
+    pk_bot = user_credit_info['pk_bot']
+    user_id = user_credit_info['user_id']
+    credits = literal(Decimal(user_credit_info['credits']), DECIMAL(10, 2))
+    seed = func.coalesce(latest_ledger_total(user_id, pk_bot), 0)
+
+    source = select(literal(pk_bot, BigInteger), literal(user_id, BigInteger), seed + credits)
+    if only_if is not None:
+        source = source.select_from(only_if)
+    if refuse_negative:
+        # An existing row is checked by the ON CONFLICT clause against its own balance
+        has_balance = exists().where(UserBalance.pk_bot == pk_bot, UserBalance.user_id == user_id)
+        source = source.where(or_(has_balance, seed + credits >= 0))
+
+    balance = (
+        pg_insert(UserBalance)
+        .from_select(['pk_bot', 'user_id', 'total_credits'], source)
+        .on_conflict_do_update(
+            index_elements=['pk_bot', 'user_id'],
+            set_={'total_credits': UserBalance.total_credits + credits, 'updated_on': func.now()},
+            where=(UserBalance.total_credits + credits >= 0) if refuse_negative else None
+        )
+        .returning(UserBalance.total_credits)
+        .cte(f'{name}_balance')
+    )
 
-        latest_total_credits = await get_latest_total_credits(db, user_id, pk_bot)
+    ledger = (
+        insert(UserCredit)
+        .from_select(
+            ['channel', 'pk_bot', 'user_id', 'chat_id', 'credits', 'transaction_type', 'transaction_date', 'pk_payment', 'total_credits'],
+            select(
+                literal(user_credit_info.get('channel', 'TELEGRAM')),
+                literal(pk_bot, BigInteger),
+                literal(user_id, BigInteger),
+                literal(user_credit_info['chat_id'], BigInteger),
+                credits,
+                literal(user_credit_info['transaction_type']),
+                literal(user_credit_info.get('transaction_date') or datetime.utcnow(), DateTime()),
+                literal(user_credit_info.get('pk_payment'), BigInteger),
+                balance.c.total_credits,
+            ).select_from(balance)
+        )
+        .returning(UserCredit.total_credits)
+        .cte(f'{name}_ledger')
+    )
+    return balance, ledger
 
-        if latest_total_credits is None:
-            latest_total_credits = Decimal('0')
-            logger.debug(f"No existing credits found for user_id={user_id}. Initializing to 0.")
 
-        updated_total_credits = latest_total_credits + credits_to_add
+async def apply_credit_transaction(db: AsyncSession, user_credit_info: dict, refuse_negative: bool = False) -> Optional[Decimal]:
+    """Moves the balance and appends the ledger row in one statement. Returns the new total."""
+    _, ledger = credit_transaction_ctes(user_credit_info, refuse_negative=refuse_negative)
+    result = await db.execute(select(ledger.c.total_credits))
+    total_credits = result.scalar_one_or_none()
+    await db.commit()
+    read_router.note_write('user', user_credit_info['pk_bot'], user_credit_info['user_id'])
+    return Decimal(total_credits) if total_credits is not None else None
 
-        logger.debug(f"User_id={user_id} had {latest_total_credits} credits. After adding {credits_to_add}, new total is {updated_total_credits}.")
 
-        user_credit_info['total_credits'] = updated_total_credits
+async def apply_credit_writes(db: AsyncSession, user_credit_infos: List[dict]) -> List[Optional[Decimal]]:
+    """
+    The ledger rows of a batch, one statement each since every row carries the running
+    total left by the previous one, committed together by write_batcher.
+    """
+    totals = []
+    for user_credit_info in user_credit_infos:
+        _, ledger = credit_transaction_ctes(user_credit_info)
+        total_credits = (await db.execute(select(ledger.c.total_credits))).scalar_one_or_none()
+        totals.append(Decimal(total_credits) if total_credits is not None else None)
+    return totals
 
-        new_credit = UserCredit(**user_credit_info)
-        db.add(new_credit)
-        await db.commit()
+
+def after_credit_writes(user_credit_infos: List[dict], totals: List[Optional[Decimal]]) -> None:
+    for user_credit_info in user_credit_infos:
+        read_router.note_write('user', user_credit_info['pk_bot'], user_credit_info['user_id'])
+
+
+write_batcher.register("credit_transactions", apply_credit_writes, after_credit_writes)
+
+
+async def update_user_credits(db: AsyncSession, user_credit_info: dict, batched: bool = False) -> Optional[Decimal]:
+    try:
+        user_id = user_credit_info['user_id']
+        logger.debug(f"Updating credits for user_id={user_id}, pk_bot={user_credit_info['pk_bot']}. Adding credits: {user_credit_info['credits']}")
+
+        if batched:
+            updated_total_credits = await write_batcher.submit("credit_transactions", user_credit_info)
+        else:
+            updated_total_credits = await apply_credit_transaction(db, user_credit_info)
 
         logger.info(f"Successfully updated credits for user_id={user_id}. New total credits: {updated_total_credits}. Details: {user_credit_info}")
+        return updated_total_credits
 
     except KeyError as e:
         logger.error(f"Missing key in user_credit_info: {e}")
-    except ValueError as e:
+    except (ValueError, ArithmeticError) as e:
         logger.error(f"Invalid value for credits: {e}")
     except Exception as e:
         logger.error(f"Error updating user credits: {e}")
         await db.rollback()
 
-async def insert_user_if_not_exists(db: AsyncSession, user_data: dict) -> bool:
-    query = select(tbl_150_user_info).where(
-        tbl_150_user_info.id == user_data['id'],
-        tbl_150_user_info.pk_bot == user_data['pk_bot'],
-        tbl_150_user_info.channel == user_data['channel']
-    )
-    existing_user = await db.execute(query)
-    if existing_user.scalars().first() is not None:
-        logger.info("User already exists, skipping insertion.")
-        return False
 
+async def try_debit_credits(db: AsyncSession, user_credit_info: dict) -> Optional[Decimal]:
+    """
+    Applies a (negative) credit transaction only if the balance stays at or above zero.
+    Returns the new total, or None when the user cannot afford it.
+    """
     try:
-        new_user = tbl_150_user_info(**user_data)
-        db.add(new_user)
-        await db.commit()
-        logger.info("New user inserted successfully.")
-
-        # Adding initial 50 credits gift
-        user_credit_info = {
-            "channel": "TELEGRAM",
-            "pk_bot": user_data['pk_bot'],
-            "user_id": user_data['id'],
-            "chat_id": user_data['chat_id'],
-            "credits": Decimal('50'),
-            "transaction_type": "FIRST_TIME_USER",
-            "transaction_date": datetime.utcnow(),
-            "pk_payment": None
-        }
-        await update_user_credits(db, user_credit_info)
-        return True
-    except IntegrityError as e:
+        total_credits = await apply_credit_transaction(db, user_credit_info, refuse_negative=True)
+    except SQLAlchemyError as e:
+        logger.error(f"Database error in try_debit_credits: {e}")
         await db.rollback()
-        logger.error(f"Failed to insert new user: {e}")
-        return False
+        raise
+    if total_credits is None:
+        logger.info(f"Debit of {user_credit_info['credits']} refused for user_id={user_credit_info['user_id']}, insufficient credits")
+    return total_credits
 
 
-async def is_user_banned(db: AsyncSession, id: int, pk_bot: int, channel: str) -> bool:
-    query = select(tbl_150_user_info.is_banned).where(
-        tbl_150_user_info.id == id,
-        tbl_150_user_info.pk_bot == pk_bot,
-        tbl_150_user_info.channel == channel
-    )
-    result = await db.execute(query)
-    is_banned = result.scalar_one_or_none()
-    if is_banned is None:
-        logger.warning("User not found.")
-        return False  # Assuming not banned if the user doesn't exist for safety
-    return is_banned
+FIRST_TIME_USER_CREDITS = Decimal('50')
+
 
+@dataclass(frozen=True)
+class UserContext:
+    """Everything the webhook needs to know about the sender, loaded in one round trip."""
+    user_id: int
+    bot_id: int
+    chat_id: int
+    is_new: bool
+    is_banned: bool
+    total_credits: Decimal
+    awaiting_type: Optional[str] = None
 
 
-async def get_users_for_auto_reply(db: AsyncSession) -> set:
+def load_user_context_query(user_data: dict):
     """
-    Fetch users whose last message was sent more than X minutes ago.
+    Upserts the user (granting the first-time gift when the row is new) and reads the
+    ban flag, the current balance and the pending awaiting state in a single statement.
     """
-    cutoff_time = datetime.utcnow() - timedelta(minutes=1440)
-    user_info_set = set()
+    user_id, pk_bot, channel, chat_id = user_data['id'], user_data['pk_bot'], user_data['channel'], user_data['chat_id']
+
+    inserted = (
+        pg_insert(tbl_150_user_info)
+        .values(**user_data, is_banned=False)
+        .on_conflict_do_nothing(index_elements=['id', 'pk_bot', 'channel'])
+        .returning(tbl_150_user_info.id)
+        .cte('inserted')
+    )
 
-    try:
-        # First, group messages by user and find the most recent message time for each
-        recent_messages_subq = (
-            select(
-                tbl_msg.chat_id,
-                tbl_msg.user_id,
-                tbl_msg.bot_id,
-                func.max(tbl_msg.message_date).label('last_message_time')
-            )
-            .group_by(tbl_msg.chat_id, tbl_msg.user_id, tbl_msg.bot_id)
-            .subquery()
-        )
+    _, gift = credit_transaction_ctes({
+        'channel': channel,
+        'pk_bot': pk_bot,
+        'user_id': user_id,
+        'chat_id': chat_id,
+        'credits': FIRST_TIME_USER_CREDITS,
+        'transaction_type': 'FIRST_TIME_USER',
+    }, only_if=inserted, name='gift')
+
+    # Sub-selects see the snapshot taken before the CTE inserts, so a new user reads as
+    # missing there and its values come from the CTEs instead
+    is_banned = (
+        select(tbl_150_user_info.is_banned)
+        .where(tbl_150_user_info.id == user_id, tbl_150_user_info.pk_bot == pk_bot, tbl_150_user_info.channel == channel)
+        .limit(1)
+        .scalar_subquery()
+    )
+    awaiting_type = (
+        awaiting_state_query(pk_bot, chat_id)
+        .with_only_columns(tbl_300_awaiting_user_input.awaiting_type)
+        .scalar_subquery()
+    )
+    return select(
+        select(func.count()).select_from(inserted).scalar_subquery().label('inserted_count'),
+        func.coalesce(is_banned, False).label('is_banned'),
+        func.coalesce(select(gift.c.total_credits).scalar_subquery(), current_balance(user_id, pk_bot)).label('total_credits'),
+        awaiting_type.label('awaiting_type'),
+    )
 
-        # Then, select those users whose last message was more than X minutes ago
-        query = (
-            select(
-                recent_messages_subq.c.chat_id,
-                recent_messages_subq.c.user_id,
-                recent_messages_subq.c.bot_id
-            )
-            .where(recent_messages_subq.c.last_message_time < cutoff_time)
-        )
 
-        result = await db.execute(query)
-        rows = result.fetchall()
+async def load_user_context(db: AsyncSession, user_data: dict) -> UserContext:
+    user_id, pk_bot, chat_id = user_data['id'], user_data['pk_bot'], user_data['chat_id']
+    try:
+        # The awaiting state comes with it, from the table that holds it
+        row = (await db.execute(load_user_context_query(user_data))).one()
+        await db.commit()
+    except SQLAlchemyError as e:
+        await db.rollback()
+        logger.error(f"Database error in load_user_context: {e}")
+        raise
+
+    context = UserContext(
+        user_id=user_id,
+        bot_id=pk_bot,
+        chat_id=chat_id,
+        is_new=row.inserted_count > 0,
+        is_banned=bool(row.is_banned),
+        total_credits=Decimal(row.total_credits),
+        awaiting_type=row.awaiting_type,
+    )
+    if context.is_new:
+        read_router.note_write('user', pk_bot, user_id)
+        logger.info(f"New user {user_id} inserted with {FIRST_TIME_USER_CREDITS} gift credits.")
+    logger.debug(f"User context loaded: {context}")
+    return context
+
+
+
+def claim_due_reengagements_statement(now: datetime, limit: int):
+    due = (
+        select(ChatActivity.bot_id, ChatActivity.chat_id)
+        .where(ChatActivity.reengage_due_at <= now)
+        .order_by(ChatActivity.reengage_due_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .cte('due')
+    )
+    return (
+        update(ChatActivity)
+        .where(ChatActivity.bot_id == due.c.bot_id, ChatActivity.chat_id == due.c.chat_id)
+        .values(reengage_due_at=None)
+        .returning(ChatActivity.bot_id, ChatActivity.chat_id, ChatActivity.user_id)
+    )
 
-        for row in rows:
-            # Optionally, fetch bot_short_name if needed using the bot_id
-            # This might require an additional query per row, consider caching or optimizing
-            bot_short_name =  bot_config["bot_short_name"]  # Simplification for illustration
-            user_info_set.add((row.chat_id, row.user_id, bot_short_name))
 
-        return user_info_set
+async def claim_due_reengagements(db: AsyncSession, limit: int) -> List[Row]:
+    """
+    Takes up to limit chats whose re-engagement is due and clears their due time, so
+    each one is dispatched once per idle period. Safe to run from several processes.
+    """
+    try:
+        result = await db.execute(claim_due_reengagements_statement(datetime.utcnow(), limit))
+        chats = result.all()
+        await db.commit()
+        return chats
     except SQLAlchemyError as e:
-        logger.error(f"Database error in get_users_for_auto_reply: {e}")
-        return set()
+        logger.error(f"Database error in claim_due_reengagements: {e}")
+        await db.rollback()
+        return []
+
+
+async def reschedule_reengagement(db: AsyncSession, bot_id: int, chat_id: int, due_at: datetime) -> None:
+    """Puts back a claimed re-engagement that could not be dispatched, unless the chat got active meanwhile."""
+    await db.execute(
+        update(ChatActivity)
+        .where(ChatActivity.bot_id == bot_id, ChatActivity.chat_id == chat_id, ChatActivity.reengage_due_at.is_(None))
+        .values(reengage_due_at=due_at)
+    )
+    await db.commit()
+
+
+async def get_next_reengagement_due(db: AsyncSession) -> Optional[datetime]:
+    result = await db.execute(select(func.min(ChatActivity.reengage_due_at)))
+    return result.scalar_one_or_none()
+
+
+async def backfill_chat_activity(db: AsyncSession) -> int:
+    """
+    Seeds tbl_230_chat_activity from the message history. Only does anything while the
+    table is empty, so the full scan of tbl_200_messages happens once.
+    """
+    if (await db.execute(select(ChatActivity.bot_id).limit(1))).first() is not None:
+        return 0
+    last_message = func.max(tbl_msg.message_date)
+    source = (
+        select(
+            tbl_msg.bot_id,
+            tbl_msg.chat_id,
+            func.max(tbl_msg.user_id),
+            last_message,
+            last_message + timedelta(minutes=AUTO_REPLY_IDLE_MINUTES),
+        )
+        .where(tbl_msg.chat_id.is_not(None), tbl_msg.message_date.is_not(None))
+        .group_by(tbl_msg.bot_id, tbl_msg.chat_id)
+    )
+    result = await db.execute(
+        pg_insert(ChatActivity)
+        .from_select(['bot_id', 'chat_id', 'user_id', 'last_activity_at', 'reengage_due_at'], source)
+        .on_conflict_do_nothing()
+    )
+    await db.commit()
+    logger.info(f"Backfilled chat activity for {result.rowcount} chats")
+    return result.rowcount
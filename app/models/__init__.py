@@ -4,7 +4,13 @@ Base = declarative_base()
 
 from .telegram_config import TelegramConfig
 from .message import tbl_msg
+from .archived_message import ArchivedMessage
+from .chat_reset import ChatReset
+from .chat_activity import ChatActivity
 from .awaiting_user_input import tbl_300_awaiting_user_input
 from .payments import Payment
 from .user_credits import UserCredit
-from .user_info import tbl_150_user_info
\ No newline at end of file
+from .user_balance import UserBalance
+from .user_info import tbl_150_user_info
+from .job import Job
+from .processed_update import ProcessedUpdate
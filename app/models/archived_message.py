@@ -0,0 +1,31 @@
+# app/models/archived_message.py
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Index, func
+from . import Base
+
+class ArchivedMessage(Base):
+    """Cold copy of tbl_200_messages rows that were reset or aged out, never read by the bot."""
+    __tablename__ = 'tbl_205_messages_archive'
+
+    pk_messages = Column(Integer, primary_key=True, autoincrement=False)
+    channel = Column(String(100))
+    bot_id = Column(BigInteger, nullable=False)
+    chat_id = Column(BigInteger)
+    user_id = Column(BigInteger)
+    type = Column(String(100))
+    role = Column(String(100))
+    content_text = Column(String(4000))
+    file_id = Column(String(4000))
+    message_date = Column(DateTime, nullable=False)
+    update_id = Column(BigInteger)
+    message_id = Column(BigInteger)
+    is_processed = Column(String(1))
+    is_reset = Column(String(1))
+    created_by = Column(String(1000))
+    created_on = Column(DateTime)
+    updated_by = Column(String(1000))
+    updated_on = Column(DateTime)
+    archived_on = Column(DateTime, nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        Index('ix_205_messages_archive_chat', 'bot_id', 'chat_id', 'message_date'),
+    )
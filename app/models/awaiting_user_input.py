@@ -1,5 +1,5 @@
 #app/models/awaiting_user_input.py
-from sqlalchemy import Column, BigInteger, String, Integer
+from sqlalchemy import Column, BigInteger, String, Integer, DateTime, Index, func
 from sqlalchemy.ext.declarative import declarative_base
 from . import Base
 
@@ -12,7 +12,13 @@ class tbl_300_awaiting_user_input(Base):
     user_id = Column(BigInteger)
     chat_id = Column(BigInteger)
     awaiting_type = Column(String(100))
-    status = Column(String(100))
+    status = Column(String(100))  # AWAITING or GENERATING; an IDLE chat has no row
+    expires_at = Column(DateTime)
+    updated_on = Column(DateTime, server_default=func.now())
+
+    __table_args__ = (
+        Index('ux_300_awaiting_chat', 'bot_id', 'chat_id', unique=True),
+    )
 
     def __repr__(self):
-        return f"<tbl_300_awaiting_user_input(pk_user_status={self.pk_user_status}, channel='{self.channel}', bot_id={self.bot_id}, user_id={self.user_id}, chat_id={self.chat_id}, awaiting_type='{self.awaiting_type}', status='{self.status}')>"
+        return f"<tbl_300_awaiting_user_input(pk_user_status={self.pk_user_status}, channel='{self.channel}', bot_id={self.bot_id}, user_id={self.user_id}, chat_id={self.chat_id}, awaiting_type='{self.awaiting_type}', status='{self.status}', expires_at={self.expires_at})>"
@@ -0,0 +1,18 @@
+# app/models/chat_activity.py
+from sqlalchemy import Column, BigInteger, DateTime, Index, PrimaryKeyConstraint, text
+from . import Base
+
+class ChatActivity(Base):
+    __tablename__ = 'tbl_230_chat_activity'
+
+    bot_id = Column(BigInteger, nullable=False)
+    chat_id = Column(BigInteger, nullable=False)
+    user_id = Column(BigInteger)
+    last_activity_at = Column(DateTime, nullable=False)  # Naive UTC like tbl_200_messages.message_date
+    reengage_due_at = Column(DateTime)  # NULL once the re-engagement was dispatched, set again by the next message
+
+    # Maintained by add_messages; the partial index only holds chats that still have a pending re-engagement
+    __table_args__ = (
+        PrimaryKeyConstraint('bot_id', 'chat_id', name='pk_230_chat_activity'),
+        Index('ix_230_chat_activity_due', 'reengage_due_at', postgresql_where=text("reengage_due_at IS NOT NULL")),
+    )
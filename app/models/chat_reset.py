@@ -0,0 +1,15 @@
+# app/models/chat_reset.py
+from sqlalchemy import Column, BigInteger, DateTime, PrimaryKeyConstraint
+from . import Base
+
+class ChatReset(Base):
+    __tablename__ = 'tbl_210_chat_resets'
+
+    bot_id = Column(BigInteger, nullable=False)
+    chat_id = Column(BigInteger, nullable=False)
+    reset_at = Column(DateTime, nullable=False)  # Naive UTC like tbl_200_messages.message_date
+
+    # Messages of the (bot, chat) dated at or before reset_at are no longer part of the conversation
+    __table_args__ = (
+        PrimaryKeyConstraint('bot_id', 'chat_id', name='pk_210_chat_resets'),
+    )
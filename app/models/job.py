@@ -0,0 +1,28 @@
+# app/models/job.py
+from sqlalchemy import Column, BigInteger, Integer, String, DateTime, Index, func, text
+from sqlalchemy.dialects.postgresql import JSONB
+from . import Base
+
+class Job(Base):
+    __tablename__ = 'tbl_500_jobs'
+
+    pk_job = Column(BigInteger, primary_key=True, autoincrement=True)
+    job_type = Column(String(100), nullable=False)
+    bot_id = Column(BigInteger, nullable=False)
+    chat_id = Column(BigInteger, nullable=False)
+    payload = Column(JSONB, nullable=False)
+    status = Column(String(20), nullable=False, default='QUEUED')  # QUEUED, RUNNING or FAILED; finished jobs are deleted
+    priority = Column(Integer, nullable=False, default=0)  # Lower values are claimed first
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False)
+    run_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    locked_by = Column(String(200))
+    locked_until = Column(DateTime(timezone=True))
+    last_error = Column(String(4000))
+    created_on = Column(DateTime(timezone=True), server_default=func.now())
+    updated_on = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        Index('ix_500_jobs_claim', 'priority', 'pk_job', postgresql_where=text("status = 'QUEUED'")),
+        Index('ix_500_jobs_chat', 'bot_id', 'chat_id', 'status'),
+    )
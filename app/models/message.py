@@ -1,12 +1,12 @@
 #app/models/message.py
-from sqlalchemy import Column, Integer, BigInteger, String, DateTime, func
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Index, func, text
 from sqlalchemy.ext.declarative import declarative_base
 from . import Base
 
 class tbl_msg(Base):
     __tablename__ = 'tbl_200_messages'
 
-    pk_messages = Column(Integer, primary_key=True, index=True)  # Changed from id to pk_messages
+    pk_messages = Column(Integer, primary_key=True, autoincrement=True, index=True)  # Changed from id to pk_messages
     channel = Column(String(100))
     bot_id = Column(BigInteger, nullable=False) # NOT NULL constraint specified here
     chat_id = Column(BigInteger)
@@ -15,7 +15,7 @@ class tbl_msg(Base):
     role = Column(String(100))
     content_text = Column(String(4000))
     file_id = Column(String(4000))
-    message_date = Column(DateTime) # This matches the TIMESTAMP in your SQL
+    message_date = Column(DateTime, primary_key=True) # Partition key, so part of the primary key
     update_id = Column(BigInteger)
     message_id = Column(BigInteger)
     is_processed = Column(String(1))
@@ -24,3 +24,10 @@ class tbl_msg(Base):
     created_on = Column(DateTime, default=func.now()) # Default to the current timestamp
     updated_by = Column(String(1000))
     updated_on = Column(DateTime, default=func.now(), onupdate=func.now()) # Updated timestamp on update
+
+    __table_args__ = (
+        Index('ix_200_messages_history', 'bot_id', 'chat_id', 'message_date'),
+        Index('ix_200_messages_unprocessed', 'bot_id', 'chat_id', 'message_date', postgresql_where=text("is_processed = 'N'")),
+        # One partition per month, see app/utils/message_archive.py
+        {'postgresql_partition_by': 'RANGE (message_date)'},
+    )
@@ -0,0 +1,16 @@
+# app/models/processed_update.py
+from sqlalchemy import Column, BigInteger, String, DateTime, Index, PrimaryKeyConstraint, func
+from . import Base
+
+class ProcessedUpdate(Base):
+    __tablename__ = 'tbl_110_processed_updates'
+
+    bot_short_name = Column(String(100), nullable=False)
+    update_id = Column(BigInteger, nullable=False)
+    received_on = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    # The primary key is what makes a redelivered update_id lose the race in every process
+    __table_args__ = (
+        PrimaryKeyConstraint('bot_short_name', 'update_id', name='pk_110_processed_updates'),
+        Index('ix_110_processed_updates_received_on', 'received_on'),
+    )
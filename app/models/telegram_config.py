@@ -1,5 +1,5 @@
 # app/models/telegram_config.py
-from sqlalchemy import Column, Integer, String, DateTime
+from sqlalchemy import Column, Integer, String, DateTime, Index
 from . import Base
 
 class TelegramConfig(Base):
@@ -18,8 +18,13 @@ class TelegramConfig(Base):
     bot_presence_penalty = Column(Integer)
     bot_frequency_penalty = Column(Integer)
     bot_default_reply = Column(String(4000))
+    bot_history_budget_chars = Column(Integer)
     created_by = Column(String(1000))
     created_on = Column(DateTime)
     updated_by = Column(String(1000))
     updated_on = Column(DateTime)
+
+    __table_args__ = (
+        Index('ux_100_telegram_config_short_name', 'bot_short_name', unique=True),
+    )
     
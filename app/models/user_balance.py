@@ -0,0 +1,17 @@
+# app/models/user_balance.py
+from sqlalchemy import Column, BigInteger, DateTime, DECIMAL, PrimaryKeyConstraint, func
+from . import Base
+
+class UserBalance(Base):
+    __tablename__ = 'tbl_460_user_balances'
+
+    pk_bot = Column(BigInteger, nullable=False)
+    user_id = Column(BigInteger, nullable=False)
+    total_credits = Column(DECIMAL(precision=10, scale=2), nullable=False)
+    updated_on = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    # Current balance per (bot, user); tbl_450_user_credits stays the ledger and is appended
+    # in the same statement that moves this row
+    __table_args__ = (
+        PrimaryKeyConstraint('pk_bot', 'user_id', name='pk_460_user_balances'),
+    )
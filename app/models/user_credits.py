@@ -1,6 +1,6 @@
 
 # In ./app/models/user_credits.py
-from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Float, ForeignKey, DECIMAL
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Float, ForeignKey, DECIMAL, Index, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from app.models.payments import Payment
@@ -20,4 +20,8 @@ class UserCredit(Base):
     transaction_date = Column(DateTime, default=datetime.utcnow)
     pk_payment = Column(BigInteger)
     total_credits = Column(DECIMAL(precision=10, scale=2))
+
+    __table_args__ = (
+        Index('ix_450_user_credits_latest', 'user_id', 'pk_bot', text('pk_credit DESC')),
+    )
     
\ No newline at end of file
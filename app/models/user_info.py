@@ -1,5 +1,5 @@
 # In ./app/models/user_info.py
-from sqlalchemy import Column, Integer, BigInteger, String, Boolean, TIMESTAMP
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, TIMESTAMP, Index
 from sqlalchemy.sql import func
 from . import Base
 
@@ -19,3 +19,8 @@ class tbl_150_user_info(Base):
     is_banned = Column(Boolean, nullable=False, default=False)
     pk_bot = Column(Integer)
     channel = Column(String(100))
+
+    __table_args__ = (
+        # Conflict target of the user upsert in load_user_context
+        Index('ux_150_user_info_user', 'id', 'pk_bot', 'channel', unique=True),
+    )
@@ -0,0 +1,19 @@
+# app/routers/admin.py
+from typing import Optional
+from fastapi import APIRouter, HTTPException
+from app.config import TELEGRAM_SECRET_TOKEN
+from app.utils.bot_registry import bot_registry, notify_bot_config_changed
+
+router = APIRouter()
+
+@router.post("/admin/{token}/bot-config/invalidate")
+async def invalidate_bot_config(token: str, bot_short_name: Optional[str] = None):
+    """
+    Drops cached bot configs after tbl_100_telegram_config was edited, in this
+    process and, through NOTIFY, in every other process.
+    """
+    if token != TELEGRAM_SECRET_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid token")
+    bot_registry.invalidate(bot_short_name)
+    await notify_bot_config_changed(bot_short_name)
+    return {"status": "Bot config invalidated", "bot_short_name": bot_short_name}
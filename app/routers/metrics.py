@@ -0,0 +1,15 @@
+# app/routers/metrics.py
+from fastapi import APIRouter, HTTPException
+from app.config import TELEGRAM_SECRET_TOKEN
+from app.utils.metrics import snapshot
+
+router = APIRouter()
+
+@router.get("/metrics/{token}")
+async def get_metrics(token: str):
+    """
+    Returns runtime stats (queues, caches, pools) of this process.
+    """
+    if token != TELEGRAM_SECRET_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid token")
+    return snapshot()
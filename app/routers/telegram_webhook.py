@@ -1,107 +1,44 @@
 # app/routers/telegram_webhook.py
 import logging
 import os
+from functools import partial
 from fastapi import APIRouter, HTTPException, Request, BackgroundTasks, Depends
-from pydantic import BaseModel, Field
-from typing import List, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.schemas import TextMessage
-from app.database import get_db
+from app.schemas import TextMessage, TelegramWebhookPayload, is_handled_update
+from app.database import get_db, AsyncSessionLocal
 from app.database_operations import (
-    get_bot_config_by_short_name_full, get_bot_greeting_msg, check_if_chat_is_awaiting, insert_user_if_not_exists, is_user_banned, add_messages, reset_messages_by_chat_id, manage_awaiting_status, get_latest_total_credits, add_payment_details, update_user_credits
+    load_user_context, UserContext, add_messages, reset_messages_by_chat_id, request_input, get_latest_total_credits, add_payment_details, update_user_credits
 )
 from app.controllers.telegram_integration import send_reset_options, send_credit_count, send_telegram_message, send_credit_purchase_options, send_generate_options, send_invoice, answer_pre_checkout_query
-from app.controllers.message_processing import process_queue
-from app.utils.process_audio import transcribe_audio
-from app.utils.process_photo import caption_photo
+from app.controllers.message_processing import enqueue_process_queue
+from app.utils.job_queue import enqueue_job, register_job_handler, JOB_PRIORITY_LIVE, JOB_PRIORITY_BACKGROUND
+# Imported for their job handler registrations
+import app.utils.process_audio
+import app.utils.process_photo
 
 from decimal import Decimal
 
 from datetime import datetime
 from app.utils.error_handler import error_handler, send_error_notification
-from app.config import TELEGRAM_SECRET_TOKEN
+from app.config import TELEGRAM_SECRET_TOKEN, WEBHOOK_INGEST_MODE, JOB_MAX_ATTEMPTS
+from app.utils.update_queue import update_queue, classify_update
+from app.utils.update_dedup import (
+    is_duplicate_update, forget_update, claim_update, release_update, UpdateProgress, SYNTHETIC_UPDATE_ID
+)
 from slowapi import Limiter
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
-from app.config import bot_config, initialize_bot_config
+from app.utils.bot_registry import bot_registry, BotContext
 
 limiter = Limiter(key_func=get_remote_address)
 
 logger = logging.getLogger(__name__)
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
-logger = logging.getLogger(__name__)
-
-
-class Voice(BaseModel):
-    duration: int
-    mime_type: str
-    file_id: str
-    file_size: int
-
-class PhotoSize(BaseModel):
-    file_id: str
-    file_unique_id: str
-    file_size: int
-    width: int
-    height: int
-
-class Document(BaseModel):
-    file_id: str
-    file_unique_id: str
-    file_size: int
-    file_name: str
-    mime_type: str
-    thumb: PhotoSize = None
-
-class SuccessfulPayment(BaseModel):
-    currency: str
-    total_amount: int
-    invoice_payload: str
-    shipping_option_id: Optional[str] = None
-    order_info: Optional[dict] = None
-    telegram_payment_charge_id: str
-    provider_payment_charge_id: str
-
-class Message(BaseModel):
-    message_id: int
-    from_: dict = Field(None, alias='from')
-    chat: dict
-    date: int
-    text: Optional[str] = None
-    voice: Optional[Voice] = None
-    photo: Optional[List[PhotoSize]] = None
-    document: Optional[Document] = None
-    caption: Optional[str] = None
-    successful_payment: Optional[SuccessfulPayment] = None
-
-class CallbackQuery(BaseModel):
-    id: str
-    from_: dict = Field(None, alias='from')
-    message: Optional[Message] = None  # Ensure Message is defined as per your existing model
-    data: str
-
-class PreCheckoutQuery(BaseModel):
-    id: str
-    from_: dict = Field(..., alias='from')
-    currency: str
-    total_amount: int
-    invoice_payload: str
-    shipping_option_id: Optional[str] = None
-    order_info: Optional[dict] = None
-    
-class TelegramWebhookPayload(BaseModel):
-    update_id: int
-    message: Optional[Message] = None
-    callback_query: Optional[CallbackQuery] = None
-    pre_checkout_query: Optional[PreCheckoutQuery] = None
-    
 
 router = APIRouter()
 
-async def process_message_type(message_data, chat_id, user_id, message_id, bot_id, bot_short_name, background_tasks, db, payload, request):
-    message_type, process_task, text_prefix = None, None, ""
+async def process_message_type(message_data, chat_id, user_id, message_id, bot: BotContext, db, update_id: int, user_ctx: UserContext, progress: UpdateProgress):
+    message_type, job_type, text_prefix = None, None, ""
     ai_placeholder = "[AI PLACEHOLDER]"
     task_params = {} 
 
@@ -115,103 +52,197 @@ async def process_message_type(message_data, chat_id, user_id, message_id, bot_i
         message_type = 'TEXT'
         text_prefix = message_data.text
         if message_data.text == "/start":
-            predefined_response_text = await get_bot_greeting_msg(bot_id=bot_config["bot_id"], db=db)
-            await send_telegram_message(chat_id, predefined_response_text, bot_config["bot_token"])
+            predefined_response_text = bot.bot_greeting_msg
+            await send_telegram_message(chat_id, predefined_response_text, bot.bot_token)
             text_prefix = "/start"
             ai_placeholder = predefined_response_text
         else:
-            # Before deciding on the generic process_task, check if the chat is awaiting specific input
-            if await check_if_chat_is_awaiting(db=db, chat_id=chat_id, awaiting_type="AUDIO"):
+            # Before deciding on the generic job_type, check if the chat is awaiting specific input
+            if user_ctx.awaiting_type == "AUDIO":
                 text_prefix = f"[SYSTEM MSG: REPLY SHORT MAX 50 CHARACTERS] {message_data.text}"
-                # Adjust process_task and task_params as needed for AUDIO processing
-                process_task = process_queue  
-                task_params = {'chat_id': chat_id, 'bot_id': bot_config["bot_id"], 'user_id': user_id}
-            elif await check_if_chat_is_awaiting(db=db, chat_id=chat_id, awaiting_type="PHOTO"):
+                # Adjust job_type and task_params as needed for AUDIO processing
+                job_type = "process_queue"
+                task_params = {'chat_id': chat_id, 'bot_id': bot.bot_id, 'user_id': user_id}
+            elif user_ctx.awaiting_type == "PHOTO":
                 text_prefix = f"[SYSTEM MSG: REPLY SHORT MAX 50 CHARACTERS] {message_data.text}"
                 text_prefix = f"{message_data.text}"
-                # Adjust process_task and task_params as needed for PHOTO processing
-                process_task = process_queue  
-                task_params = {'chat_id': chat_id, 'bot_id': bot_config["bot_id"], 'user_id': user_id}
+                # Adjust job_type and task_params as needed for PHOTO processing
+                job_type = "process_queue"
+                task_params = {'chat_id': chat_id, 'bot_id': bot.bot_id, 'user_id': user_id}
             else:
-                process_task = process_queue
-                task_params = {'chat_id': chat_id, 'bot_id': bot_config["bot_id"], 'user_id': user_id}
+                job_type = "process_queue"
+                task_params = {'chat_id': chat_id, 'bot_id': bot.bot_id, 'user_id': user_id}
                 logger.info(f"task_params text set")
 
     elif message_data.photo:
         message_type = 'PHOTO'
-        process_task = caption_photo
+        job_type = "caption_photo"
         text_prefix = "[PROCESSING PHOTO]"
         user_caption = message_data.caption if message_data.caption else None
-        task_params = { 'background_tasks': background_tasks,'bot_id': bot_config["bot_id"], 'chat_id': chat_id, 'user_id': user_id, 'user_caption': user_caption}
+        task_params = {'bot_id': bot.bot_id, 'chat_id': chat_id, 'user_id': user_id, 'user_caption': user_caption}
 
     elif message_data.document and message_data.document.mime_type.startswith("image/"):
         message_type = 'DOCUMENT'
-        process_task = caption_photo
+        job_type = "caption_photo"
         text_prefix = "[PROCESSING DOCUMENT AS PHOTO]"
         user_caption = message_data.caption if message_data.caption else None
-        task_params = {'background_tasks': background_tasks,'bot_id': bot_config["bot_id"], 'chat_id': chat_id, 'user_id': user_id,'user_caption': user_caption}
+        task_params = {'bot_id': bot.bot_id, 'chat_id': chat_id, 'user_id': user_id,'user_caption': user_caption}
 
     elif message_data.voice:
         message_type = 'AUDIO'
-        process_task = transcribe_audio
+        job_type = "transcribe_audio"
         text_prefix = "[TRANSCRIBING AUDIO]"
-        task_params = {'background_tasks': background_tasks, 'bot_id': bot_config["bot_id"], 'chat_id': chat_id, 'user_id': user_id}  # common parameters for transcribe_audio
+        task_params = {'bot_id': bot.bot_id, 'chat_id': chat_id, 'user_id': user_id}  # common parameters for transcribe_audio
 
     if message_type:
         
         messages_info = [
-            {'message_data': TextMessage(chat_id=chat_id, user_id=user_id, bot_id=bot_config["bot_id"], message_text=text_prefix, message_id=message_id, channel="TELEGRAM", update_id=payload['update_id']), 'type': message_type, 'role': 'USER', 'is_processed': 'N'},
-            {'message_data': TextMessage(chat_id=chat_id, user_id=user_id, bot_id=bot_config["bot_id"], message_text=ai_placeholder, message_id=message_id, channel="TELEGRAM", update_id=payload['update_id']), 'type': 'TEXT', 'role': 'ASSISTANT', 'is_processed': 'S'}
+            {'message_data': TextMessage(chat_id=chat_id, user_id=user_id, bot_id=bot.bot_id, message_text=text_prefix, message_id=message_id, channel="TELEGRAM", update_id=update_id), 'type': message_type, 'role': 'USER', 'is_processed': 'N'},
+            {'message_data': TextMessage(chat_id=chat_id, user_id=user_id, bot_id=bot.bot_id, message_text=ai_placeholder, message_id=message_id, channel="TELEGRAM", update_id=update_id), 'type': 'TEXT', 'role': 'ASSISTANT', 'is_processed': 'S'}
         ]
 
         logger.info(f"added_messages 1")
+        progress.mark_written()
         added_messages = await add_messages(db, messages_info)
         logger.info(f"added_messages 2")
-        if process_task and len(added_messages) > 1:
+        if job_type and len(added_messages) > 1:
             # Add specific parameters based on the message type
             task_specific_params = {'message_pk': added_messages[0].pk_messages, 'ai_placeholder_pk': added_messages[1].pk_messages}
-            if message_data.photo or message_data.voice or message_data.document:
+            # The awaiting state read with the user context travels with the job instead of being queried again
+            task_specific_params['awaiting_type'] = user_ctx.awaiting_type
+            if job_type == "process_queue":
+                priority = JOB_PRIORITY_BACKGROUND if update_id == SYNTHETIC_UPDATE_ID else JOB_PRIORITY_LIVE
+                await enqueue_process_queue(db, **task_params, **task_specific_params, priority=priority)
+            else:
                 task_specific_params['file_id'] = message_data.photo[-1].file_id if message_data.photo else message_data.document.file_id if message_data.document else message_data.voice.file_id
-            
-            all_task_params = {**task_params, **task_specific_params, 'request': request, 'db': db}  # Merge common and specific parameters
-            background_tasks.add_task(process_task, **all_task_params)
-            logger.info(f"background_tasks set")
+                all_task_params = {**task_params, **task_specific_params}  # Merge common and specific parameters
+                await enqueue_job(db, job_type, bot_id=task_params['bot_id'], chat_id=chat_id, payload=all_task_params)
+            logger.info(f"{job_type} job queued")
 
 @router.post("/telegram-webhook/{token}/{bot_short_name}")
 @limiter.limit("10/10 seconds")
 @error_handler
 async def telegram_webhook(background_tasks: BackgroundTasks, request: Request, token: str, bot_short_name: str, db: AsyncSession = Depends(get_db)):
-    chat_id = None  # Declare chat_id outside the try block for wider scope
-    user_id = None  # Similarly, declare user_id for broader access
-    
     logger.debug(f"Received request with token: {token}, bot_short_name: {bot_short_name}")
     
     if token != TELEGRAM_SECRET_TOKEN:
         logger.warning("Invalid token received")
         raise HTTPException(status_code=403, detail="Invalid token")
-    
+
+    body = await request.body()
+    logger.debug('Raw JSON Payload: %s', body)
+
+    if not is_handled_update(body):
+        return {"status": "Update type not handled"}
+
     try:
-        payload = await request.json()
-        logger.debug('Raw JSON Payload: %s', payload)
-        
-        payload_obj = TelegramWebhookPayload(**payload)
-        logger.debug('Parsed Payload: %s', payload_obj.dict())
-        
-        async with db as session:
-            try:
-                bot_config_data = await get_bot_config_by_short_name_full(session, bot_short_name)
-            except Exception as e:
-                logger.error(f"Failed to fetch bot config: {e}")
-                raise
+        # Decoded once, straight from the bytes into the models
+        payload_obj = TelegramWebhookPayload.model_validate_json(body)
+        # Shared with error_handler so it does not decode the body again
+        request.state.telegram_update = payload_obj
+    except Exception as e:
+        logger.error(f"Invalid webhook payload: {e}")
+        raise HTTPException(status_code=400, detail="Invalid payload")
+
+    if is_duplicate_update(bot_short_name, payload_obj.update_id):
+        return {"status": "Duplicate update ignored"}
+
+    if WEBHOOK_INGEST_MODE == "queue":
+        job = partial(process_queued_update, payload_obj, bot_short_name)
+        if not update_queue.submit(classify_update(payload_obj), job):
+            # Telegram redelivers on non-2xx responses, so a full queue just defers the update;
+            # it was never claimed, so its redelivery must not be taken for a duplicate
+            forget_update(bot_short_name, payload_obj.update_id)
+            raise HTTPException(status_code=503, detail="Update queue is full", headers={"Retry-After": "5"})
+        return {"status": "Update queued"}
+
+    return await handle_telegram_update(payload_obj, bot_short_name, background_tasks, db)
+
+
+async def process_queued_update(payload_obj: TelegramWebhookPayload, bot_short_name: str):
+    """
+    Runs a queued update on an update worker with its own session.
+    """
+    background_tasks = BackgroundTasks()
+    async with AsyncSessionLocal() as db:
+        try:
+            await handle_telegram_update(payload_obj, bot_short_name, background_tasks, db, delivery="queue")
+        except HTTPException:
+            pass  # Already logged and the user notification is queued in background_tasks
+    # Only error notifications end up here, the heavy work goes through the job queue
+    await background_tasks()
+
+
+async def telegram_update_job(db: AsyncSession, attempts: int, update: dict, bot_short_name: str, **kwargs):
+    """
+    Retries a queued update that failed on its update worker. Telegram got its 200 long
+    ago and will not redeliver it, so the job queue's backoff takes over.
+    """
+    payload_obj = TelegramWebhookPayload.model_validate(update)
+    background_tasks = BackgroundTasks()
+    try:
+        await handle_telegram_update(payload_obj, bot_short_name, background_tasks, db, delivery="job")
+    except HTTPException:
+        # The user hears about the failure only once no retry is left
+        if attempts >= JOB_MAX_ATTEMPTS:
+            await background_tasks()
+        raise
+    await background_tasks()
+
+
+register_job_handler("telegram_update", telegram_update_job)
+
+
+async def defer_update_to_job(db: AsyncSession, payload_obj: TelegramWebhookPayload, bot_short_name: str, bot, chat_id):
+    """Hands a failed queued update over to the durable job queue."""
+    try:
+        await db.rollback()
+        await enqueue_job(
+            db, "telegram_update",
+            # Job rows need both; updates that failed before the bot or chat was known share 0
+            bot_id=bot.bot_id if bot else 0,
+            chat_id=chat_id or 0,
+            payload={"update": payload_obj.model_dump(by_alias=True, mode="json", exclude_none=True),
+                     "bot_short_name": bot_short_name},
+        )
+    except Exception as e:
+        logger.error(f"Failed to defer update {payload_obj.update_id} for {bot_short_name} to the job queue, it is lost: {e}")
+
 
-        initialize_bot_config(bot_config_data)
+async def handle_telegram_update(payload_obj: TelegramWebhookPayload, bot_short_name: str, background_tasks: BackgroundTasks,
+                                 db: AsyncSession, delivery: str = "webhook"):
+    """
+    delivery tells what happens to a failed update: "webhook" releases its claim so that
+    Telegram redelivers it, "queue" (Telegram already has its 200) moves it to the job
+    queue, and "job" raises for the job queue to retry. An update that failed after a
+    write it would repeat is never run again.
+    """
+    chat_id = None  # Declare chat_id outside the try block for wider scope
+    user_id = None  # Similarly, declare user_id for broader access
+    bot = None
+    progress = UpdateProgress()
+
+    try:
+        # Claimed before any other DB write or outbound call so a redelivery can never run twice;
+        # a retry job runs an update its first attempt already claimed
+        if delivery != "job" and not await claim_update(db, bot_short_name, payload_obj.update_id):
+            return {"status": "Duplicate update ignored"}
+
+        try:
+            bot = await bot_registry.get_by_short_name(bot_short_name)
+        except Exception as e:
+            logger.error(f"Failed to fetch bot config: {e}")
+            raise
+        if bot is None:
+            logger.warning(f"No bot config found for {bot_short_name}, ignoring update")
+            return {"status": "Unknown bot"}
 
         # Handling callback_query for inline keyboard responses
-        if 'callback_query' in payload:
-            callback_query = payload['callback_query']
-            chat_id = callback_query['message']['chat']['id']
-            user_id = callback_query['from']['id']
-            data = callback_query['data']
+        if payload_obj.callback_query:
+            callback_query = payload_obj.callback_query
+            chat_id = callback_query.message.chat['id']
+            user_id = callback_query.from_['id']
+            data = callback_query.data
 
             if data.startswith("buy_"):
                 credit_amounts = {
@@ -236,37 +267,35 @@ async def telegram_webhook(background_tasks: BackgroundTasks, request: Request,
 
                 prices = [{"label": "Service Fee", "amount": amount}]
                 currency = "USD"
-                payload = data
 
                 await send_invoice(
                     chat_id=chat_id,
                     title=title,
                     description=description,
-                    payload=payload,
+                    payload=data,
                     currency=currency,
                     prices=prices,
-                    bot_token=bot_config["bot_token"],
+                    bot_token=bot.bot_token,
                     start_parameter="example"
                 )
-                
-            data = payload_obj.callback_query.data
 
             # Depending on the callback data, trigger the corresponding function
             if data == "generate_photo":
-                await manage_awaiting_status(db, channel='TELEGRAM', chat_id=chat_id, bot_id=bot_config["bot_id"], user_id=user_id, awaiting_type='PHOTO')
-                await send_telegram_message(chat_id=chat_id, text="Please send me the text description for the photo you want to generate", bot_token=bot_config["bot_token"])
+                await request_input(db, channel='TELEGRAM', bot_id=bot.bot_id, chat_id=chat_id, user_id=user_id, awaiting_type='PHOTO')
+                await send_telegram_message(chat_id=chat_id, text="Please send me the text description for the photo you want to generate", bot_token=bot.bot_token)
             
             if data == "generate_audio":
-                await manage_awaiting_status(db, channel='TELEGRAM', chat_id=chat_id, bot_id=bot_config["bot_id"], user_id=user_id, awaiting_type='AUDIO')
-                await send_telegram_message(chat_id=chat_id, text="Please tell me what you want to hear", bot_token=bot_config["bot_token"])
+                await request_input(db, channel='TELEGRAM', bot_id=bot.bot_id, chat_id=chat_id, user_id=user_id, awaiting_type='AUDIO')
+                await send_telegram_message(chat_id=chat_id, text="Please tell me what you want to hear", bot_token=bot.bot_token)
            
             if data == "ask_credit":
-                await send_credit_purchase_options(chat_id, bot_config["bot_token"])
+                await send_credit_purchase_options(chat_id, bot.bot_token)
            
             if data == "reset_yes":
-                await reset_messages_by_chat_id(db=db, chat_id=chat_id)
-                predefined_response_text = await get_bot_greeting_msg(bot_id=bot_config["bot_id"], db=db)
-                await send_telegram_message(chat_id=chat_id,  text=predefined_response_text, bot_token=bot_config["bot_token"])
+                progress.mark_written()
+                await reset_messages_by_chat_id(db=db, chat_id=chat_id, bot_id=bot.bot_id)
+                predefined_response_text = bot.bot_greeting_msg
+                await send_telegram_message(chat_id=chat_id,  text=predefined_response_text, bot_token=bot.bot_token)
 
             return {"status": "Callback query processed successfully"}
 
@@ -279,57 +308,57 @@ async def telegram_webhook(background_tasks: BackgroundTasks, request: Request,
 
         if payload_obj.message and payload_obj.message.text == "/generate":
         
-            await send_generate_options(chat_id, bot_config["bot_token"])
+            await send_generate_options(chat_id, bot.bot_token)
             return {"status": "Generate command processed"}
 
         if payload_obj.message and payload_obj.message.text == "/getvoice":
 
-            # Mark the chat as awaiting voice input in the database
-            await manage_awaiting_status(db, channel='TELEGRAM', chat_id=chat_id, bot_id=bot_config["bot_id"], user_id=user_id, awaiting_type='AUDIO')
+            # Move the chat to AWAITING AUDIO until the user answers or the request expires
+            await request_input(db, channel='TELEGRAM', bot_id=bot.bot_id, chat_id=chat_id, user_id=user_id, awaiting_type='AUDIO')
 
             # Send a prompt to the user asking for the voice input
-            await send_telegram_message(chat_id=chat_id, text="Please tell me what you want to hear", bot_token=bot_config["bot_token"])
+            await send_telegram_message(chat_id=chat_id, text="Please tell me what you want to hear", bot_token=bot.bot_token)
 
             return {"status": "Awaiting voice input"}
 
 
         if payload_obj.message and payload_obj.message.text == "/getphoto":
 
-            # Mark the chat as awaiting photo input in the database
-            await manage_awaiting_status(db, channel='TELEGRAM', chat_id=chat_id, bot_id=bot_config["bot_id"], user_id=user_id, awaiting_type='PHOTO')
+            # Move the chat to AWAITING PHOTO until the user answers or the request expires
+            await request_input(db, channel='TELEGRAM', bot_id=bot.bot_id, chat_id=chat_id, user_id=user_id, awaiting_type='PHOTO')
 
             # Send a prompt to the user asking for the text input to generate the photo
-            await send_telegram_message(chat_id=chat_id, text="Please send me the text description for the photo you want to generate", bot_token= bot_config["bot_token"])
+            await send_telegram_message(chat_id=chat_id, text="Please send me the text description for the photo you want to generate", bot_token= bot.bot_token)
 
             return {"status": "Awaiting text input for photo generation"}
 
         if payload_obj.message and payload_obj.message.text == "/credits":
 
             # Retrieve the total credits for the user
-            await send_credit_count(chat_id=chat_id, bot_token=bot_config["bot_token"], total_credits=await get_latest_total_credits(db=db,  user_id=user_id, bot_id=bot_config["bot_id"]))
+            await send_credit_count(chat_id=chat_id, bot_token=bot.bot_token, total_credits=await get_latest_total_credits(db=db,  user_id=user_id, bot_id=bot.bot_id))
             return {"status": "Credits information sent"}
             
             
         if payload_obj.message and payload_obj.message.text == "/payment":
             
-            await send_credit_purchase_options(chat_id, bot_config["bot_token"])
+            await send_credit_purchase_options(chat_id, bot.bot_token)
             return {"status": "Payment command processed"}
 
         if payload_obj.message and payload_obj.message.text == "/reset":
             
-            await send_reset_options(chat_id, bot_config["bot_token"])
+            await send_reset_options(chat_id, bot.bot_token)
             return {"status": "Send reset command processed"}
 
 
         
-        if 'pre_checkout_query' in payload:
+        if payload_obj.pre_checkout_query:
             
             logger.debug(f"PreCheckoutQuery data: {payload_obj.pre_checkout_query}")
             
             #if payload_obj.pre_checkout_query:
             pre_checkout_query_id = payload_obj.pre_checkout_query.id
             try:
-                await answer_pre_checkout_query(pre_checkout_query_id, ok=True, bot_token=bot_config["bot_token"])
+                await answer_pre_checkout_query(pre_checkout_query_id, ok=True, bot_token=bot.bot_token)
                 logger.info(f"PreCheckoutQuery {pre_checkout_query_id} answered successfully.")
             except Exception as e:
                 logger.error(f"Failed to answer PreCheckoutQuery {pre_checkout_query_id}: {e}")
@@ -377,6 +406,7 @@ async def telegram_webhook(background_tasks: BackgroundTasks, request: Request,
             }
             # Initialize pk_payment to None
             pk_payment = None
+            progress.mark_written()
             # Log the successful transaction
             try:
                 pk_payment = await add_payment_details(db, payment_info)
@@ -386,7 +416,7 @@ async def telegram_webhook(background_tasks: BackgroundTasks, request: Request,
 
             user_credit_info = {
                 "channel": "TELEGRAM",
-                "pk_bot": bot_config["bot_id"],
+                "pk_bot": bot.bot_id,
                 "user_id": payload_obj.message.from_.get('id'),
                 "chat_id": payload_obj.message.chat.get('id'),
                 "credits": credits_to_add,  # The number of credits to add
@@ -403,8 +433,8 @@ async def telegram_webhook(background_tasks: BackgroundTasks, request: Request,
             try:
                 # After updating user credits successfully
                 confirmation_text = "Thank you for your payment! 💋💋💋"
-                await send_telegram_message(payload_obj.message.chat['id'], confirmation_text, bot_config["bot_token"])
-                await send_credit_count(chat_id=chat_id, bot_token=bot_config["bot_token"], total_credits=await get_latest_total_credits(db=db,  user_id=user_id, bot_id=bot_config["bot_id"]))
+                await send_telegram_message(payload_obj.message.chat['id'], confirmation_text, bot.bot_token)
+                await send_credit_count(chat_id=chat_id, bot_token=bot.bot_token, total_credits=await get_latest_total_credits(db=db,  user_id=user_id, bot_id=bot.bot_id))
 
                 logger.info(f"Payment confirmed for chat_id {payload_obj.message.chat['id']}.")
             except Exception as e:
@@ -413,23 +443,14 @@ async def telegram_webhook(background_tasks: BackgroundTasks, request: Request,
             return {"status": "Payment confirmed "}
 
 
-        if payload_obj.message and payload_obj.message.text not in ['/payment','/start', '/credits'] and payload_obj.message.from_:
- 
-            chat_id = payload_obj.message.chat.get('id')
-            user_id = payload_obj.message.from_.get('id')
-            
-            # Perform the credit check after determining user_id and chat_id
-            total_credits = await get_latest_total_credits(db=db, user_id=user_id, bot_id=bot_config["bot_id"])
-            if total_credits <= Decimal('0') and payload_obj.update_id != -1:
-                # User does not have enough credits, send a message and stop further processing
-                await send_telegram_message(chat_id, "You don't have enough credits to perform this operation.", bot_config["bot_token"])
-                await send_credit_count(chat_id=chat_id, bot_token=bot_config["bot_token"], total_credits=total_credits)
-                return {"status": "Insufficient credits"}
-
-        # Use the username as a fallback for last_name if last_name is not provided
-        last_name_or_username = payload_obj.message.from_.get('last_name', payload_obj.message.from_.get('username', ''))
+        if not payload_obj.message or not payload_obj.message.from_:
+            return {"status": "Update type not handled"}
+
+        chat_id = payload_obj.message.chat.get('id')
+        user_id = payload_obj.message.from_.get('id')
+
         user_data = {
-            'id': payload_obj.message.from_.get('id'),
+            'id': user_id,
             'channel': 'TELEGRAM',
             'is_bot': payload_obj.message.from_.get('is_bot', False),
             'first_name': payload_obj.message.from_.get('first_name', ''),
@@ -437,34 +458,50 @@ async def telegram_webhook(background_tasks: BackgroundTasks, request: Request,
             'username': payload_obj.message.from_.get('username', ''),  # Optional, defaulting to empty string as it's not provided
             'language_code': payload_obj.message.from_.get('language_code', ''),  # Optional, using .get() in case it's not present
             'is_premium': False,  # Optional, defaulting to False as it's not provided
-            'pk_bot': bot_config["bot_id"],  # Adding the bot_id as pk_bot
+            'pk_bot': bot.bot_id,  # Adding the bot_id as pk_bot
             'chat_id': chat_id  # Adding chat_id
         }
 
-        # Insert the user if not exists and check if banned
-        inserted = await insert_user_if_not_exists(db, user_data)
-        if inserted:
-            logger.info(f"User {user_data['id']} inserted.")
-        else:
-            logger.info(f"User {user_data['id']} already exists.")
+        # Upserts the user and reads ban flag, balance and awaiting state in one round trip
+        user_ctx = await load_user_context(db, user_data)
 
-        if await is_user_banned(db, user_data['id'],bot_config["bot_id"] , 'TELEGRAM'):
+        if user_ctx.is_banned:
 
-            await send_error_notification(chat_id, bot_short_name, "Your account is banned.")
+            await send_error_notification(chat_id, bot.bot_token, "Your account is banned.")
             
             return {"status": "User is banned"}
 
+        if payload_obj.message.text not in ['/payment','/start', '/credits'] and user_ctx.total_credits <= Decimal('0') and payload_obj.update_id != SYNTHETIC_UPDATE_ID:
+            # User does not have enough credits, send a message and stop further processing.
+            # Only the balance is checked here, the text cost is charged per processed batch
+            await send_telegram_message(chat_id, "You don't have enough credits to perform this operation.", bot.bot_token)
+            await send_credit_count(chat_id=chat_id, bot_token=bot.bot_token, total_credits=user_ctx.total_credits)
+            return {"status": "Insufficient credits"}
+
 
         logger.info(f"Incoming payload is not a special case, procesing with handling of chat messages")
-        # Pass the Pydantic model, chat_id, message_id, bot_id, bot_short_name, background_tasks, and db to process_message_type
-        await process_message_type(payload_obj.message, chat_id, user_id, payload_obj.message.message_id, bot_config["bot_id"], bot_short_name, background_tasks, db, payload, request)
+        # Pass the Pydantic model, chat_id, message_id, bot and user context and db to process_message_type
+        await process_message_type(payload_obj.message, chat_id, user_id, payload_obj.message.message_id, bot, db, payload_obj.update_id, user_ctx, progress)
 
 
     except Exception as e:
         logger.error(f"An error occurred while processing the request: {e}")
-        if chat_id:
+        if progress.written:
+            # Running it again would repeat what it already committed
+            logger.error(f"Update {payload_obj.update_id} for {bot_short_name} failed after writing, not retried")
+            if delivery != "webhook":
+                if chat_id and bot:
+                    background_tasks.add_task(send_error_notification, chat_id, bot.bot_token, "Sorry, something went wrong. Please try again later.")
+                return {"status": "Update failed"}
+        elif delivery == "webhook":
+            # Let Telegram's redelivery of this update through the dedup layer
+            await release_update(db, bot_short_name, payload_obj.update_id)
+        elif delivery == "queue":
+            await defer_update_to_job(db, payload_obj, bot_short_name, bot, chat_id)
+            return {"status": "Update deferred to the job queue"}
+        if chat_id and bot:
             # Use background_tasks to add an error handling task
-            background_tasks.add_task(send_error_notification, chat_id, bot_short_name, "Sorry, something went wrong. Please try again later.")
+            background_tasks.add_task(send_error_notification, chat_id, bot.bot_token, "Sorry, something went wrong. Please try again later.")
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
     return {"status": "Message processed successfully"}
@@ -1,5 +1,6 @@
 #app/schemas.py
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from typing import List, Optional
 from datetime import datetime
 
 class TextMessage(BaseModel):
@@ -10,3 +11,78 @@ class TextMessage(BaseModel):
     message_id: int
     channel: str
     update_id: int
+
+
+class Voice(BaseModel):
+    duration: int
+    mime_type: str
+    file_id: str
+    file_size: int
+
+class PhotoSize(BaseModel):
+    file_id: str
+    file_unique_id: str
+    file_size: int
+    width: int
+    height: int
+
+class Document(BaseModel):
+    file_id: str
+    file_unique_id: str
+    file_size: int
+    file_name: str
+    mime_type: str
+    thumb: PhotoSize = None
+
+class SuccessfulPayment(BaseModel):
+    currency: str
+    total_amount: int
+    invoice_payload: str
+    shipping_option_id: Optional[str] = None
+    order_info: Optional[dict] = None
+    telegram_payment_charge_id: str
+    provider_payment_charge_id: str
+
+class Message(BaseModel):
+    message_id: int
+    from_: dict = Field(None, alias='from')
+    chat: dict
+    date: int
+    text: Optional[str] = None
+    voice: Optional[Voice] = None
+    photo: Optional[List[PhotoSize]] = None
+    document: Optional[Document] = None
+    caption: Optional[str] = None
+    successful_payment: Optional[SuccessfulPayment] = None
+
+class CallbackQuery(BaseModel):
+    id: str
+    from_: dict = Field(None, alias='from')
+    message: Optional[Message] = None  # Ensure Message is defined as per your existing model
+    data: str
+
+class PreCheckoutQuery(BaseModel):
+    id: str
+    from_: dict = Field(..., alias='from')
+    currency: str
+    total_amount: int
+    invoice_payload: str
+    shipping_option_id: Optional[str] = None
+    order_info: Optional[dict] = None
+    
+class TelegramWebhookPayload(BaseModel):
+    update_id: int
+    message: Optional[Message] = None
+    callback_query: Optional[CallbackQuery] = None
+    pre_checkout_query: Optional[PreCheckoutQuery] = None
+
+
+# Top-level keys of the update types handled by the webhook, anything else is dropped before parsing
+HANDLED_UPDATE_KEYS = (b'"message"', b'"callback_query"', b'"pre_checkout_query"')
+
+def is_handled_update(body: bytes) -> bool:
+    """
+    Cheap byte scan run before the body is decoded. It can only give false
+    positives (e.g. a nested key), which then fail through the normal parse.
+    """
+    return any(key in body for key in HANDLED_UPDATE_KEYS)
@@ -1,65 +1,148 @@
 import asyncio
-import httpx
-from datetime import datetime
-from app.config import TELEGRAM_SECRET_TOKEN, HOST_URL
-from app.database_operations import get_users_for_auto_reply
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import sessionmaker
-from app.database import get_db
+from datetime import datetime, timedelta
+from app.config import (
+    HOST_URL, AUTO_REPLY_BATCH_SIZE, AUTO_REPLY_MAX_SLEEP_SECONDS, AUTO_REPLY_SPREAD_SECONDS,
+    AUTO_REPLY_CONCURRENCY, KEEP_ALIVE_INTERVAL_SECONDS
+)
+from app.database_operations import (
+    claim_due_reengagements, reschedule_reengagement, get_next_reengagement_due, backfill_chat_activity
+)
+from app.database import BackgroundSessionLocal
+from app.routers.telegram_webhook import process_queued_update
+from app.schemas import TelegramWebhookPayload
+from app.utils.bot_registry import bot_registry
+from app.utils.http_clients import http_clients
+from app.utils.update_dedup import SYNTHETIC_UPDATE_ID
+from app.utils.update_queue import update_queue, PRIORITY_SYNTHETIC
+from app.utils.metrics import register_collector
 import logging
 
 logger = logging.getLogger(__name__)
 
-from app.config import SQLALCHEMY_DATABASE_URL
+REENGAGEMENT_TEXT = "[SYSTEM MESSAGE] Please send a reply to the user based on your previous conversation that will get him excited to continue chatting with you"
 
-engine = create_async_engine(SQLALCHEMY_DATABASE_URL, echo=True, pool_size=20, max_overflow=0)
-AsyncSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, class_=AsyncSession)
+stats = {"dispatched": 0, "failed": 0, "in_flight": 0, "next_due_at": None}
+
+# Synthetic updates submitted to the update queue and not ingested yet. Ingesting only
+# stores the message and enqueues its process_queue job; the reply (and its LLM call)
+# runs on a job worker, so JOB_WORKERS is what bounds those
+in_flight = asyncio.Semaphore(AUTO_REPLY_CONCURRENCY)
 
 
 async def keep_service_alive():
     keep_alive_url = f'{HOST_URL}/keep-alive' 
-    async with httpx.AsyncClient() as client:
-        response = await client.get(keep_alive_url)
-        if response.status_code == 200:
-            logger.info("Keep-alive request successful.")
+    response = await http_clients.get("self").get(keep_alive_url)
+    if response.status_code == 200:
+        logger.info("Keep-alive request successful.")
+    else:
+        logger.error(f"Keep-alive request failed. Response status: {response.status_code}")
+
+async def keep_service_alive_periodically():
+    while True:
+        try:
+            await keep_service_alive()  # Make a dummy call to keep the service alive
+        except Exception as e:
+            logger.error(f"Keep-alive request failed: {e}")
+        await asyncio.sleep(KEEP_ALIVE_INTERVAL_SECONDS)
+
+
+def build_reengagement_update(chat_id: int, user_id: int) -> TelegramWebhookPayload:
+    return TelegramWebhookPayload.model_validate({
+        "update_id": SYNTHETIC_UPDATE_ID,
+        "message": {
+            "message_id": -1,
+            "from": {"id": user_id},
+            "chat": {"id": chat_id},
+            "date": int(datetime.utcnow().timestamp()),
+            "text": REENGAGEMENT_TEXT,
+        }
+    })
+
+
+async def dispatch_automatic_reply(bot_short_name: str, chat_id: int, user_id: int) -> bool:
+    """
+    Feeds the synthetic update straight into the update queue, below every live
+    priority class. Waits while AUTO_REPLY_CONCURRENCY of them are still being ingested.
+    Returns False when the queue is full.
+    """
+    await in_flight.acquire()
+    payload_obj = build_reengagement_update(chat_id, user_id)
+
+    async def run():
+        try:
+            await process_queued_update(payload_obj, bot_short_name)
+        finally:
+            stats["in_flight"] -= 1
+            in_flight.release()
+
+    if not update_queue.submit(PRIORITY_SYNTHETIC, run):
+        in_flight.release()
+        logger.warning(f"Update queue full, automatic reply to chat_id {chat_id} via {bot_short_name} deferred")
+        return False
+    stats["in_flight"] += 1
+    logger.info(f"Automatic reply to user_id: {user_id}, chat_id: {chat_id} queued via bot: {bot_short_name}")
+    return True
+
+
+async def dispatch_due_reengagements() -> int:
+    """Sends the re-engagement of every chat that is due now. Returns how many chats were claimed."""
+    async with BackgroundSessionLocal() as db:
+        chats = await claim_due_reengagements(db, AUTO_REPLY_BATCH_SIZE)
+    if chats:
+        logger.info(f"Identified {len(chats)} chats for automatic replies")
+
+    # Spread the batch over the window so a burst of due chats does not hit the LLM at once
+    spacing = AUTO_REPLY_SPREAD_SECONDS / len(chats) if chats else 0
+    for index, chat in enumerate(chats):
+        if index:
+            await asyncio.sleep(spacing)
+        sent = False
+        try:
+            bot = await bot_registry.get_by_id(chat.bot_id)
+            if bot is None:
+                logger.warning(f"No bot config for bot_id {chat.bot_id}, skipping automatic reply to chat_id {chat.chat_id}")
+                continue
+            sent = await dispatch_automatic_reply(bot.bot_short_name, chat.chat_id, chat.user_id)
+        except Exception as e:
+            logger.error(f"Automatic reply to chat_id {chat.chat_id} failed: {e}")
+        if sent:
+            stats["dispatched"] += 1
         else:
-            logger.error(f"Keep-alive request failed. Response status: {response.status_code}")
-            
+            stats["failed"] += 1
+            async with BackgroundSessionLocal() as db:
+                await reschedule_reengagement(db, chat.bot_id, chat.chat_id,
+                                              datetime.utcnow() + timedelta(seconds=AUTO_REPLY_MAX_SLEEP_SECONDS))
+    return len(chats)
+
+
 async def check_and_trigger_responses():
+    """
+    Re-engages idle chats. Each pass only touches the chats that are due, then sleeps
+    until the earliest pending due time (bounded by AUTO_REPLY_MAX_SLEEP_SECONDS).
+    """
+    try:
+        async with BackgroundSessionLocal() as db:
+            await backfill_chat_activity(db)
+    except Exception as e:
+        logger.error(f"Failed to backfill chat activity: {e}")
+
     while True:
         try:
-            await keep_service_alive()  # Make a dummy call to keep the service alive
-            logger.debug("Starting to check for users eligible for automatic replies.")
-            async for db in get_db():
-                users = await get_users_for_auto_reply(db)
-                if users:
-                    logger.info(f"Identified {len(users)} users for automatic replies: {users}")
-                else:
-                    logger.info("No users identified for automatic replies at this time.")
-
-                for chat_id, user_id, bot_short_name in users:
-                    payload = {
-                        "update_id": -1,
-                        "message": {
-                            "message_id": -1,
-                            "from": {"id": user_id},
-                            "chat": {"id": chat_id},
-                            "date": int(datetime.utcnow().timestamp()),
-                            "text": "[SYSTEM MESSAGE] Please send a reply to the user based on your previous conversation that will get him excited to continue chatting with you",
-                        }
-                    }
-                    url = f'{HOST_URL}/telegram-webhook/{TELEGRAM_SECRET_TOKEN}/{bot_short_name}'
-
-                    logger.info(f"Sending automatic reply to user_id: {user_id}, chat_id: {chat_id}, via bot: {bot_short_name}")
-                    async with httpx.AsyncClient() as client:
-                        response = await client.post(url, json=payload)
-                        if response.status_code == 200:
-                            logger.info(f"Successfully sent automatic reply to user_id: {user_id}, chat_id: {chat_id}")
-                        else:
-                            logger.error(f"Failed to send automatic reply to user_id: {user_id}, chat_id: {chat_id}. Response status: {response.status_code}")
-
-            logger.debug("Finished sending automatic replies.")
-            await asyncio.sleep(30) 
+            claimed = await dispatch_due_reengagements()
+            if claimed >= AUTO_REPLY_BATCH_SIZE:
+                continue  # More chats are due right now
+
+            async with BackgroundSessionLocal() as db:
+                next_due = await get_next_reengagement_due(db)
+            stats["next_due_at"] = next_due.isoformat() if next_due else None
+            delay = AUTO_REPLY_MAX_SLEEP_SECONDS
+            if next_due is not None:
+                delay = min(delay, max(1.0, (next_due - datetime.utcnow()).total_seconds()))
+            logger.debug(f"Next automatic reply check in {delay:.0f}s")
+            await asyncio.sleep(delay)
         except Exception as e:
             logger.error(f"An error occurred: {e}")
-            await asyncio.sleep(10)  # Wait a bit before trying again to avoid spamming logs in case of a persistent error.
\ No newline at end of file
+            await asyncio.sleep(10)  # Wait a bit before trying again to avoid spamming logs in case of a persistent error.
+
+
+register_collector("automatic_reply", lambda: dict(stats))
@@ -0,0 +1,132 @@
+# app/utils/bot_registry.py
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import text
+
+from app.config import BOT_CONFIG_TTL_SECONDS, BOT_CONFIG_NEGATIVE_TTL_SECONDS
+from app.database import AsyncSessionLocal, add_notify_listener, read_router
+from app.database_operations import get_bot_config_by_short_name_full, get_bot_config_by_id_full
+from app.utils.metrics import register_collector
+
+logger = logging.getLogger(__name__)
+
+BOT_CONFIG_CHANNEL = "eiei_bot_config"
+
+
+@dataclass(frozen=True)
+class BotContext:
+    """Immutable per-request view of a row of tbl_100_telegram_config."""
+    bot_id: int
+    bot_token: str
+    bot_short_name: str
+    bot_voice_id: Optional[str] = None
+    bot_assistant_prompt: Optional[str] = None
+    bot_greeting_msg: Optional[str] = None
+    bot_history_budget_chars: Optional[int] = None
+
+
+class BotRegistry:
+    """
+    In-memory cache of bot configs keyed by short name and by id. Misses are cached
+    too (for a shorter time) so unknown bot names in webhook URLs stay cheap.
+    """
+
+    def __init__(self, ttl: float, negative_ttl: float):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._by_name: Dict[str, Tuple[float, Optional[BotContext]]] = {}
+        self._by_id: Dict[int, Tuple[float, Optional[BotContext]]] = {}
+        self._locks: Dict[object, asyncio.Lock] = {}
+        self._listener_conn = None
+        self._stats = {"hits": 0, "negative_hits": 0, "loads": 0, "invalidations": 0}
+
+    async def start(self):
+        try:
+            self._listener_conn = await add_notify_listener(BOT_CONFIG_CHANNEL, self._on_notify)
+        except Exception as e:
+            logger.error(f"Failed to LISTEN on {BOT_CONFIG_CHANNEL}, relying on TTL only: {e}")
+
+    async def stop(self):
+        if self._listener_conn is not None:
+            await self._listener_conn.close()
+            self._listener_conn = None
+
+    def _on_notify(self, connection, pid, channel, payload):
+        self.invalidate(payload or None)
+
+    def peek_by_short_name(self, bot_short_name: str) -> Optional[BotContext]:
+        """Returns the cached context without ever querying the database."""
+        entry = self._by_name.get(bot_short_name)
+        return entry[1] if entry else None
+
+    async def get_by_short_name(self, bot_short_name: str) -> Optional[BotContext]:
+        return await self._get(self._by_name, bot_short_name, get_bot_config_by_short_name_full)
+
+    async def get_by_id(self, bot_id: int) -> Optional[BotContext]:
+        return await self._get(self._by_id, bot_id, get_bot_config_by_id_full)
+
+    async def _get(self, cache: dict, key, loader) -> Optional[BotContext]:
+        entry = cache.get(key)
+        if entry and entry[0] > time.monotonic():
+            self._stats["hits" if entry[1] else "negative_hits"] += 1
+            return entry[1]
+
+        # One load per key at a time, concurrent updates for the same bot wait for it
+        lock = self._locks.setdefault((id(cache), key), asyncio.Lock())
+        async with lock:
+            entry = cache.get(key)
+            if entry and entry[0] > time.monotonic():
+                return entry[1]
+            async with AsyncSessionLocal() as db:
+                bot_config_data = await read_router.run(db, ('bot_config',), lambda session: loader(session, key))
+            self._stats["loads"] += 1
+            bot = BotContext(**bot_config_data) if bot_config_data else None
+            self._store(bot, key if cache is self._by_name else None, key if cache is self._by_id else None)
+            return bot
+
+    def _store(self, bot: Optional[BotContext], bot_short_name: Optional[str] = None, bot_id: Optional[int] = None):
+        now = time.monotonic()
+        if bot is None:
+            expires = now + self.negative_ttl
+            if bot_short_name is not None:
+                self._by_name[bot_short_name] = (expires, None)
+            if bot_id is not None:
+                self._by_id[bot_id] = (expires, None)
+            return
+        expires = now + self.ttl
+        self._by_name[bot.bot_short_name] = (expires, bot)
+        self._by_id[bot.bot_id] = (expires, bot)
+
+    def invalidate(self, bot_short_name: Optional[str] = None):
+        """Drops one bot (or every bot when no name is given) from this process's cache."""
+        self._stats["invalidations"] += 1
+        # The edit may not have reached the replica yet, reload from the primary for a while
+        read_router.note_write('bot_config')
+        if bot_short_name is None:
+            self._by_name.clear()
+            self._by_id.clear()
+            logger.info("Invalidated all cached bot configs")
+            return
+        entry = self._by_name.pop(bot_short_name, None)
+        if entry and entry[1]:
+            self._by_id.pop(entry[1].bot_id, None)
+        logger.info(f"Invalidated cached bot config for {bot_short_name}")
+
+    def get_stats(self) -> dict:
+        return {**self._stats, "cached_bots": sum(1 for _, bot in self._by_name.values() if bot)}
+
+
+async def notify_bot_config_changed(bot_short_name: Optional[str] = None):
+    """Tells every process sharing the database to drop its cached config."""
+    async with AsyncSessionLocal() as db:
+        await db.execute(text("SELECT pg_notify(:channel, :payload)"),
+                         {"channel": BOT_CONFIG_CHANNEL, "payload": bot_short_name or ""})
+        await db.commit()
+
+
+bot_registry = BotRegistry(ttl=BOT_CONFIG_TTL_SECONDS, negative_ttl=BOT_CONFIG_NEGATIVE_TTL_SECONDS)
+register_collector("bot_registry", bot_registry.get_stats)
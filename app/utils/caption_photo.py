@@ -1,35 +1,54 @@
 # app/utils/caption_photo.py
 import aiofiles
-import asyncio
-import httpx
 import logging
 from app.config import HUGGINGFACE_API_TOKEN
+from app.utils.http_clients import http_clients
+from app.utils.resilience import call_with_retries, is_transient
 
 logger = logging.getLogger(__name__)
 
-async def get_caption_for_local_photo(photo_file_path: str) -> str:
-    logger.debug(f"Doing caption of {photo_file_path}")
+CAPTION_SERVICES = [
+    'https://api-inference.huggingface.co/models/Salesforce/blip-image-captioning-large',
+    'https://api-inference.huggingface.co/models/nlpconnect/vit-gpt2-image-captioning'
+]
+CAPTION_ATTEMPTS = 5
+
+async def caption_image(photo_content: bytes) -> str:
+    """Captions the image with the first service that answers, retrying the round with backoff."""
     headers = {"Authorization": f"Bearer {HUGGINGFACE_API_TOKEN}"}
-    services = [
-        'https://api-inference.huggingface.co/models/Salesforce/blip-image-captioning-large',
-        'https://api-inference.huggingface.co/models/nlpconnect/vit-gpt2-image-captioning'
-    ]
-    caption = None
+    client = http_clients.get("huggingface")
+
+    async def try_services() -> str:
+        error = None
+        for service in CAPTION_SERVICES:
+            try:
+                caption_resp = await client.post(service, content=photo_content, headers=headers)
+                caption_resp.raise_for_status()
+                caption = caption_resp.json()[0]['generated_text']
+                if caption:
+                    return caption
+            except Exception as e:
+                logger.error(f"Service {service} failed with error: {e}")
+                # Retried as a whole when any service failed in a way worth retrying
+                if error is None or is_transient(e):
+                    error = e
+        if error is not None:
+            raise error
+        return ""
 
-    async with httpx.AsyncClient() as client:
-        async with aiofiles.open(photo_file_path, "rb") as file:
-            photo_content = await file.read()
-            for attempt in range(5):
-                for service in services:
-                    try:
-                        caption_resp = await client.post(service, content=photo_content, headers=headers)
-                        caption_resp.raise_for_status()
-                        caption = caption_resp.json()[0]['generated_text']
-                        if caption:
-                            logger.debug(f"Caption generated {caption}")
-                            return caption
-                    except Exception as e:
-                        logger.error(f"Service {service} failed with error: {e}")
-                        await asyncio.sleep(5)  # Wait for 5 seconds before retrying
+    try:
+        caption = await call_with_retries("huggingface", try_services, attempts=CAPTION_ATTEMPTS,
+                                          retry_result=lambda caption: not caption)
+    except Exception as e:
+        raise Exception(f"Caption service unavailable: {e}") from e
     if not caption:
-        raise Exception("Caption service unavailable after 5 attempts.")
+        raise Exception(f"Caption service unavailable after {CAPTION_ATTEMPTS} attempts.")
+    return caption
+
+async def get_caption_for_local_photo(photo_file_path: str) -> str:
+    logger.debug(f"Doing caption of {photo_file_path}")
+    async with aiofiles.open(photo_file_path, "rb") as file:
+        photo_content = await file.read()
+    caption = await caption_image(photo_content)
+    logger.debug(f"Caption generated {caption}")
+    return caption
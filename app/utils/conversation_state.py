@@ -0,0 +1,39 @@
+# app/utils/conversation_state.py
+import asyncio
+import logging
+from datetime import datetime
+
+from sqlalchemy import delete
+
+from app.config import CONVERSATION_STATE_PURGE_INTERVAL_SECONDS
+from app.database import BackgroundSessionLocal
+from app.models import tbl_300_awaiting_user_input
+
+logger = logging.getLogger(__name__)
+
+# tbl_300_awaiting_user_input holds one row per (bot, chat) that is not IDLE, and is the
+# only record of the state: IDLE -> AWAITING (AUDIO or PHOTO) -> GENERATING -> IDLE. The
+# transitions in database_operations are single statements on the row, so every worker
+# and node sees the same state; a row past its expires_at reads as IDLE.
+IDLE = "IDLE"
+# awaiting_type says what was asked for: AUDIO (/getvoice) or PHOTO (/getphoto)
+AWAITING = "AWAITING"
+GENERATING = "GENERATING"
+
+
+async def purge_expired_states_periodically():
+    """Expired rows already read as IDLE; deleting them keeps the table at one row per active chat."""
+    while True:
+        try:
+            async with BackgroundSessionLocal() as db:
+                result = await db.execute(
+                    delete(tbl_300_awaiting_user_input)
+                    .where(tbl_300_awaiting_user_input.expires_at <= datetime.utcnow())
+                )
+                await db.commit()
+                if result.rowcount:
+                    logger.info(f"Purged {result.rowcount} expired conversation states")
+        except Exception as e:
+            logger.error(f"Failed to purge expired conversation states: {e}")
+        await asyncio.sleep(CONVERSATION_STATE_PURGE_INTERVAL_SECONDS)
+
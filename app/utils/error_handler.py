@@ -3,6 +3,7 @@ from functools import wraps
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
 from app.controllers.telegram_integration import send_telegram_error_message
+from app.utils.bot_registry import bot_registry
 from sqlalchemy.ext.asyncio import AsyncSession
 import logging
 app = FastAPI()
@@ -19,33 +20,25 @@ def error_handler(endpoint):
         request: Request = kwargs.get('request')
         background_tasks: BackgroundTasks = kwargs.get('background_tasks')
         bot_short_name: str = kwargs.get('bot_short_name')
-        try:
-            # Attempt to extract chat_id from the request body for error reporting
-            body = await request.json()
-            chat_id = body.get('message', {}).get('chat', {}).get('id') if body.get('message') else None
-        except:
-            chat_id = None
         try:
             return await endpoint(*args, **kwargs)
         except Exception as e:
             logger.error(f"An error occurred: {e}")
-            if chat_id and background_tasks:  # Check if background_tasks is available
+            # The endpoint leaves the parsed update on request.state, the body is not decoded again
+            update = getattr(request.state, 'telegram_update', None) if request else None
+            chat_id = update.message.chat.get('id') if update and update.message else None
+            # Only a cached config is used here, the database may be what just failed
+            bot = bot_registry.peek_by_short_name(bot_short_name) if bot_short_name else None
+            if chat_id and background_tasks and bot:  # Check if background_tasks is available
                 # If we have a chat_id and background_tasks, attempt to notify the user of the error
-                background_tasks.add_task(send_telegram_error_message, chat_id, "Sorry, something went wrong. Please try again later. e003", bot_short_name)
+                background_tasks.add_task(send_telegram_error_message, chat_id, "Sorry, something went wrong. Please try again later. e003", bot.bot_token)
             # Re-raise the exception to let FastAPI's global exception handler take over
             raise
     return wrapper
 
 
-async def send_error_notification(chat_id: int, bot_short_name: str, error_message: str = "Sorry, something went wrong. Please try again later."):
-    try:
-        await send_telegram_error_message(chat_id, error_message, bot_short_name)
-    except Exception as e:
-        logger.error(f"Failed to send error notification to user: {e}")
-
-async def send_error_notification(chat_id: int, bot_short_name: str, error_message: str = "Sorry, something went wrong. Please try again later."):
+async def send_error_notification(chat_id: int, bot_token: str, error_message: str = "Sorry, something went wrong. Please try again later."):
     try:
-        
-        await send_telegram_error_message(chat_id, error_message, bot_short_name)
+        await send_telegram_error_message(chat_id, error_message, bot_token)
     except Exception as e:
         logger.error(f"Failed to send error notification to user: {e}")
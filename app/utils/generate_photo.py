@@ -1,5 +1,4 @@
 # app/utils/generate_photo.py
-import httpx
 import random
 import logging
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -10,6 +9,7 @@ from typing import Optional
 from b2sdk.v1 import InMemoryAccountInfo, B2Api
 from app.config import B2_APPLICATION_KEY_ID, B2_APPLICATION_KEY, B2_BUCKET_NAME, HOST_URL
 from .file_list_cache import get_cached_file_list
+from .http_clients import http_clients
 from app.controllers.ai_communication import get_photo_filename
 from datetime import datetime, timedelta
 import os
@@ -24,10 +24,10 @@ logger = logging.getLogger(__name__)
 
 
 
-async def generate_photo_from_text(text: str, request: Request) -> Optional[str]:
+async def generate_photo_from_text(text: str) -> Optional[str]:
     try:
         logger.info(f"Generating photo filename from text: {text}")
-        file_name = await get_photo_filename(text, request)
+        file_name = await get_photo_filename(text)
         if file_name:
             logger.info(f"File name generated: {file_name}")
             temp_file_path = await get_image(file_name)
@@ -74,12 +74,12 @@ async def get_image(partial_filename: str):
             b2_file_url = f"https://f005.backblazeb2.com/file/{B2_BUCKET_NAME}/{closest_match}"
             headers = {"Authorization": b2_authorization_token}
             
-            async with httpx.AsyncClient() as client:
-                response = await client.get(b2_file_url, headers=headers)
+            async with http_clients.get("b2").stream("GET", b2_file_url, headers=headers) as response:
 
                 if response.status_code == 200:
                     with open(temp_file_path, "wb") as temp_file:
-                        temp_file.write(response.content)
+                        async for chunk in response.aiter_bytes():
+                            temp_file.write(chunk)
                     
                     # Redirect or serve the file directly here
                     return temp_file_path
@@ -0,0 +1,212 @@
+# app/utils/history_cache.py
+import logging
+import sys
+from bisect import insort
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from app.config import HISTORY_CACHE_MAX_BYTES, HISTORY_CACHE_CHAT_TURNS
+from app.utils.metrics import register_collector
+
+logger = logging.getLogger(__name__)
+
+# Rough per-turn overhead on top of the content (the Turn object, its fields and the pk index entry)
+TURN_OVERHEAD_BYTES = 200
+
+
+@dataclass
+class Turn:
+    pk_messages: int
+    message_date: datetime
+    role: str
+    content_text: Optional[str]
+    is_processed: str
+
+    @property
+    def key(self) -> Tuple[datetime, int]:
+        return (self.message_date, self.pk_messages)
+
+    @property
+    def size(self) -> int:
+        return TURN_OVERHEAD_BYTES + sys.getsizeof(self.content_text or '')
+
+    @property
+    def visible(self) -> bool:
+        # Placeholders ('S') only join the conversation once their reply is written
+        return self.is_processed != 'S'
+
+    def __lt__(self, other):
+        return self.key < other.key
+
+
+class ChatHistory:
+    """
+    The newest turns of one (bot, chat) in date order. complete means no older turn
+    exists since the last reset, so running out of turns is not a reason to hit the database.
+    """
+
+    def __init__(self, turns: List[Turn], complete: bool):
+        self.turns = sorted(turns)
+        self.complete = complete
+        self.size = sum(turn.size for turn in self.turns)
+
+
+def budget_turns(turns_newest_first, budget_chars: int) -> Tuple[List[dict], bool]:
+    """
+    Walks turns newest first and keeps them while their content fits in budget_chars.
+    Returns the kept turns oldest first as {"role", "content"} dicts, and whether the
+    budget was spent (False means the turns ran out first). The newest turn is always kept.
+    """
+    kept = []
+    used = 0
+    spent = False
+    for turn in turns_newest_first:
+        if not turn.visible:
+            continue
+        size = len(turn.content_text or '')
+        if kept and used + size > budget_chars:
+            spent = True
+            break
+        used += size
+        kept.append({"role": turn.role.lower(), "content": turn.content_text})
+    kept.reverse()
+    return kept, spent or used >= budget_chars
+
+
+class HistoryCache:
+    """
+    Write-through cache of recent conversation turns per (bot, chat), filled by the
+    message writes of database_operations. Chats are evicted least recently used once
+    the total footprint passes max_bytes; each chat keeps at most chat_turns turns.
+
+    Only writes made by this process reach the cache, so it is only correct when a chat's
+    messages are written by the process that reads them; it is off unless
+    HISTORY_CACHE_MAX_BYTES is set.
+    """
+
+    def __init__(self, max_bytes: int, chat_turns: int):
+        self.max_bytes = max_bytes
+        self.chat_turns = chat_turns
+        self._chats: "OrderedDict[Tuple[int, int], ChatHistory]" = OrderedDict()
+        self._pk_index: Dict[int, Tuple[int, int]] = {}
+        self._bytes = 0
+        self._stats = {"hits": 0, "misses": 0, "loads": 0, "evictions": 0, "resets": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 and self.chat_turns > 0
+
+    def get(self, bot_id: int, chat_id: int, budget_chars: int) -> Optional[List[dict]]:
+        """The budgeted conversation, or None when the cache cannot answer it."""
+        history = self._chats.get((bot_id, chat_id))
+        if history is not None:
+            turns, spent = budget_turns(reversed(history.turns), budget_chars)
+            if spent or history.complete:
+                self._chats.move_to_end((bot_id, chat_id))
+                self._stats["hits"] += 1
+                return turns
+        self._stats["misses"] += 1
+        return None
+
+    def load(self, bot_id: int, chat_id: int, turns: List[Turn], complete: bool) -> None:
+        """Replaces the cached turns of a chat with rows read from the database."""
+        if not self.enabled:
+            return
+        self._drop((bot_id, chat_id))
+        self._stats["loads"] += 1
+        self._put((bot_id, chat_id), ChatHistory(turns, complete))
+
+    def append(self, bot_id: int, chat_id: int, turn: Turn) -> None:
+        """Adds a freshly inserted message to a chat that is already cached."""
+        key = (bot_id, chat_id)
+        history = self._chats.get(key)
+        if history is None:
+            return
+        if history.turns and turn < history.turns[-1]:
+            insort(history.turns, turn)
+        else:
+            history.turns.append(turn)
+        history.size += turn.size
+        self._bytes += turn.size
+        self._pk_index[turn.pk_messages] = key
+        self._chats.move_to_end(key)
+        while len(history.turns) > self.chat_turns:
+            dropped = history.turns.pop(0)
+            history.size -= dropped.size
+            self._bytes -= dropped.size
+            self._pk_index.pop(dropped.pk_messages, None)
+            history.complete = False
+        self._shrink()
+
+    def update(self, pks: List[int], content_text: Optional[str] = None, is_processed: Optional[str] = None) -> None:
+        """Mirrors an UPDATE of tbl_200_messages on the cached turns it touched."""
+        for pk in pks:
+            key = self._pk_index.get(pk)
+            history = self._chats.get(key) if key else None
+            if history is None:
+                continue
+            for turn in history.turns:
+                if turn.pk_messages != pk:
+                    continue
+                if content_text is not None:
+                    before = turn.size
+                    turn.content_text = content_text
+                    history.size += turn.size - before
+                    self._bytes += turn.size - before
+                if is_processed is not None:
+                    turn.is_processed = is_processed
+                break
+        self._shrink()
+
+    def reset(self, bot_id: int, chat_id: int) -> None:
+        """After a reset the conversation is known to be empty."""
+        if not self.enabled:
+            return
+        self._stats["resets"] += 1
+        self._drop((bot_id, chat_id))
+        self._put((bot_id, chat_id), ChatHistory([], complete=True))
+
+    def invalidate(self, bot_id: int, chat_id: int) -> None:
+        self._drop((bot_id, chat_id))
+
+    def _put(self, key, history: ChatHistory) -> None:
+        if len(history.turns) > self.chat_turns:
+            history.turns = history.turns[-self.chat_turns:]
+            history.size = sum(turn.size for turn in history.turns)
+            history.complete = False
+        self._chats[key] = history
+        self._bytes += history.size
+        for turn in history.turns:
+            self._pk_index[turn.pk_messages] = key
+        self._shrink()
+
+    def _drop(self, key) -> None:
+        history = self._chats.pop(key, None)
+        if history is None:
+            return
+        self._bytes -= history.size
+        for turn in history.turns:
+            self._pk_index.pop(turn.pk_messages, None)
+
+    def _shrink(self) -> None:
+        while self._bytes > self.max_bytes and self._chats:
+            key = next(iter(self._chats))
+            self._drop(key)
+            self._stats["evictions"] += 1
+
+    def get_stats(self) -> dict:
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else None,
+            "chats": len(self._chats),
+            "turns": len(self._pk_index),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+history_cache = HistoryCache(max_bytes=HISTORY_CACHE_MAX_BYTES, chat_turns=HISTORY_CACHE_CHAT_TURNS)
+register_collector("history_cache", history_cache.get_stats)
@@ -0,0 +1,186 @@
+# app/utils/http_clients.py
+import asyncio
+import importlib.util
+import logging
+from dataclasses import dataclass
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from app.config import (
+    TELEGRAM_API_URL, OPENROUTER_URL, HTTP_KEEPALIVE_EXPIRY_SECONDS, HTTP2_ENABLED,
+    HTTP_WARMUP_ON_STARTUP, TELEGRAM_HTTP_MAX_CONNECTIONS, OPENROUTER_HTTP_MAX_CONNECTIONS,
+    OPENROUTER_READ_TIMEOUT_SECONDS
+)
+from app.utils.metrics import register_collector
+
+logger = logging.getLogger(__name__)
+
+# HTTP/2 needs the h2 package (httpx[http2], pinned in requirements.txt); without it
+# the clients fall back to HTTP/1.1 and say so in the log
+H2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+def origin(url: Optional[str]) -> Optional[str]:
+    if not url:
+        return None
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}" if parts.scheme and parts.netloc else None
+
+
+@dataclass(frozen=True)
+class Upstream:
+    name: str
+    base_url: Optional[str]  # warmed up at startup when set
+    max_connections: int
+    max_keepalive: int
+    connect_timeout: float = 5.0
+    read_timeout: float = 30.0
+    write_timeout: float = 30.0
+    pool_timeout: float = 10.0
+    http2: bool = False
+
+
+UPSTREAMS = (
+    # Messages, typing actions, file downloads and uploads for every bot
+    Upstream("telegram", origin(TELEGRAM_API_URL) or "https://api.telegram.org",
+             max_connections=TELEGRAM_HTTP_MAX_CONNECTIONS, max_keepalive=TELEGRAM_HTTP_MAX_CONNECTIONS // 2,
+             read_timeout=30.0, write_timeout=60.0, http2=True),
+    # Completions take seconds to tens of seconds
+    Upstream("openrouter", origin(OPENROUTER_URL), max_connections=OPENROUTER_HTTP_MAX_CONNECTIONS,
+             max_keepalive=OPENROUTER_HTTP_MAX_CONNECTIONS, read_timeout=OPENROUTER_READ_TIMEOUT_SECONDS, http2=True),
+    Upstream("huggingface", "https://api-inference.huggingface.co", max_connections=10, max_keepalive=5, read_timeout=60.0),
+    Upstream("monsterapi", "https://api.monsterapi.ai", max_connections=10, max_keepalive=5, read_timeout=60.0),
+    Upstream("elevenlabs", "https://api.elevenlabs.io", max_connections=10, max_keepalive=5, read_timeout=60.0),
+    Upstream("b2", "https://f005.backblazeb2.com", max_connections=10, max_keepalive=5, read_timeout=60.0),
+    # Our own keep-alive endpoint; not listening yet while the app starts, so never warmed up
+    Upstream("self", None, max_connections=2, max_keepalive=1, read_timeout=10.0),
+)
+
+
+class InstrumentedTransport(httpx.AsyncHTTPTransport):
+    """Counts requests, new connections (through the httpcore trace hook) and pool timeouts."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.stats = {"requests": 0, "new_connections": 0, "pool_timeouts": 0, "transport_errors": 0}
+
+    async def _trace(self, event_name: str, info: dict) -> None:
+        if event_name == "connection.connect_tcp.complete":
+            self.stats["new_connections"] += 1
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.stats["requests"] += 1
+        caller_trace = request.extensions.get("trace")
+        if caller_trace is None:
+            request.extensions["trace"] = self._trace
+        else:
+            async def trace(event_name, info):
+                await self._trace(event_name, info)
+                await caller_trace(event_name, info)
+            request.extensions["trace"] = trace
+        try:
+            return await super().handle_async_request(request)
+        except httpx.PoolTimeout:
+            self.stats["pool_timeouts"] += 1
+            raise
+        except httpx.TransportError:
+            self.stats["transport_errors"] += 1
+            raise
+
+    def pool_state(self) -> dict:
+        # httpcore keeps no counters of its own; read them off the pool
+        connections = list(self._pool.connections)
+        queued = [request for request in getattr(self._pool, "_requests", []) if getattr(request, "connection", None) is None]
+        idle = sum(1 for connection in connections if connection.is_idle())
+        return {"connections": len(connections), "idle": idle, "active": len(connections) - idle, "queued_requests": len(queued)}
+
+
+class HttpClientRegistry:
+    """
+    One long-lived httpx.AsyncClient per upstream, so DNS, TCP and TLS are paid once
+    per connection instead of once per call. Clients are created on first use or by
+    start(), which also opens a connection to each upstream, and closed by stop().
+    """
+
+    def __init__(self, upstreams):
+        self.upstreams: Dict[str, Upstream] = {upstream.name: upstream for upstream in upstreams}
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._transports: Dict[str, InstrumentedTransport] = {}
+        self._http2: Dict[str, bool] = {}
+
+    def add(self, upstream: Upstream) -> None:
+        """Registers an upstream known only at runtime; call before start() to have it warmed up."""
+        self.upstreams.setdefault(upstream.name, upstream)
+
+    def get(self, name: str) -> httpx.AsyncClient:
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            client = self._create(self.upstreams[name])
+        return client
+
+    def _create(self, upstream: Upstream) -> httpx.AsyncClient:
+        http2 = upstream.http2 and HTTP2_ENABLED and H2_AVAILABLE
+        if upstream.http2 and HTTP2_ENABLED and not H2_AVAILABLE:
+            logger.warning(f"h2 is not installed, {upstream.name} client uses HTTP/1.1 instead of HTTP/2")
+        transport = InstrumentedTransport(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=upstream.max_connections,
+                max_keepalive_connections=upstream.max_keepalive,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECONDS,
+            ),
+            # Only failed connection attempts are retried, a sent request never is
+            retries=1,
+        )
+        client = httpx.AsyncClient(
+            transport=transport,
+            timeout=httpx.Timeout(
+                connect=upstream.connect_timeout, read=upstream.read_timeout,
+                write=upstream.write_timeout, pool=upstream.pool_timeout,
+            ),
+        )
+        self._clients[upstream.name] = client
+        self._transports[upstream.name] = transport
+        self._http2[upstream.name] = http2
+        return client
+
+    async def start(self) -> None:
+        for upstream in self.upstreams.values():
+            self.get(upstream.name)
+        if HTTP_WARMUP_ON_STARTUP:
+            await asyncio.gather(*(self._warm_up(upstream) for upstream in self.upstreams.values() if upstream.base_url))
+
+    async def _warm_up(self, upstream: Upstream) -> None:
+        # Any answer will do, the point is the pooled keep-alive connection it leaves behind
+        try:
+            await self.get(upstream.name).head(upstream.base_url, timeout=5.0)
+            logger.info(f"HTTP client for {upstream.name} warmed up")
+        except httpx.HTTPError as e:
+            logger.warning(f"Warm-up of {upstream.name} ({upstream.base_url}) failed: {e}")
+
+    async def stop(self) -> None:
+        clients, self._clients = self._clients, {}
+        await asyncio.gather(*(client.aclose() for client in clients.values()), return_exceptions=True)
+
+    def get_stats(self) -> dict:
+        stats = {}
+        for name, transport in self._transports.items():
+            requests, new_connections = transport.stats["requests"], transport.stats["new_connections"]
+            try:
+                pool = transport.pool_state()
+            except Exception:
+                pool = {}
+            stats[name] = {
+                **transport.stats,
+                "reuse_rate": round(1 - new_connections / requests, 3) if requests else None,
+                **pool,
+                "max_connections": self.upstreams[name].max_connections,
+                "http2": self._http2[name],
+            }
+        return stats
+
+
+http_clients = HttpClientRegistry(UPSTREAMS)
+register_collector("http_clients", http_clients.get_stats)
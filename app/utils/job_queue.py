@@ -0,0 +1,279 @@
+# app/utils/job_queue.py
+import asyncio
+import logging
+import os
+import socket
+from datetime import timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy import and_, delete, exists, func, insert, or_, select, text, update
+from sqlalchemy.exc import InterfaceError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from app.config import (
+    JOB_WORKERS, JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS, JOB_RETRY_BASE_SECONDS,
+    JOB_RETRY_MAX_SECONDS, JOB_POLL_INTERVAL_SECONDS
+)
+from app.database import BackgroundSessionLocal, add_notify_listener
+from app.models import Job
+from app.utils.metrics import register_collector
+from app.utils.resilience import is_transient
+
+logger = logging.getLogger(__name__)
+
+JOB_CHANNEL = "eiei_jobs"
+
+# Lower values are claimed first; jobs of synthetic updates yield to live users
+JOB_PRIORITY_LIVE = 0
+JOB_PRIORITY_BACKGROUND = 10
+
+# job_type -> coroutine called as handler(db=..., attempts=..., **payload)
+job_handlers: Dict[str, Callable[..., Awaitable]] = {}
+
+def register_job_handler(job_type: str, handler: Callable[..., Awaitable]) -> None:
+    job_handlers[job_type] = handler
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Errors a handler should raise for its job to run again: upstream hiccups and lost database connections."""
+    return is_transient(exc) or isinstance(exc, (OperationalError, InterfaceError))
+
+
+async def enqueue_job(db: AsyncSession, job_type: str, bot_id: int, chat_id: int, payload: dict,
+                      delay: float = 0, priority: int = 0, commit: bool = True) -> int:
+    """
+    Inserts a job and notifies the workers. The payload must be JSON serialisable.
+    Jobs for the same (bot_id, chat_id) run one at a time in insertion order.
+    """
+    result = await db.execute(
+        insert(Job)
+        .values(
+            job_type=job_type,
+            bot_id=bot_id,
+            chat_id=chat_id,
+            payload=payload,
+            status='QUEUED',
+            priority=priority,
+            max_attempts=JOB_MAX_ATTEMPTS,
+            run_at=func.now() + timedelta(seconds=delay),
+        )
+        .returning(Job.pk_job)
+    )
+    pk_job = result.scalar_one()
+    # The notification is delivered on commit; its payload tells listeners when the job is due
+    await db.execute(text("SELECT pg_notify(:channel, :delay)"), {"channel": JOB_CHANNEL, "delay": str(delay)})
+    if commit:
+        await db.commit()
+    logger.debug(f"Enqueued job {pk_job} ({job_type}) for chat_id {chat_id} due in {delay}s")
+    return pk_job
+
+
+def retry_delay(attempts: int) -> float:
+    return min(JOB_RETRY_MAX_SECONDS, JOB_RETRY_BASE_SECONDS * (2 ** (attempts - 1)))
+
+
+def claim_statement(worker_id: str):
+    """UPDATE ... WHERE pk_job = (SELECT ... FOR UPDATE SKIP LOCKED) taking the next runnable job."""
+    candidate = aliased(Job)
+    other = aliased(Job)
+    # A chat is blocked while one of its jobs runs or an older one is still queued
+    blocked = exists().where(
+        other.bot_id == candidate.bot_id,
+        other.chat_id == candidate.chat_id,
+        or_(other.status == 'RUNNING', and_(other.status == 'QUEUED', other.pk_job < candidate.pk_job)),
+    )
+    next_job = (
+        select(candidate.pk_job)
+        .where(candidate.status == 'QUEUED', candidate.run_at <= func.now(), ~blocked)
+        .order_by(candidate.priority, candidate.pk_job)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    return (
+        update(Job)
+        .where(Job.pk_job == next_job)
+        .values(
+            status='RUNNING',
+            attempts=Job.attempts + 1,
+            locked_by=worker_id,
+            locked_until=func.now() + timedelta(seconds=JOB_LEASE_SECONDS),
+        )
+        .returning(Job.pk_job, Job.job_type, Job.chat_id, Job.payload, Job.attempts, Job.max_attempts)
+    )
+
+
+class JobWorkerPool:
+    """
+    Claims jobs with SELECT ... FOR UPDATE SKIP LOCKED and runs them under a lease.
+    Several processes can run a pool against the same table; a chat never has
+    more than one RUNNING job, and expired leases are handed back to the queue.
+    """
+
+    def __init__(self, workers: int):
+        self.worker_count = workers
+        self.worker_prefix = f"{socket.gethostname()}:{os.getpid()}"
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+        self._listener_conn = None
+        self._stats = {"claimed": 0, "succeeded": 0, "retried": 0, "failed": 0, "recovered": 0}
+        self._busy = 0
+
+    async def start(self):
+        if self._tasks:
+            return
+        await self._listen()
+        await self.recover_expired_leases()
+        self._tasks = [asyncio.create_task(self._worker(f"{self.worker_prefix}:{i}")) for i in range(self.worker_count)]
+        self._tasks.append(asyncio.create_task(self._sweeper()))
+        logger.info(f"Job worker pool started with {self.worker_count} workers")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._listener_conn is not None:
+            await self._listener_conn.close()
+            self._listener_conn = None
+
+    async def _listen(self):
+        try:
+            self._listener_conn = await add_notify_listener(JOB_CHANNEL, self._on_notify)
+        except Exception as e:
+            # Polling still picks jobs up, just with more latency
+            logger.error(f"Failed to LISTEN on {JOB_CHANNEL}, falling back to polling: {e}")
+
+    def _on_notify(self, connection, pid, channel, payload):
+        try:
+            delay = float(payload or 0)
+        except ValueError:
+            delay = 0
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self._wakeup.set)
+        else:
+            self._wakeup.set()
+
+    async def _worker(self, worker_id: str):
+        while True:
+            try:
+                self._wakeup.clear()
+                job = await self._claim(worker_id)
+                if job is None:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), JOB_POLL_INTERVAL_SECONDS)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await self._run(job, worker_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job worker {worker_id} error: {e}")
+                await asyncio.sleep(JOB_POLL_INTERVAL_SECONDS)
+
+    async def _claim(self, worker_id: str):
+        async with BackgroundSessionLocal() as db:
+            result = await db.execute(claim_statement(worker_id))
+            job = result.one_or_none()
+            await db.commit()
+        if job is not None:
+            self._stats["claimed"] += 1
+        return job
+
+    async def _run(self, job, worker_id: str):
+        handler = job_handlers.get(job.job_type)
+        heartbeat = asyncio.create_task(self._heartbeat(job.pk_job, worker_id))
+        self._busy += 1
+        try:
+            if handler is None:
+                raise RuntimeError(f"No handler registered for job type {job.job_type}")
+            logger.info(f"Running job {job.pk_job} ({job.job_type}) for chat_id {job.chat_id}, attempt {job.attempts}")
+            db = BackgroundSessionLocal()
+            try:
+                await handler(db=db, attempts=job.attempts, **job.payload)
+            finally:
+                await db.close()
+        except Exception as e:
+            logger.error(f"Job {job.pk_job} ({job.job_type}) failed on attempt {job.attempts}: {e}")
+            await self._fail(job, str(e))
+        else:
+            await self._complete(job)
+        finally:
+            self._busy -= 1
+            heartbeat.cancel()
+
+    async def _heartbeat(self, pk_job: int, worker_id: str):
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            try:
+                async with BackgroundSessionLocal() as db:
+                    await db.execute(
+                        update(Job)
+                        .where(Job.pk_job == pk_job, Job.locked_by == worker_id)
+                        .values(locked_until=func.now() + timedelta(seconds=JOB_LEASE_SECONDS))
+                    )
+                    await db.commit()
+            except Exception as e:
+                logger.error(f"Failed to extend lease of job {pk_job}: {e}")
+
+    async def _complete(self, job):
+        async with BackgroundSessionLocal() as db:
+            await db.execute(delete(Job).where(Job.pk_job == job.pk_job))
+            await db.commit()
+        self._stats["succeeded"] += 1
+
+    async def _fail(self, job, error: str):
+        if job.attempts >= job.max_attempts:
+            values = dict(status='FAILED', locked_by=None, locked_until=None, last_error=error[:4000])
+            self._stats["failed"] += 1
+        else:
+            delay = retry_delay(job.attempts)
+            values = dict(status='QUEUED', locked_by=None, locked_until=None, last_error=error[:4000],
+                          run_at=func.now() + timedelta(seconds=delay))
+            self._stats["retried"] += 1
+        async with BackgroundSessionLocal() as db:
+            await db.execute(update(Job).where(Job.pk_job == job.pk_job).values(**values))
+            if values['status'] == 'QUEUED':
+                await db.execute(text("SELECT pg_notify(:channel, :delay)"),
+                                 {"channel": JOB_CHANNEL, "delay": str(retry_delay(job.attempts))})
+            await db.commit()
+
+    async def recover_expired_leases(self) -> int:
+        """Hands jobs of crashed workers back to the queue (or fails them when out of attempts)."""
+        async with BackgroundSessionLocal() as db:
+            expired = and_(Job.status == 'RUNNING', Job.locked_until < func.now())
+            await db.execute(
+                update(Job)
+                .where(expired, Job.attempts >= Job.max_attempts)
+                .values(status='FAILED', locked_by=None, locked_until=None, last_error='Lease expired')
+            )
+            result = await db.execute(
+                update(Job)
+                .where(expired)
+                .values(status='QUEUED', locked_by=None, locked_until=None, run_at=func.now())
+                .returning(Job.pk_job)
+            )
+            recovered = result.scalars().all()
+            await db.commit()
+        if recovered:
+            self._stats["recovered"] += len(recovered)
+            logger.warning(f"Recovered {len(recovered)} jobs with expired leases: {recovered}")
+            self._wakeup.set()
+        return len(recovered)
+
+    async def _sweeper(self):
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 2)
+            try:
+                await self.recover_expired_leases()
+            except Exception as e:
+                logger.error(f"Failed to recover expired job leases: {e}")
+
+    def get_stats(self) -> dict:
+        return {**self._stats, "workers": self.worker_count, "busy_workers": self._busy}
+
+
+job_worker_pool = JobWorkerPool(workers=JOB_WORKERS)
+register_collector("job_queue", job_worker_pool.get_stats)
@@ -0,0 +1,263 @@
+# app/utils/llm_router.py
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional
+
+from app.config import (
+    OPENROUTER_TOKEN, OPENROUTER_MODEL, OPENROUTER_URL, OPENROUTER_HTTP_MAX_CONNECTIONS,
+    OPENROUTER_READ_TIMEOUT_SECONDS, LLM_TARGETS, LLM_ROUTER_WINDOW, LLM_ROUTER_EXPLORE_RATE,
+    LLM_TARGET_MAX_ERROR_RATE, LLM_TARGET_COOLDOWN_SECONDS, LLM_HEDGE_ENABLED, LLM_HEDGE_MIN_DELAY_SECONDS
+)
+from app.utils.http_clients import http_clients, Upstream, origin
+from app.utils.metrics import register_collector
+from app.utils.prompt_cache import prepare_payload, prompt_cache_stats
+from app.utils.resilience import CircuitBreaker, CircuitOpenError, is_transient, retry_budget
+
+logger = logging.getLogger(__name__)
+
+# Below this many samples a target's latency is unknown and it is tried before the measured ones
+MIN_SAMPLES = 5
+
+
+@dataclass(frozen=True)
+class LLMTarget:
+    name: str
+    url: str
+    model: str
+    token: Optional[str]
+    client: str  # name of the pooled client in http_clients
+
+
+@dataclass
+class TargetHealth:
+    window: int
+    latencies: Deque[float] = field(init=False)
+    outcomes: Deque[bool] = field(init=False)
+    cooldown_until: float = 0.0
+    requests: int = 0
+    failures: int = 0
+    cooldowns: int = 0
+
+    def __post_init__(self):
+        self.latencies = deque(maxlen=self.window)
+        self.outcomes = deque(maxlen=self.window)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if len(self.latencies) < MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+    def error_rate(self) -> Optional[float]:
+        if len(self.outcomes) < MIN_SAMPLES:
+            return None
+        return self.outcomes.count(False) / len(self.outcomes)
+
+
+def load_targets(raw: str) -> List[LLMTarget]:
+    openrouter_origin = origin(OPENROUTER_URL)
+    if not raw.strip():
+        return [LLMTarget("openrouter", OPENROUTER_URL, OPENROUTER_MODEL, OPENROUTER_TOKEN, "openrouter")]
+    targets = []
+    for entry in json.loads(raw):
+        url = entry.get("url", OPENROUTER_URL)
+        token = os.getenv(entry["token_env"]) if entry.get("token_env") else OPENROUTER_TOKEN
+        # Models on the same host share its connection pool
+        client = "openrouter" if origin(url) == openrouter_origin else f"llm_{entry['name']}"
+        if client != "openrouter":
+            http_clients.add(Upstream(client, origin(url), max_connections=OPENROUTER_HTTP_MAX_CONNECTIONS,
+                                      max_keepalive=OPENROUTER_HTTP_MAX_CONNECTIONS,
+                                      read_timeout=OPENROUTER_READ_TIMEOUT_SECONDS, http2=True))
+        targets.append(LLMTarget(entry["name"], url, entry.get("model", OPENROUTER_MODEL), token, client))
+    return targets
+
+
+class LLMRouter:
+    """
+    Sends chat completions to the fastest healthy of several (endpoint, model) targets,
+    ranked by their median latency over the last window requests. A target whose recent
+    error rate passes max_error_rate sits out cooldown seconds. A small share of requests
+    goes to another target so the ranking follows targets that got faster.
+
+    Each target has its own circuit breaker, so one failing target cannot make the others
+    fail fast. A request that fails on a transient error (or meets an open breaker) goes on
+    to the next ranked target while the shared retry budget allows.
+
+    With hedging, a request still unanswered after the p95 latency of its target is sent
+    to the runner-up as well; the first answer wins and the other request is cancelled.
+    """
+
+    def __init__(self, targets: List[LLMTarget], window: int = LLM_ROUTER_WINDOW,
+                 explore_rate: float = LLM_ROUTER_EXPLORE_RATE, max_error_rate: float = LLM_TARGET_MAX_ERROR_RATE,
+                 cooldown: float = LLM_TARGET_COOLDOWN_SECONDS, hedge: bool = LLM_HEDGE_ENABLED,
+                 hedge_min_delay: float = LLM_HEDGE_MIN_DELAY_SECONDS):
+        self.targets = targets
+        self.explore_rate = explore_rate
+        self.max_error_rate = max_error_rate
+        self.cooldown = cooldown
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.health: Dict[str, TargetHealth] = {target.name: TargetHealth(window) for target in targets}
+        self.breakers: Dict[str, CircuitBreaker] = {target.name: CircuitBreaker(f"llm:{target.name}") for target in targets}
+        self._stats = {"requests": 0, "explored": 0, "hedged": 0, "hedges_won": 0, "hedges_cancelled": 0, "failovers": 0}
+
+    def available(self, target: LLMTarget, now: float) -> bool:
+        return self.health[target.name].cooldown_until <= now and self.breakers[target.name].available()
+
+    def back_at(self, target: LLMTarget) -> float:
+        breaker = self.breakers[target.name]
+        breaker_back = breaker.opened_at + breaker.recovery_seconds if not breaker.available() else 0.0
+        return max(self.health[target.name].cooldown_until, breaker_back)
+
+    def ranked(self) -> List[LLMTarget]:
+        """Healthy targets fastest first, then the cooling down or broken ones by how soon they are back."""
+        now = time.monotonic()
+        healthy = [target for target in self.targets if self.available(target, now)]
+        cooling = [target for target in self.targets if not self.available(target, now)]
+        healthy.sort(key=lambda target: self.health[target.name].percentile(0.5) or 0.0)
+        cooling.sort(key=self.back_at)
+        if len(healthy) > 1 and random.random() < self.explore_rate:
+            self._stats["explored"] += 1
+            explored = healthy.pop(random.randrange(1, len(healthy)))
+            healthy.insert(0, explored)
+        return healthy + cooling
+
+    def pick(self) -> LLMTarget:
+        return self.ranked()[0]
+
+    def breaker(self, target: LLMTarget) -> CircuitBreaker:
+        return self.breakers[target.name]
+
+    def record(self, target: LLMTarget, ok: bool, latency: Optional[float] = None) -> None:
+        health = self.health[target.name]
+        health.requests += 1
+        health.outcomes.append(ok)
+        if ok:
+            if latency is not None:
+                health.latencies.append(latency)
+            return
+        health.failures += 1
+        error_rate = health.error_rate()
+        if error_rate is not None and error_rate > self.max_error_rate and len(self.targets) > 1:
+            health.cooldown_until = time.monotonic() + self.cooldown
+            health.cooldowns += 1
+            # Judged afresh when it comes back
+            health.outcomes.clear()
+            logger.warning(f"LLM target {target.name} failed {error_rate:.0%} of recent requests, skipping it for {self.cooldown}s")
+
+    def hedge_delay(self, target: LLMTarget) -> float:
+        p95 = self.health[target.name].percentile(0.95)
+        return max(self.hedge_min_delay, p95 or 0.0)
+
+    async def complete(self, payload: dict) -> dict:
+        """
+        Posts payload (its model replaced by the target's) and returns the parsed JSON answer,
+        failing over down the ranking. Raises the last error once no target is left to try.
+        """
+        self._stats["requests"] += 1
+        # One deposit per request, shared with call_with_retries when that wraps this call
+        with retry_budget.request():
+            remaining = self.ranked()
+            while True:
+                target = remaining.pop(0)
+                try:
+                    if self.hedge and remaining:
+                        return await self._hedged(target, remaining, payload)
+                    return await self._send(target, payload)
+                except Exception as e:
+                    if not (is_transient(e) or isinstance(e, CircuitOpenError)):
+                        raise
+                    if not remaining or not retry_budget.withdraw():
+                        raise
+                    self._stats["failovers"] += 1
+                    logger.warning(f"LLM target {target.name} failed ({e}), failing over to {remaining[0].name}")
+
+    async def _hedged(self, primary: LLMTarget, remaining: List[LLMTarget], payload: dict) -> dict:
+        """_send to primary, hedged with the next of remaining, which is taken off the list once used."""
+        tasks = {asyncio.create_task(self._send(primary, payload)): primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay(primary))
+            if not done:
+                runner_up = remaining.pop(0)
+                self._stats["hedged"] += 1
+                logger.debug(f"LLM target {primary.name} is slow, hedging with {runner_up.name}")
+                tasks[asyncio.create_task(self._send(runner_up, payload))] = runner_up
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if tasks[task] is not primary:
+                            self._stats["hedges_won"] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    self._stats["hedges_cancelled"] += 1
+                    task.cancel()
+
+    async def _send(self, target: LLMTarget, payload: dict) -> dict:
+        breaker = self.breakers[target.name]
+        if not breaker.allow():
+            raise CircuitOpenError(breaker.name)
+        started = time.perf_counter()
+        try:
+            response = await http_clients.get(target.client).post(
+                target.url, json=prepare_payload(payload, target.model), headers=self.headers(target)
+            )
+            response.raise_for_status()
+            response_data = response.json()
+        except asyncio.CancelledError:
+            # The losing side of a hedge says nothing about the target
+            breaker.release()
+            raise
+        except Exception as e:
+            self.record(target, ok=False)
+            if is_transient(e):
+                breaker.record_failure()
+            else:
+                # The target answered; the request itself was at fault
+                breaker.record_success()
+            raise
+        breaker.record_success()
+        latency = time.perf_counter() - started
+        self.record(target, ok=True, latency=latency)
+        if isinstance(response_data, dict):
+            prompt_cache_stats.record(target.model, response_data.get("usage"), latency)
+        return response_data
+
+    @staticmethod
+    def headers(target: LLMTarget) -> dict:
+        return {"Authorization": f"Bearer {target.token}"}
+
+    def get_stats(self) -> dict:
+        now = time.monotonic()
+        targets = {}
+        for target in self.targets:
+            health = self.health[target.name]
+            p50, p95, error_rate = health.percentile(0.5), health.percentile(0.95), health.error_rate()
+            targets[target.name] = {
+                "model": target.model,
+                "requests": health.requests,
+                "failures": health.failures,
+                "p50_seconds": round(p50, 3) if p50 is not None else None,
+                "p95_seconds": round(p95, 3) if p95 is not None else None,
+                "error_rate": round(error_rate, 3) if error_rate is not None else None,
+                "cooldowns": health.cooldowns,
+                "cooling_down": health.cooldown_until > now,
+                "breaker": self.breakers[target.name].get_stats(),
+            }
+        return {**self._stats, "hedging": self.hedge, "targets": targets}
+
+
+llm_router = LLMRouter(load_targets(LLM_TARGETS))
+register_collector("llm_router", llm_router.get_stats)
@@ -0,0 +1,212 @@
+# app/utils/message_archive.py
+import asyncio
+import logging
+import re
+from datetime import datetime, timedelta
+from typing import List, NamedTuple, Optional
+
+from sqlalchemy import exists, func, or_, select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.config import (
+    MESSAGE_PARTITIONS_AHEAD, MESSAGE_ARCHIVE_AFTER_DAYS, MESSAGE_ARCHIVE_BATCH_SIZE,
+    MESSAGE_ARCHIVE_PAUSE_SECONDS, MESSAGE_ARCHIVE_INTERVAL_SECONDS
+)
+from app.database import background_engine
+from app.models import tbl_msg, ArchivedMessage, ChatReset
+from app.utils.metrics import register_collector
+
+logger = logging.getLogger(__name__)
+
+# pg_try_advisory_lock key, one maintenance run at a time across processes
+MAINTENANCE_LOCK_ID = 200205
+
+stats = {"runs": 0, "skipped_runs": 0, "archived": 0, "partitions_created": 0, "partitions_dropped": 0,
+         "last_run_at": None, "last_run_seconds": None}
+
+_bound_re = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+
+class Partition(NamedTuple):
+    name: str
+    lower: Optional[datetime]  # None for MINVALUE
+    upper: datetime
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def _parse_bound(value: str) -> Optional[datetime]:
+    if value == "MINVALUE":
+        return None
+    return datetime.fromisoformat(value.strip("'"))
+
+
+async def list_partitions(conn: AsyncConnection) -> List[Partition]:
+    result = await conn.execute(text("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'tbl_200_messages'::regclass
+    """))
+    partitions = []
+    for name, bound in result.all():
+        match = _bound_re.search(bound or "")
+        if match:
+            partitions.append(Partition(name, _parse_bound(match.group(1)), _parse_bound(match.group(2))))
+    return sorted(partitions, key=lambda partition: partition.upper)
+
+
+async def ensure_partitions(conn: AsyncConnection) -> int:
+    """
+    Creates the monthly partitions up to MESSAGE_PARTITIONS_AHEAD months from now, starting
+    where the last one ends so the ranges never leave a gap an insert could fall into.
+    """
+    partitions = await list_partitions(conn)
+    now = datetime.utcnow()
+    target = add_months(datetime(now.year, now.month, 1), MESSAGE_PARTITIONS_AHEAD + 1)
+    start = partitions[-1].upper if partitions else datetime(now.year, now.month, 1)
+    created = 0
+    while start < target:
+        end = add_months(start, 1)
+        await conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS tbl_200_messages_p{start:%Y%m} PARTITION OF tbl_200_messages "
+            f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+        ))
+        await conn.commit()
+        logger.info(f"Created message partition tbl_200_messages_p{start:%Y%m}")
+        created += 1
+        start = end
+    stats["partitions_created"] += created
+    return created
+
+
+def archive_batch_statement(low_pk: int, high_pk: int, cutoff: datetime):
+    """
+    Moves the rows of one pk window that left the conversation (reset and answered) or are
+    older than cutoff into tbl_205_messages_archive, in a single DELETE ... RETURNING.
+    """
+    reset = exists().where(
+        ChatReset.bot_id == tbl_msg.bot_id,
+        ChatReset.chat_id == tbl_msg.chat_id,
+        ChatReset.reset_at >= tbl_msg.message_date
+    )
+    doomed = (
+        select(tbl_msg.pk_messages, tbl_msg.message_date)
+        .where(
+            tbl_msg.pk_messages > low_pk,
+            tbl_msg.pk_messages <= high_pk,
+            or_(
+                tbl_msg.message_date < cutoff,
+                # Messages still in flight are left alone even when their chat was reset
+                (tbl_msg.is_processed == 'Y') & or_(tbl_msg.is_reset == 'Y', reset),
+            )
+        )
+        .with_for_update(skip_locked=True)
+        .cte('doomed')
+    )
+    columns = [column.name for column in tbl_msg.__table__.columns]
+    moved = (
+        tbl_msg.__table__.delete()
+        .where(tbl_msg.pk_messages == doomed.c.pk_messages, tbl_msg.message_date == doomed.c.message_date)
+        .returning(*tbl_msg.__table__.columns)
+        .cte('moved')
+    )
+    return (
+        insert(ArchivedMessage)
+        .from_select(columns, select(*(moved.c[column] for column in columns)))
+        .on_conflict_do_nothing(index_elements=['pk_messages'])
+    )
+
+
+async def archive_messages(conn: AsyncConnection) -> int:
+    """
+    Walks tbl_200_messages in pk windows of MESSAGE_ARCHIVE_BATCH_SIZE, one short transaction
+    per window, pausing in between so webhook traffic is never queued behind the job.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=MESSAGE_ARCHIVE_AFTER_DAYS)
+    low_pk, high_pk = (await conn.execute(select(func.min(tbl_msg.pk_messages), func.max(tbl_msg.pk_messages)))).one()
+    await conn.commit()
+    if low_pk is None:
+        return 0
+
+    archived = 0
+    window_start = low_pk - 1
+    while window_start < high_pk:
+        window_end = window_start + MESSAGE_ARCHIVE_BATCH_SIZE
+        result = await conn.execute(archive_batch_statement(window_start, window_end, cutoff))
+        await conn.commit()
+        archived += max(result.rowcount, 0)
+        window_start = window_end
+        await asyncio.sleep(MESSAGE_ARCHIVE_PAUSE_SECONDS)
+    stats["archived"] += archived
+    return archived
+
+
+async def drop_empty_partitions(conn: AsyncConnection) -> int:
+    """Detaches and drops past partitions the archive job has emptied."""
+    now = datetime.utcnow()
+    current_month = datetime(now.year, now.month, 1)
+    dropped = 0
+    for partition in await list_partitions(conn):
+        if partition.upper > current_month:
+            continue
+        has_rows = (await conn.execute(text(f"SELECT EXISTS (SELECT 1 FROM {partition.name})"))).scalar()
+        await conn.commit()
+        if has_rows:
+            continue
+        try:
+            # DETACH needs an exclusive lock on tbl_200_messages; give up rather than queue behind traffic
+            await conn.execute(text("SET LOCAL lock_timeout = '2s'"))
+            await conn.execute(text(f"ALTER TABLE tbl_200_messages DETACH PARTITION {partition.name}"))
+            await conn.execute(text(f"DROP TABLE {partition.name}"))
+            await conn.commit()
+            dropped += 1
+            logger.info(f"Dropped empty message partition {partition.name}")
+        except Exception as e:
+            await conn.rollback()
+            logger.warning(f"Could not drop message partition {partition.name}, retrying next run: {e}")
+    stats["partitions_dropped"] += dropped
+    return dropped
+
+
+async def maintain_messages() -> None:
+    async with background_engine.connect() as conn:
+        locked = (await conn.execute(text("SELECT pg_try_advisory_lock(:id)"), {"id": MAINTENANCE_LOCK_ID})).scalar()
+        await conn.commit()
+        if not locked:
+            stats["skipped_runs"] += 1
+            logger.info("Message maintenance already running in another process")
+            return
+        started = datetime.utcnow()
+        try:
+            await ensure_partitions(conn)
+            archived = await archive_messages(conn)
+            await drop_empty_partitions(conn)
+            logger.info(f"Message maintenance archived {archived} messages")
+        finally:
+            await conn.rollback()
+            await conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MAINTENANCE_LOCK_ID})
+            await conn.commit()
+        stats["runs"] += 1
+        stats["last_run_at"] = started.isoformat()
+        stats["last_run_seconds"] = round((datetime.utcnow() - started).total_seconds(), 1)
+
+
+async def maintain_messages_periodically():
+    """Partitions are created ahead at startup and every run, before they are needed."""
+    while True:
+        try:
+            await maintain_messages()
+        except Exception as e:
+            logger.error(f"Message maintenance failed: {e}")
+        await asyncio.sleep(MESSAGE_ARCHIVE_INTERVAL_SECONDS)
+
+
+def get_stats() -> dict:
+    return dict(stats)
+
+
+register_collector("message_archive", get_stats)
@@ -0,0 +1,22 @@
+# app/utils/metrics.py
+import logging
+from typing import Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+# Each collector returns a JSON-serialisable dict describing its component
+collectors: Dict[str, Callable[[], dict]] = {}
+
+def register_collector(name: str, collector: Callable[[], dict]) -> None:
+    collectors[name] = collector
+
+def snapshot() -> dict:
+    """Collects the current stats of every registered component."""
+    result = {}
+    for name, collector in collectors.items():
+        try:
+            result[name] = collector()
+        except Exception as e:
+            logger.error(f"Metrics collector {name} failed: {e}")
+            result[name] = {"error": str(e)}
+    return result
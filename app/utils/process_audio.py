@@ -1,114 +1,121 @@
 # app/routers/process_audio.py
 import asyncio
-import httpx
 import logging
 import os
 import mimetypes
 from app.database_operations import update_message
-from app.config import TELEGRAM_API_URL, MONSTER_API_TOKEN
+from app.config import TELEGRAM_API_URL, MONSTER_API_TOKEN, JOB_MAX_ATTEMPTS
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional
 from app.database import get_db
 import subprocess
-import requests
 from tempfile import NamedTemporaryFile
-from fastapi import APIRouter, HTTPException, Depends, Request, BackgroundTasks
-from app.controllers.message_processing import process_queue
-from app.config import bot_config
+from fastapi import Depends
+from app.controllers.message_processing import enqueue_process_queue, resolve_job_bot
+from app.utils.job_queue import register_job_handler, is_retryable
+from app.utils.bot_registry import BotContext
+from app.utils.http_clients import http_clients
 
 logger = logging.getLogger(__name__)
-async def transcribe_audio(background_tasks, message_pk: int, ai_placeholder_pk: int, bot_id: int, chat_id: int, user_id: int, file_id: str, request: Request, db: AsyncSession = Depends(get_db)) -> Optional[str]:
+async def transcribe_audio(message_pk: int, ai_placeholder_pk: int, bot: BotContext, chat_id: int, user_id: int, file_id: str, db: AsyncSession = Depends(get_db), awaiting_type: Optional[str] = None, may_retry: bool = False) -> Optional[str]:
     try:
-        bot_token = bot_config["bot_token"]
+        bot_token = bot.bot_token
         file_url = f"{TELEGRAM_API_URL}{bot_token}/getFile?file_id={file_id}"
 
-        async with httpx.AsyncClient() as client:
-            file_response = await client.get(file_url)
-            file_response.raise_for_status()
-
-            file_path = file_response.json().get("result", {}).get("file_path", "")
-            full_file_url = f"https://api.telegram.org/file/bot{bot_token}/{file_path}"
-
-            logger.info(f"full_file_url {full_file_url}")
-
-            # Convert audio file format
-            converted_file_path = await convert_audio(full_file_url)  # Ensure this uses the same API as PL/SQL function
-
-            # Prepare the file for upload
-            file_name = os.path.basename(converted_file_path)
-            files = {
-                "file": (file_name, open(converted_file_path, "rb"), mimetypes.guess_type(converted_file_path)[0])
-            }
-            payload = {
-                "diarize": "false",
-                "do_sample": "true"
-                #,"language": "en"
-            }
-            headers = {
-                "accept": "application/json",
-                "authorization": f"Bearer {MONSTER_API_TOKEN}"
-            }
-
-            # Send the transcription request
-            transcription_response = await client.post(
-                'https://api.monsterapi.ai/v1/generate/speech2text-v2',
-                data=payload,
-                files=files,
-                headers=headers
-            )
-            response_json = transcription_response.json()
-            logger.debug(f"Monster transcription_response JSON: {response_json}")
-
-
-            transcription_response.raise_for_status()
-            process_id = transcription_response.json().get('process_id', '')
-
-            logger.info(f"Monster process_id {process_id}")
-
-            # Check the status of the transcription in a loop
-            max_attempts = 5
-            attempt_count = 0
-            transcribed_text = ''
-            while attempt_count < max_attempts:
-                await asyncio.sleep(3)  # Non-blocking sleep
-                status_response = await client.get(f'https://api.monsterapi.ai/v1/status/{process_id}',
-                headers=headers)
-                status = status_response.json().get('status', '')
-
-                if status == 'COMPLETED':
+        file_response = await http_clients.get("telegram").get(file_url)
+        file_response.raise_for_status()
+
+        file_path = file_response.json().get("result", {}).get("file_path", "")
+        full_file_url = f"https://api.telegram.org/file/bot{bot_token}/{file_path}"
+
+        logger.info(f"full_file_url {full_file_url}")
+
+        # Convert audio file format
+        converted_file_path = await convert_audio(full_file_url)  # Ensure this uses the same API as PL/SQL function
+
+        # Prepare the file for upload
+        file_name = os.path.basename(converted_file_path)
+        files = {
+            "file": (file_name, open(converted_file_path, "rb"), mimetypes.guess_type(converted_file_path)[0])
+        }
+        payload = {
+            "diarize": "false",
+            "do_sample": "true"
+            #,"language": "en"
+        }
+        headers = {
+            "accept": "application/json",
+            "authorization": f"Bearer {MONSTER_API_TOKEN}"
+        }
+
+        # Send the transcription request
+        monsterapi = http_clients.get("monsterapi")
+        transcription_response = await monsterapi.post(
+            'https://api.monsterapi.ai/v1/generate/speech2text-v2',
+            data=payload,
+            files=files,
+            headers=headers
+        )
+        response_json = transcription_response.json()
+        logger.debug(f"Monster transcription_response JSON: {response_json}")
+
+
+        transcription_response.raise_for_status()
+        process_id = transcription_response.json().get('process_id', '')
+
+        logger.info(f"Monster process_id {process_id}")
+
+        # Check the status of the transcription in a loop
+        max_attempts = 5
+        attempt_count = 0
+        transcribed_text = ''
+        while attempt_count < max_attempts:
+            await asyncio.sleep(3)  # Non-blocking sleep
+            status_response = await monsterapi.get(f'https://api.monsterapi.ai/v1/status/{process_id}',
+            headers=headers)
+            status = status_response.json().get('status', '')
+
+            if status == 'COMPLETED':
                     
-                    response_json = status_response.json()
-                    logger.debug(f"Monster response_json JSON: {response_json}")
-                    transcribed_text = response_json.get('result', {}).get('text', '')
-                    break
-
-                attempt_count += 1
-                await asyncio.sleep(3)  # Non-blocking sleep
-
-            response_json = status_response.json()
-            logger.info(f"Monster status transcription_response JSON: {response_json}")
-
-            # Handle the response
-            if not transcribed_text:
-                error_message = "[Audio]: Transcription failed or incomplete"
-                logger.error(error_message)
-                await update_message(db, message_pk=message_pk, new_content=error_message)
-            else:
-                logger.info(f"transcribed_text {transcribed_text}")
-                await update_message(db, message_pk=message_pk, new_content=transcribed_text)
-
-            await update_message(db, message_pk=message_pk, new_status="N")
-            os.remove(converted_file_path)
-            background_tasks.add_task(process_queue, chat_id=chat_id, bot_id=bot_id, user_id=user_id, message_pk=message_pk, ai_placeholder_pk=ai_placeholder_pk, request=request, db=db)
- 
+                response_json = status_response.json()
+                logger.debug(f"Monster response_json JSON: {response_json}")
+                transcribed_text = response_json.get('result', {}).get('text', '')
+                break
+
+            attempt_count += 1
+            await asyncio.sleep(3)  # Non-blocking sleep
+
+        response_json = status_response.json()
+        logger.info(f"Monster status transcription_response JSON: {response_json}")
+
+        # Handle the response
+        if not transcribed_text:
+            error_message = "[Audio]: Transcription failed or incomplete"
+            logger.error(error_message)
+            await update_message(db, message_pk=message_pk, new_content=error_message, new_status="N", batched=True)
+        else:
+            logger.info(f"transcribed_text {transcribed_text}")
+            await update_message(db, message_pk=message_pk, new_content=transcribed_text, new_status="N", batched=True)
+
+        os.remove(converted_file_path)
+        await enqueue_process_queue(db, chat_id=chat_id, bot_id=bot.bot_id, user_id=user_id, message_pk=message_pk, ai_placeholder_pk=ai_placeholder_pk, awaiting_type=awaiting_type)
+
     except Exception as e:
         logger.error(f"Error in transcribe_audio: {e}")
-        await update_message(db, message_pk=message_pk, new_status="E")
+        if may_retry and is_retryable(e):
+            # Nothing was written yet; the job queue runs it again after a backoff
+            raise
+        await update_message(db, message_pk=message_pk, new_status="E", batched=True)
         return None
 
+async def transcribe_audio_job(db: AsyncSession, attempts: int, bot_id: int, **params):
+    await transcribe_audio(db=db, bot=await resolve_job_bot(bot_id), may_retry=attempts < JOB_MAX_ATTEMPTS, **params)
+
+register_job_handler("transcribe_audio", transcribe_audio_job)
+
 async def convert_audio(file_url: str) -> str:
     try:
-        response = requests.get(file_url)
+        response = await http_clients.get("telegram").get(file_url)
         if response.status_code != 200:
             logger.error('Failed to download the file')
             return ''
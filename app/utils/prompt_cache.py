@@ -0,0 +1,120 @@
+# app/utils/prompt_cache.py
+import logging
+from typing import Dict, Optional, Union
+
+from app.config import PROMPT_CACHE_ENABLED, PROMPT_CACHE_BREAKPOINT_MODELS, PROMPT_CACHE_MIN_CHARS
+from app.utils.metrics import register_collector
+
+logger = logging.getLogger(__name__)
+
+# Anthropic honours at most four cache_control breakpoints per request
+MAX_BREAKPOINTS = 4
+
+
+def cacheable(text: str) -> dict:
+    """A content part that ends a prefix worth caching."""
+    return {"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}
+
+
+def text_part(text: str) -> dict:
+    return {"type": "text", "text": text}
+
+
+def message(role: str, *parts: Union[str, dict]) -> dict:
+    """A chat message made of parts; plain strings are parts that are not cache breakpoints."""
+    return {"role": role, "content": [text_part(part) if isinstance(part, str) else part for part in parts]}
+
+
+def supports_breakpoints(model: Optional[str]) -> bool:
+    return bool(model) and any(model.startswith(prefix) for prefix in PROMPT_CACHE_BREAKPOINT_MODELS)
+
+
+def prepare_payload(payload: dict, model: str) -> dict:
+    """
+    The payload as sent to model. The payload builders mark the end of each static prefix
+    with cacheable(); for models taking cache_control breakpoints the marks are kept once
+    the prefix is long enough to be cached, for the others the parts are joined back into
+    the plain string content every provider accepts.
+    """
+    keep_breakpoints = PROMPT_CACHE_ENABLED and supports_breakpoints(model)
+    prefix_chars = 0
+    breakpoints = 0
+    messages = []
+    for original in payload.get("messages", []):
+        content = original.get("content")
+        if not isinstance(content, list):
+            prefix_chars += len(content or "")
+            messages.append(original)
+            continue
+        if not keep_breakpoints:
+            messages.append({**original, "content": "".join(part.get("text", "") for part in content)})
+            continue
+        parts = []
+        for part in content:
+            prefix_chars += len(part.get("text", ""))
+            if "cache_control" in part and (prefix_chars < PROMPT_CACHE_MIN_CHARS or breakpoints >= MAX_BREAKPOINTS):
+                part = text_part(part["text"])
+            elif "cache_control" in part:
+                breakpoints += 1
+            parts.append(part)
+        messages.append({**original, "content": parts})
+    return {**payload, "model": model, "messages": messages}
+
+
+class PromptCacheStats:
+    """
+    Token usage per model as reported in the usage field of completions: prompt tokens,
+    how many of them were read from the provider's cache or written to it, and the
+    latency of calls with and without a cache hit.
+    """
+
+    def __init__(self):
+        self.models: Dict[str, dict] = {}
+
+    def record(self, model: str, usage: Optional[dict], latency: Optional[float] = None) -> None:
+        if not usage:
+            return
+        details = usage.get("prompt_tokens_details") or {}
+        # OpenRouter normalises to prompt_tokens_details; Anthropic-style fields otherwise
+        cached = details.get("cached_tokens") or usage.get("cache_read_input_tokens") or 0
+        written = details.get("cache_write_tokens") or usage.get("cache_creation_input_tokens") or 0
+        stats = self.models.setdefault(model, {
+            "calls": 0, "cache_hits": 0, "prompt_tokens": 0, "cached_tokens": 0, "cache_write_tokens": 0,
+            "completion_tokens": 0, "cost": 0.0, "hit_seconds_total": 0.0, "hit_timed_calls": 0,
+            "miss_seconds_total": 0.0, "miss_timed_calls": 0,
+        })
+        stats["calls"] += 1
+        stats["prompt_tokens"] += usage.get("prompt_tokens") or 0
+        stats["completion_tokens"] += usage.get("completion_tokens") or 0
+        stats["cached_tokens"] += cached
+        stats["cache_write_tokens"] += written
+        stats["cost"] += usage.get("cost") or 0.0
+        if cached:
+            stats["cache_hits"] += 1
+        if latency is not None:
+            outcome = "hit" if cached else "miss"
+            stats[f"{outcome}_seconds_total"] += latency
+            stats[f"{outcome}_timed_calls"] += 1
+
+    def get_stats(self) -> dict:
+        result = {}
+        for model, stats in self.models.items():
+            hit_calls, miss_calls = stats["hit_timed_calls"], stats["miss_timed_calls"]
+            result[model] = {
+                "calls": stats["calls"],
+                "cache_hits": stats["cache_hits"],
+                "prompt_tokens": stats["prompt_tokens"],
+                "cached_tokens": stats["cached_tokens"],
+                "cache_write_tokens": stats["cache_write_tokens"],
+                "completion_tokens": stats["completion_tokens"],
+                "cached_token_ratio": round(stats["cached_tokens"] / stats["prompt_tokens"], 3) if stats["prompt_tokens"] else None,
+                "cost": round(stats["cost"], 6),
+                "cost_per_call": round(stats["cost"] / stats["calls"], 6),
+                "avg_seconds_cache_hit": round(stats["hit_seconds_total"] / hit_calls, 3) if hit_calls else None,
+                "avg_seconds_cache_miss": round(stats["miss_seconds_total"] / miss_calls, 3) if miss_calls else None,
+            }
+        return result
+
+
+prompt_cache_stats = PromptCacheStats()
+register_collector("prompt_cache", prompt_cache_stats.get_stats)
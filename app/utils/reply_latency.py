@@ -0,0 +1,61 @@
+# app/utils/reply_latency.py
+from collections import deque
+from typing import Deque, Dict
+
+from app.utils.metrics import register_collector
+
+# Percentiles are taken over the most recent samples only
+WINDOW = 1000
+
+
+class LatencySeries:
+    def __init__(self, window: int = WINDOW):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent: Deque[float] = deque(maxlen=window)
+
+    def record(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.recent.append(seconds)
+
+    def snapshot(self) -> dict:
+        ordered = sorted(self.recent)
+
+        def percentile(p: float):
+            return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))], 3) if ordered else None
+
+        return {
+            "count": self.count,
+            "avg": round(self.total / self.count, 3) if self.count else None,
+            "p50": percentile(0.5),
+            "p95": percentile(0.95),
+            "max": round(self.max, 3),
+        }
+
+
+class ReplyLatency:
+    """
+    Latency of text replies as the user sees it, measured from the completion request:
+    time to the first token (streamed replies), time to the first Telegram message and
+    time until the whole reply was sent, for streamed and buffered replies separately.
+    """
+
+    def __init__(self):
+        self.series: Dict[str, LatencySeries] = {}
+        self.counters = {"streamed": 0, "buffered": 0, "stream_fallbacks": 0, "stream_interrupted": 0}
+
+    def record(self, mode: str, metric: str, seconds: float) -> None:
+        self.series.setdefault(f"{mode}_{metric}", LatencySeries()).record(seconds)
+
+    def count(self, counter: str) -> None:
+        self.counters[counter] += 1
+
+    def get_stats(self) -> dict:
+        return {**self.counters, **{name: series.snapshot() for name, series in sorted(self.series.items())}}
+
+
+reply_latency = ReplyLatency()
+register_collector("reply_latency", reply_latency.get_stats)
@@ -45,10 +45,14 @@ async def is_photo_request(text):
 
 
 async def check_intent(  content_text: str,  chat_id: int, bot_token: str
-    ):
+    ) -> bool:
+    """Offers a voice note or photo when the text asks for one. Returns whether an offer was sent."""
     if await is_voice_note_request(content_text):
         await send_request_for_audio(chat_id,bot_token)
+        return True
     elif await is_photo_request(content_text):
         await send_request_for_photo(chat_id,bot_token)
+        return True
     else:
         logging.debug("No specific request identified.")
+        return False
@@ -0,0 +1,253 @@
+# app/utils/resilience.py
+import asyncio
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+import httpx
+
+from app.config import (
+    RETRY_BASE_DELAY_SECONDS, RETRY_MAX_DELAY_SECONDS, BREAKER_FAILURE_THRESHOLD, BREAKER_RECOVERY_SECONDS,
+    RETRY_BUDGET_RATIO, RETRY_BUDGET_MIN_PER_SECOND
+)
+from app.utils.metrics import register_collector
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Set while a logical request has made its deposit, so the retry layers nested in it
+# (call_with_retries around the LLM router, say) do not deposit again
+_request_deposited: ContextVar[bool] = ContextVar("request_deposited", default=False)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose breaker is open."""
+
+    def __init__(self, upstream: str):
+        super().__init__(f"Circuit breaker for {upstream} is open")
+        self.upstream = upstream
+
+
+def is_transient(exc: BaseException) -> bool:
+    """Errors worth retrying: timeouts, connection failures, 429 and 5xx answers."""
+    if isinstance(exc, (httpx.TransportError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    if isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+        return status == 429 or status >= 500
+    # fastapi's HTTPException, raised by send_payload_to_openrouter on 429
+    return getattr(exc, "status_code", None) == 429
+
+
+def backoff_delay(attempt: int, base: float = RETRY_BASE_DELAY_SECONDS, cap: float = RETRY_MAX_DELAY_SECONDS) -> float:
+    """Full jitter: a random delay up to base * 2^attempt, so retries of many callers spread out."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """
+    Closed while the upstream answers. failure_threshold transient failures in a row open it,
+    and calls fail fast for recovery_seconds. Then one trial call is let through (half open):
+    its success closes the breaker, its failure opens it again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 recovery_seconds: float = BREAKER_RECOVERY_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._stats = {"calls": 0, "failures": 0, "rejected": 0, "opened": 0}
+
+    def allow(self) -> bool:
+        if self.state == OPEN:
+            if time.monotonic() < self.opened_at + self.recovery_seconds:
+                self._stats["rejected"] += 1
+                return False
+            self.state = HALF_OPEN
+            self._trial_in_flight = False
+        if self.state == HALF_OPEN:
+            if self._trial_in_flight:
+                self._stats["rejected"] += 1
+                return False
+            self._trial_in_flight = True
+        self._stats["calls"] += 1
+        return True
+
+    def available(self) -> bool:
+        """Whether allow() would let a call through now, without taking the half-open trial."""
+        if self.state == OPEN:
+            return time.monotonic() >= self.opened_at + self.recovery_seconds
+        if self.state == HALF_OPEN:
+            return not self._trial_in_flight
+        return True
+
+    def record_success(self) -> None:
+        self.consecutive_failures = 0
+        self._trial_in_flight = False
+        if self.state != CLOSED:
+            logger.info(f"Circuit breaker for {self.name} closed")
+            self.state = CLOSED
+
+    def record_failure(self) -> None:
+        self._stats["failures"] += 1
+        self.consecutive_failures += 1
+        self._trial_in_flight = False
+        if self.state == HALF_OPEN or (self.state == CLOSED and self.consecutive_failures >= self.failure_threshold):
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+            self._stats["opened"] += 1
+            logger.warning(f"Circuit breaker for {self.name} opened after {self.consecutive_failures} failures, "
+                           f"failing fast for {self.recovery_seconds}s")
+
+    def release(self) -> None:
+        """For an allowed call that ended without telling anything about the upstream (cancelled)."""
+        self._trial_in_flight = False
+
+    def get_stats(self) -> dict:
+        return {**self._stats, "state": self.state, "consecutive_failures": self.consecutive_failures}
+
+
+class RetryBudget:
+    """
+    Token bucket shared by every retry. Each first attempt adds ratio tokens and a trickle of
+    min_per_second keeps a few retries possible at low traffic; a retry takes one token. In an
+    outage retries stop once the bucket is empty instead of multiplying the load.
+    """
+
+    def __init__(self, ratio: float = RETRY_BUDGET_RATIO, min_per_second: float = RETRY_BUDGET_MIN_PER_SECOND):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        # At most ten seconds worth of the trickle can be saved up
+        self.max_tokens = max(1.0, 10 * min_per_second)
+        self.tokens = self.max_tokens
+        self._refilled_at = time.monotonic()
+        self._stats = {"first_attempts": 0, "retries": 0, "denied": 0}
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.max_tokens, self.tokens + (now - self._refilled_at) * self.min_per_second)
+        self._refilled_at = now
+
+    @contextmanager
+    def request(self):
+        """
+        Scope of one logical request: deposits on entry unless an outer scope of the same
+        request already did. Each request earns its ratio of retries once, however many
+        layers retry it.
+        """
+        if _request_deposited.get():
+            yield
+            return
+        self.deposit()
+        token = _request_deposited.set(True)
+        try:
+            yield
+        finally:
+            _request_deposited.reset(token)
+
+    def deposit(self) -> None:
+        self._refill()
+        self._stats["first_attempts"] += 1
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        self._refill()
+        if self.tokens < 1:
+            self._stats["denied"] += 1
+            return False
+        self.tokens -= 1
+        self._stats["retries"] += 1
+        return True
+
+    def get_stats(self) -> dict:
+        self._refill()
+        return {**self._stats, "tokens": round(self.tokens, 2), "max_tokens": self.max_tokens}
+
+
+breakers: Dict[str, CircuitBreaker] = {}
+retry_budget = RetryBudget()
+
+
+def get_breaker(upstream: str) -> CircuitBreaker:
+    breaker = breakers.get(upstream)
+    if breaker is None:
+        breaker = breakers[upstream] = CircuitBreaker(upstream)
+    return breaker
+
+
+async def call_with_retries(
+    upstream: str,
+    operation: Callable[[], Awaitable[T]],
+    attempts: int = 3,
+    base_delay: float = RETRY_BASE_DELAY_SECONDS,
+    max_delay: float = RETRY_MAX_DELAY_SECONDS,
+    retry_on: Callable[[BaseException], bool] = is_transient,
+    retry_result: Optional[Callable[[Any], bool]] = None,
+    with_breaker: bool = True,
+) -> T:
+    """
+    Awaits operation() through the breaker of upstream, up to attempts times with jittered
+    exponential backoff in between. Errors retry_on rejects are raised at once, and so is the
+    last error when the attempts or the retry budget run out. A result retry_result accepts
+    (an empty reply, say) is retried too, and returned when no attempt does better.
+    Raises CircuitOpenError without calling when the upstream is known to be down.
+    with_breaker=False leaves the breaker to an operation that keeps finer ones itself, like
+    the LLM router with one per target; a CircuitOpenError it raises is not retried.
+    """
+    breaker = get_breaker(upstream) if with_breaker else None
+    with retry_budget.request():
+        attempt = 0
+        while True:
+            if breaker is not None and not breaker.allow():
+                raise CircuitOpenError(upstream)
+            try:
+                result = await operation()
+            except (asyncio.CancelledError, CircuitOpenError):
+                # A breaker further down refused, so this upstream was not called
+                if breaker is not None:
+                    breaker.release()
+                raise
+            except Exception as e:
+                if not retry_on(e):
+                    # The upstream answered; the request itself was at fault
+                    if breaker is not None:
+                        breaker.record_success()
+                    raise
+                if breaker is not None:
+                    breaker.record_failure()
+                # No point waiting for a retry the open breaker would refuse
+                if attempt + 1 >= attempts or (breaker is not None and breaker.state == OPEN) or not retry_budget.withdraw():
+                    raise
+                delay = backoff_delay(attempt, base_delay, max_delay)
+                logger.warning(f"{upstream} call failed ({e}), retry {attempt + 1} of {attempts - 1} in {delay:.1f}s")
+            else:
+                if breaker is not None:
+                    breaker.record_success()
+                if retry_result is None or not retry_result(result):
+                    return result
+                if attempt + 1 >= attempts or not retry_budget.withdraw():
+                    return result
+                delay = backoff_delay(attempt, base_delay, max_delay)
+                logger.warning(f"{upstream} gave an unusable answer, retry {attempt + 1} of {attempts - 1} in {delay:.1f}s")
+            attempt += 1
+            await asyncio.sleep(delay)
+
+
+def get_stats() -> dict:
+    return {"breakers": {name: breaker.get_stats() for name, breaker in breakers.items()},
+            "retry_budget": retry_budget.get_stats()}
+
+
+register_collector("resilience", get_stats)
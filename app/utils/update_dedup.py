@@ -0,0 +1,141 @@
+# app/utils/update_dedup.py
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import timedelta
+
+from sqlalchemy import delete, func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import UPDATE_DEDUP_CACHE_SIZE, UPDATE_DEDUP_RETENTION_HOURS
+from app.database import BackgroundSessionLocal
+from app.models import ProcessedUpdate
+from app.utils.metrics import register_collector
+
+logger = logging.getLogger(__name__)
+
+# Synthetic updates (automatic replies) all share this update_id and are never deduplicated
+SYNTHETIC_UPDATE_ID = -1
+
+stats = {"checked": 0, "duplicates_memory": 0, "duplicates_db": 0, "released": 0}
+
+
+class RecentUpdateIds:
+    """Bounded LRU set of (bot_short_name, update_id) seen by this process."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._ids = OrderedDict()
+
+    def add(self, key) -> bool:
+        """Remembers key. Returns False when it was already known."""
+        if key in self._ids:
+            self._ids.move_to_end(key)
+            return False
+        self._ids[key] = None
+        if len(self._ids) > self.maxsize:
+            self._ids.popitem(last=False)
+        return True
+
+    def discard(self, key) -> None:
+        self._ids.pop(key, None)
+
+    def __len__(self):
+        return len(self._ids)
+
+
+recent_update_ids = RecentUpdateIds(UPDATE_DEDUP_CACHE_SIZE)
+
+
+def is_duplicate_update(bot_short_name: str, update_id: int) -> bool:
+    """In-memory check done before anything else touches the update."""
+    if update_id == SYNTHETIC_UPDATE_ID:
+        return False
+    stats["checked"] += 1
+    if not recent_update_ids.add((bot_short_name, update_id)):
+        stats["duplicates_memory"] += 1
+        logger.info(f"Duplicate update {update_id} for {bot_short_name} dropped (memory)")
+        return True
+    return False
+
+
+def forget_update(bot_short_name: str, update_id: int) -> None:
+    """Drops an update from the in-memory set only, for one turned away before it was claimed."""
+    recent_update_ids.discard((bot_short_name, update_id))
+
+
+class UpdateProgress:
+    """
+    Whether handling an update has committed a write that running it again would repeat
+    (messages, ledger rows, a reset). Until then a failed update can be released for
+    redelivery or retried; after that it must not run a second time.
+    """
+
+    def __init__(self):
+        self.written = False
+
+    def mark_written(self) -> None:
+        self.written = True
+
+
+async def claim_update(db: AsyncSession, bot_short_name: str, update_id: int) -> bool:
+    """
+    Records the update in tbl_110_processed_updates. Returns False when another
+    process (or an earlier delivery) already claimed it.
+    """
+    if update_id == SYNTHETIC_UPDATE_ID:
+        return True
+    result = await db.execute(
+        insert(ProcessedUpdate)
+        .values(bot_short_name=bot_short_name, update_id=update_id)
+        .on_conflict_do_nothing()
+        .returning(ProcessedUpdate.update_id)
+    )
+    claimed = result.scalar_one_or_none() is not None
+    await db.commit()
+    if not claimed:
+        stats["duplicates_db"] += 1
+        logger.info(f"Duplicate update {update_id} for {bot_short_name} dropped (database)")
+    return claimed
+
+
+async def release_update(db: AsyncSession, bot_short_name: str, update_id: int) -> None:
+    """Forgets a claimed update so that Telegram's redelivery gets processed."""
+    if update_id == SYNTHETIC_UPDATE_ID:
+        return
+    recent_update_ids.discard((bot_short_name, update_id))
+    try:
+        await db.rollback()
+        await db.execute(
+            delete(ProcessedUpdate)
+            .where(ProcessedUpdate.bot_short_name == bot_short_name, ProcessedUpdate.update_id == update_id)
+        )
+        await db.commit()
+        stats["released"] += 1
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to release update {update_id} for {bot_short_name}: {e}")
+
+
+async def purge_processed_updates_periodically():
+    """Telegram stops redelivering after a day, older rows only take space."""
+    while True:
+        try:
+            async with BackgroundSessionLocal() as db:
+                result = await db.execute(
+                    delete(ProcessedUpdate)
+                    .where(ProcessedUpdate.received_on < func.now() - timedelta(hours=UPDATE_DEDUP_RETENTION_HOURS))
+                )
+                await db.commit()
+                logger.info(f"Purged {result.rowcount} processed update ids")
+        except Exception as e:
+            logger.error(f"Failed to purge processed update ids: {e}")
+        await asyncio.sleep(3600)
+
+
+def get_stats() -> dict:
+    return {**stats, "cached_ids": len(recent_update_ids), "cache_size": recent_update_ids.maxsize}
+
+
+register_collector("update_dedup", get_stats)
@@ -0,0 +1,140 @@
+# app/utils/update_queue.py
+import asyncio
+import itertools
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from app.config import UPDATE_QUEUE_MAXSIZE, UPDATE_QUEUE_WORKERS
+from app.utils.metrics import register_collector
+
+logger = logging.getLogger(__name__)
+
+# Priority classes, lower values are served first. Payments come first because
+# Telegram expects pre_checkout_query to be answered within 10 seconds. Synthetic
+# updates built in-process (re-engagement) only run when live traffic leaves room.
+PRIORITY_PAYMENT = 0
+PRIORITY_COMMAND = 1
+PRIORITY_TEXT = 2
+PRIORITY_MEDIA = 3
+PRIORITY_SYNTHETIC = 4
+
+PRIORITY_NAMES = {
+    PRIORITY_PAYMENT: "payment",
+    PRIORITY_COMMAND: "command",
+    PRIORITY_TEXT: "text",
+    PRIORITY_MEDIA: "media",
+    PRIORITY_SYNTHETIC: "synthetic",
+}
+
+
+def classify_update(payload_obj) -> int:
+    """Maps a parsed Telegram update to its priority class."""
+    message = payload_obj.message
+    if payload_obj.pre_checkout_query or (message and message.successful_payment):
+        return PRIORITY_PAYMENT
+    if payload_obj.callback_query or (message and message.text and message.text.startswith("/")):
+        return PRIORITY_COMMAND
+    if message and message.text:
+        return PRIORITY_TEXT
+    return PRIORITY_MEDIA
+
+
+class UpdateQueue:
+    """
+    Bounded priority queue drained by a fixed pool of asyncio workers.
+    """
+
+    def __init__(self, maxsize: int, workers: int):
+        self.maxsize = maxsize
+        self.worker_count = workers
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._workers: List[asyncio.Task] = []
+        self._seq = itertools.count()
+        self._depth: Dict[int, int] = {p: 0 for p in PRIORITY_NAMES}
+        self._waits: Dict[int, dict] = {p: {"count": 0, "total": 0.0, "max": 0.0} for p in PRIORITY_NAMES}
+        self._rejected = 0
+        self._failed = 0
+        self._busy = 0
+        self._busy_seconds = 0.0
+        self._started_at = None
+
+    async def start(self):
+        if self._workers:
+            return
+        self._queue = asyncio.PriorityQueue(maxsize=self.maxsize)
+        self._started_at = time.monotonic()
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(self.worker_count)]
+        logger.info(f"Update queue started with {self.worker_count} workers (maxsize {self.maxsize})")
+
+    async def stop(self, timeout: float = 10):
+        if not self._workers:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Update queue stopped with {self._queue.qsize()} pending updates")
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(self, priority: int, job: Callable[[], Awaitable]) -> bool:
+        """Enqueues a job without waiting. Returns False when the queue is full."""
+        if self._queue is None:
+            raise RuntimeError("Update queue has not been started")
+        try:
+            self._queue.put_nowait((priority, next(self._seq), time.monotonic(), job))
+        except asyncio.QueueFull:
+            self._rejected += 1
+            logger.warning(f"Update queue full, rejecting {PRIORITY_NAMES[priority]} update")
+            return False
+        self._depth[priority] += 1
+        return True
+
+    async def _worker(self, index: int):
+        while True:
+            priority, _, enqueued_at, job = await self._queue.get()
+            self._depth[priority] -= 1
+            started = time.monotonic()
+            self._record_wait(priority, started - enqueued_at)
+            self._busy += 1
+            try:
+                await job()
+            except Exception as e:
+                self._failed += 1
+                logger.error(f"Update worker {index} failed to process {PRIORITY_NAMES[priority]} update: {e}")
+            finally:
+                self._busy -= 1
+                self._busy_seconds += time.monotonic() - started
+                self._queue.task_done()
+
+    def _record_wait(self, priority: int, wait: float):
+        stats = self._waits[priority]
+        stats["count"] += 1
+        stats["total"] += wait
+        stats["max"] = max(stats["max"], wait)
+
+    def get_stats(self) -> dict:
+        uptime = time.monotonic() - self._started_at if self._started_at else 0
+        return {
+            "depth": {PRIORITY_NAMES[p]: d for p, d in self._depth.items()},
+            "maxsize": self.maxsize,
+            "rejected": self._rejected,
+            "failed": self._failed,
+            "wait_seconds": {
+                PRIORITY_NAMES[p]: {
+                    "count": w["count"],
+                    "avg": w["total"] / w["count"] if w["count"] else 0.0,
+                    "max": w["max"],
+                }
+                for p, w in self._waits.items()
+            },
+            "workers": self.worker_count,
+            "busy_workers": self._busy,
+            "utilisation": self._busy_seconds / (uptime * self.worker_count) if uptime else 0.0,
+        }
+
+
+update_queue = UpdateQueue(maxsize=UPDATE_QUEUE_MAXSIZE, workers=UPDATE_QUEUE_WORKERS)
+register_collector("update_queue", update_queue.get_stats)
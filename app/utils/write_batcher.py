@@ -0,0 +1,200 @@
+# app/utils/write_batcher.py
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import WRITE_BATCH_MAX_ITEMS, WRITE_BATCH_MAX_DELAY_MS
+from app.database import BackgroundSessionLocal
+from app.utils.metrics import register_collector
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the flush size histogram
+FLUSH_SIZE_BUCKETS = (1, 4, 16, 64, 256)
+
+
+@dataclass
+class WriteHandler:
+    # apply(db, payloads) runs the writes of a batch without committing and returns one result per payload
+    apply: Callable[[AsyncSession, List[Any]], Awaitable[List[Any]]]
+    # after_commit(payloads, results) updates in-memory state once the writes are durable
+    after_commit: Optional[Callable[[List[Any], List[Any]], None]] = None
+
+
+@dataclass
+class PendingWrite:
+    kind: str
+    payload: Any
+    future: asyncio.Future
+    submitted_at: float = field(default_factory=time.perf_counter)
+
+
+class WriteBatcher:
+    """
+    Group commit for small writes of concurrent jobs. Writes are queued and flushed
+    together once max_items are waiting or the oldest has waited max_delay seconds,
+    in one transaction with the handler of each kind turning its share of the batch
+    into multi-row statements. submit() returns once the write is committed.
+
+    When a batch fails its writes are retried one per transaction, so a bad write only
+    fails its own caller.
+    """
+
+    def __init__(self, session_factory, max_items: int, max_delay: float):
+        self.session_factory = session_factory
+        self.max_items = max(1, max_items)
+        self.max_delay = max_delay
+        self.handlers: Dict[str, WriteHandler] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {
+            "submitted": 0, "flushes": 0, "flushed_items": 0, "failed": 0, "split_batches": 0,
+            "flush_size_max": 0, "flush_seconds_total": 0.0, "flush_seconds_max": 0.0,
+            "wait_seconds_total": 0.0, "wait_seconds_max": 0.0,
+        }
+        self._size_histogram = {f"le_{bucket}": 0 for bucket in FLUSH_SIZE_BUCKETS}
+        self._size_histogram["more"] = 0
+
+    def register(self, kind: str, apply, after_commit=None) -> None:
+        self.handlers[kind] = WriteHandler(apply, after_commit)
+
+    async def submit(self, kind: str, payload: Any) -> Any:
+        """Queues a write and waits until it is committed. Returns the handler's result for it."""
+        if kind not in self.handlers:
+            raise RuntimeError(f"No write handler registered for {kind}")
+        self._ensure_running()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait(PendingWrite(kind, payload, future))
+        self._stats["submitted"] += 1
+        # The write still happens when the caller is cancelled, only the wait is abandoned
+        return await asyncio.shield(future)
+
+    def _ensure_running(self) -> None:
+        if self._task is None or self._task.done():
+            self._queue = self._queue or asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Flushes what is queued and stops the flusher."""
+        if self._task is None or self._task.done():
+            return
+        # Queued behind every pending write, so the flusher drains the queue before it exits
+        self._queue.put_nowait(None)
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            first = await self._queue.get()
+            if first is None:
+                return
+            batch = [first]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_items:
+                if self._queue.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        pending = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    pending = self._queue.get_nowait()
+                if pending is None:
+                    stopping = True
+                    break
+                batch.append(pending)
+            try:
+                await self._flush(batch)
+            except Exception as e:
+                # _flush settles every future itself, this only keeps the flusher alive
+                logger.error(f"Write batch flush error: {e}")
+
+    async def _flush(self, batch: List[PendingWrite]) -> None:
+        started = time.perf_counter()
+        try:
+            async with self.session_factory() as db:
+                results = await self._apply(db, batch)
+                await db.commit()
+        except Exception as e:
+            if len(batch) == 1:
+                self._stats["failed"] += 1
+                logger.error(f"Batched {batch[0].kind} write failed: {e}")
+                if not batch[0].future.done():
+                    batch[0].future.set_exception(e)
+                return
+            self._stats["split_batches"] += 1
+            logger.warning(f"Batch of {len(batch)} writes failed, retrying them one by one: {e}")
+            for pending in batch:
+                await self._flush([pending])
+            return
+
+        finished = time.perf_counter()
+        self._record(batch, finished - started, finished)
+        for kind, indexes in self._by_kind(batch).items():
+            after_commit = self.handlers[kind].after_commit
+            if after_commit is not None:
+                try:
+                    after_commit([batch[i].payload for i in indexes], [results[i] for i in indexes])
+                except Exception as e:
+                    logger.error(f"after_commit of {kind} writes failed: {e}")
+        for pending, result in zip(batch, results):
+            if not pending.future.done():
+                pending.future.set_result(result)
+
+    async def _apply(self, db: AsyncSession, batch: List[PendingWrite]) -> List[Any]:
+        results: List[Any] = [None] * len(batch)
+        for kind, indexes in self._by_kind(batch).items():
+            kind_results = await self.handlers[kind].apply(db, [batch[i].payload for i in indexes])
+            for i, result in zip(indexes, kind_results):
+                results[i] = result
+        return results
+
+    @staticmethod
+    def _by_kind(batch: List[PendingWrite]) -> Dict[str, List[int]]:
+        # Kinds are applied in the order their first write arrived
+        grouped: Dict[str, List[int]] = {}
+        for i, pending in enumerate(batch):
+            grouped.setdefault(pending.kind, []).append(i)
+        return grouped
+
+    def _record(self, batch: List[PendingWrite], flush_seconds: float, finished: float) -> None:
+        size = len(batch)
+        self._stats["flushes"] += 1
+        self._stats["flushed_items"] += size
+        self._stats["flush_size_max"] = max(self._stats["flush_size_max"], size)
+        self._stats["flush_seconds_total"] += flush_seconds
+        self._stats["flush_seconds_max"] = max(self._stats["flush_seconds_max"], flush_seconds)
+        for pending in batch:
+            waited = finished - pending.submitted_at
+            self._stats["wait_seconds_total"] += waited
+            self._stats["wait_seconds_max"] = max(self._stats["wait_seconds_max"], waited)
+        bucket = next((f"le_{bucket}" for bucket in FLUSH_SIZE_BUCKETS if size <= bucket), "more")
+        self._size_histogram[bucket] += 1
+
+    def get_stats(self) -> dict:
+        flushes, items = self._stats["flushes"], self._stats["flushed_items"]
+        return {
+            **self._stats,
+            "flush_seconds_total": round(self._stats["flush_seconds_total"], 3),
+            "flush_seconds_max": round(self._stats["flush_seconds_max"], 3),
+            "wait_seconds_total": round(self._stats["wait_seconds_total"], 3),
+            "wait_seconds_max": round(self._stats["wait_seconds_max"], 3),
+            "avg_flush_size": round(items / flushes, 2) if flushes else None,
+            "avg_wait_ms": round(1000 * self._stats["wait_seconds_total"] / items, 2) if items else None,
+            "flush_size_histogram": dict(self._size_histogram),
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "max_items": self.max_items,
+            "max_delay_ms": self.max_delay * 1000,
+        }
+
+
+write_batcher = WriteBatcher(BackgroundSessionLocal, max_items=WRITE_BATCH_MAX_ITEMS, max_delay=WRITE_BATCH_MAX_DELAY_MS / 1000)
+register_collector("write_batcher", write_batcher.get_stats)
@@ -6,8 +6,19 @@ from app.logging_config import setup_logging
 from fastapi.staticfiles import StaticFiles
 import asyncio
 from app.utils.file_list_cache import get_cached_file_list
-from app.utils.automatic_reply import check_and_trigger_responses
+from app.utils.automatic_reply import check_and_trigger_responses, keep_service_alive_periodically
 from app.routers.keep_alive import router as keep_alive_router
+from app.routers.metrics import router as metrics_router
+from app.routers.admin import router as admin_router
+from app.utils.bot_registry import bot_registry
+from app.utils.update_queue import update_queue
+from app.utils.job_queue import job_worker_pool
+from app.utils.update_dedup import purge_processed_updates_periodically
+from app.utils.message_archive import maintain_messages_periodically
+from app.utils.conversation_state import purge_expired_states_periodically
+from app.database import dispose_engines
+from app.utils.write_batcher import write_batcher
+from app.utils.http_clients import http_clients
 from slowapi import Limiter
 from slowapi.errors import RateLimitExceeded
 from slowapi.util import get_remote_address
@@ -24,6 +35,8 @@ logger = logging.getLogger(__name__)
 app.include_router(api_router)
 app.include_router(telegram_router)
 app.include_router(keep_alive_router)
+app.include_router(metrics_router)
+app.include_router(admin_router)
 
 limiter = Limiter(key_func=get_remote_address)
 app.state.limiter = limiter
@@ -43,7 +56,28 @@ async def startup_event():
     file_list = await get_cached_file_list()
     # Print the refreshed file list
     logger.info("Cache initialized with the following files:")
+    # Connections to Telegram, OpenRouter and the media APIs are opened before traffic arrives
+    await http_clients.start()
+    await bot_registry.start()
+    await update_queue.start()
+    await job_worker_pool.start()
+    asyncio.create_task(keep_service_alive_periodically())
     asyncio.create_task(check_and_trigger_responses())
+    asyncio.create_task(purge_processed_updates_periodically())
+    asyncio.create_task(maintain_messages_periodically())
+    asyncio.create_task(purge_expired_states_periodically())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Give queued webhook updates a chance to finish before the process exits
+    await update_queue.stop()
+    # Jobs still running are picked up by another worker once their lease expires
+    await job_worker_pool.stop()
+    # Writes of the jobs that just stopped are still committed
+    await write_batcher.stop()
+    await bot_registry.stop()
+    await http_clients.stop()
+    await dispose_engines()
 
 # Remove the duplicate exception handler
 # @app.exception_handler(RateLimitExceeded)
@@ -0,0 +1,75 @@
+# scripts/bench_webhook_decode.py
+"""
+Per-update parse cost of the webhook, before and after decoding the body once.
+
+    python scripts/bench_webhook_decode.py [iterations]
+"""
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.schemas import TelegramWebhookPayload, is_handled_update
+
+USER = {"id": 123456789, "is_bot": False, "first_name": "Ana", "username": "ana", "language_code": "en"}
+CHAT = {"id": 123456789, "first_name": "Ana", "username": "ana", "type": "private"}
+
+SAMPLES = {
+    "text": {
+        "update_id": 900000001,
+        "message": {"message_id": 42, "from": USER, "chat": CHAT, "date": 1712000000, "text": "Hello there, how was your day?"},
+    },
+    "photo": {
+        "update_id": 900000002,
+        "message": {
+            "message_id": 43, "from": USER, "chat": CHAT, "date": 1712000001, "caption": "Look at this",
+            "photo": [
+                {"file_id": f"AgACAgQAAxkBAAI{i}", "file_unique_id": f"AQAD{i}", "file_size": 1200 * (i + 1),
+                 "width": 90 * (i + 1), "height": 60 * (i + 1)}
+                for i in range(4)
+            ],
+        },
+    },
+    "callback_query": {
+        "update_id": 900000003,
+        "callback_query": {
+            "id": "4382bfdwdsb323b2d9", "from": USER, "data": "buy_500_credits",
+            "message": {"message_id": 44, "from": USER, "chat": CHAT, "date": 1712000002, "text": "Pick a pack"},
+        },
+    },
+    "edited_message (skipped)": {
+        "update_id": 900000004,
+        "edited_message": {"message_id": 45, "from": USER, "chat": CHAT, "date": 1712000003, "edit_date": 1712000004, "text": "Edited"},
+    },
+}
+
+
+def decode_before(body: bytes):
+    # error_handler's request.json(), the endpoint's request.json(), the model and the DEBUG dump
+    json.loads(body)
+    payload = json.loads(body)
+    payload_obj = TelegramWebhookPayload(**payload)
+    payload_obj.model_dump()
+    return payload_obj
+
+
+def decode_after(body: bytes):
+    if not is_handled_update(body):
+        return None
+    return TelegramWebhookPayload.model_validate_json(body)
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    print(f"{'update':<26}{'before (us)':>14}{'after (us)':>14}{'speedup':>10}")
+    for name, sample in SAMPLES.items():
+        body = json.dumps(sample).encode()
+        before = timeit.timeit(lambda: decode_before(body), number=iterations) / iterations * 1e6
+        after = timeit.timeit(lambda: decode_after(body), number=iterations) / iterations * 1e6
+        print(f"{name:<26}{before:>14.2f}{after:>14.2f}{before / after:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# scripts/check_llm_router.py
+"""
+Runs the LLM router against local stub servers (scripts/llm_stub_server.py) and fails
+when it does not route the way it should:
+
+  - most requests go to the faster of two healthy targets
+  - a target that keeps failing is skipped once its error rate passes the limit, and the
+    requests it failed are answered by the other one
+  - with hedging, a target that stalls is overtaken by the runner-up
+
+    python scripts/check_llm_router.py
+
+Needs no network access and no API keys.
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.http_clients import http_clients, Upstream
+from app.utils.llm_router import LLMRouter, LLMTarget, MIN_SAMPLES
+from scripts.llm_stub_server import StubLLM
+
+PAYLOAD = {"model": "ignored", "messages": [{"role": "user", "content": "Hi"}]}
+
+
+async def make_target(stub: StubLLM) -> LLMTarget:
+    port = await stub.start()
+    client = f"stub_{stub.name}"
+    http_clients.add(Upstream(client, None, max_connections=20, max_keepalive=20))
+    return LLMTarget(stub.name, f"http://127.0.0.1:{port}/v1/chat/completions", f"stub-{stub.name}", None, client)
+
+
+async def send(router: LLMRouter, payload: dict = PAYLOAD):
+    try:
+        return await router.complete(payload)
+    except Exception as e:
+        return e
+
+
+async def check_fastest_wins() -> list:
+    fast, slow = StubLLM("fast", latency=0.02), StubLLM("slow", latency=0.15)
+    router = LLMRouter([await make_target(slow), await make_target(fast)], explore_rate=0.05, hedge=False)
+    # Both are tried while their latency is unknown, only the requests after that are counted
+    for _ in range(2):
+        await asyncio.gather(*(send(router) for _ in range(6)))
+    fast.requests = slow.requests = 0
+    for _ in range(10):
+        await asyncio.gather(*(send(router) for _ in range(6)))
+    print("fastest wins:", json.dumps(router.get_stats()["targets"]))
+    failures = []
+    if slow.requests > 0.2 * (fast.requests + slow.requests):
+        failures.append(f"fast target got {fast.requests} requests, slow one {slow.requests}")
+    return failures
+
+
+async def check_failing_target_skipped() -> list:
+    broken, healthy = StubLLM("broken", latency=0.01, error_rate=1.0), StubLLM("healthy", latency=0.05)
+    router = LLMRouter([await make_target(broken), await make_target(healthy)], explore_rate=0.0,
+                       max_error_rate=0.5, cooldown=60, hedge=False)
+    results = [await send(router) for _ in range(30)]
+    errors = sum(isinstance(result, Exception) for result in results)
+    print("failing target:", json.dumps(router.get_stats()["targets"]), f"caller errors: {errors}")
+    failures = []
+    if broken.requests > MIN_SAMPLES:
+        failures.append(f"broken target still got {broken.requests} requests after failing them all")
+    if router.get_stats()["targets"]["broken"]["cooldowns"] != 1:
+        failures.append("broken target was not put in cooldown")
+    if errors:
+        failures.append(f"{errors} requests failed instead of failing over to the healthy target")
+    return failures
+
+
+async def check_hedging() -> list:
+    primary, backup = StubLLM("primary", latency=0.02), StubLLM("backup", latency=0.15)
+    router = LLMRouter([await make_target(primary), await make_target(backup)], explore_rate=0.0,
+                       hedge=True, hedge_min_delay=0.1)
+    for _ in range(4 * MIN_SAMPLES):
+        await send(router)
+    primary.latency = 2.0
+    started = time.perf_counter()
+    results = await asyncio.gather(*(send(router) for _ in range(5)))
+    elapsed = time.perf_counter() - started
+    stats = router.get_stats()
+    print("hedging:", json.dumps({key: stats[key] for key in ("hedged", "hedges_won", "hedges_cancelled")}),
+          f"stalled batch took {elapsed:.2f}s")
+    failures = []
+    if any(isinstance(result, Exception) for result in results):
+        failures.append("hedged requests failed")
+    if not stats["hedges_won"]:
+        failures.append("no stalled request was won by the hedge")
+    if elapsed > 1.0:
+        failures.append(f"stalled requests took {elapsed:.2f}s despite hedging")
+    return failures
+
+
+async def main() -> int:
+    failures = []
+    try:
+        for check in (check_fastest_wins, check_failing_target_skipped, check_hedging):
+            failures += await check()
+    finally:
+        await http_clients.stop()
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    print("OK" if not failures else f"{len(failures)} checks failed")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
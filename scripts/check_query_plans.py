@@ -0,0 +1,163 @@
+# scripts/check_query_plans.py
+"""
+EXPLAINs every hot query against a scratch Postgres and fails when one of them
+would fall back to a sequential scan.
+
+    createdb eiei_plans
+    CHECK_DATABASE_URL=postgresql+asyncpg://localhost/eiei_plans alembic upgrade head   # see note below
+    CHECK_DATABASE_URL=postgresql+asyncpg://localhost/eiei_plans python scripts/check_query_plans.py --seed
+
+alembic reads SQLALCHEMY_DATABASE_URL, so export it to the same scratch URL for the
+upgrade. The URL is taken from CHECK_DATABASE_URL only, never from the application
+settings, because --seed writes synthetic rows.
+
+The planner is run with enable_seqscan off: a Seq Scan left in the plan then means
+no index can serve the query at all, which makes the check independent of how many
+rows were seeded.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+from datetime import datetime
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.database_operations import (
+    bot_config_columns, chat_history_query, unprocessed_messages_query, awaiting_state_query,
+    latest_ledger_total, current_balance, credit_transaction_ctes, claim_due_reengagements_statement,
+    load_user_context_query
+)
+from app.models import TelegramConfig, tbl_msg, tbl_300_awaiting_user_input, ChatActivity
+from app.utils.job_queue import claim_statement
+
+BOT_ID = 1
+CHAT_ID = 1000042
+USER_ID = 1000042
+
+SEED_SQL = [
+    """INSERT INTO tbl_100_telegram_config (pk_bot, bot_short_name, bot_token)
+       SELECT g, 'bot_' || g, 'token_' || g FROM generate_series(1, 50) g
+       ON CONFLICT DO NOTHING""",
+    """INSERT INTO tbl_150_user_info (id, chat_id, is_bot, first_name, is_banned, pk_bot, channel)
+       SELECT 1000000 + g, 1000000 + g, false, 'user', false, 1 + g % 50, 'TELEGRAM' FROM generate_series(1, 20000) g
+       ON CONFLICT DO NOTHING""",
+    """INSERT INTO tbl_200_messages (channel, bot_id, chat_id, user_id, type, role, content_text, message_date, is_processed, is_reset)
+       SELECT 'TELEGRAM', 1 + g % 50, 1000000 + g % 20000, 1000000 + g % 20000, 'TEXT',
+              CASE WHEN g % 2 = 0 THEN 'USER' ELSE 'ASSISTANT' END, 'message ' || g,
+              now() - (g || ' seconds')::interval, CASE WHEN g % 500 = 0 THEN 'N' ELSE 'Y' END, 'N'
+       FROM generate_series(1, 200000) g""",
+    """INSERT INTO tbl_300_awaiting_user_input (channel, bot_id, user_id, chat_id, awaiting_type, status, expires_at)
+       SELECT 'TELEGRAM', 1 + g % 50, 1000000 + g, 1000000 + g,
+              CASE WHEN g % 2 = 0 THEN 'AUDIO' ELSE 'PHOTO' END,
+              CASE WHEN g % 4 = 0 THEN 'GENERATING' ELSE 'AWAITING' END, now() + interval '15 minutes'
+       FROM generate_series(1, 2000) g
+       ON CONFLICT DO NOTHING""",
+    """INSERT INTO tbl_450_user_credits (channel, pk_bot, user_id, chat_id, credits, transaction_type, transaction_date, total_credits)
+       SELECT 'TELEGRAM', 1 + g % 50, 1000000 + g % 20000, 1000000 + g % 20000, -1, 'TEXT_GEN', now(), 100 - g % 100
+       FROM generate_series(1, 100000) g""",
+    """INSERT INTO tbl_230_chat_activity (bot_id, chat_id, user_id, last_activity_at, reengage_due_at)
+       SELECT 1 + g % 50, 1000000 + g, 1000000 + g, now(), CASE WHEN g % 10 = 0 THEN now() + interval '1 day' END
+       FROM generate_series(1, 20000) g
+       ON CONFLICT DO NOTHING""",
+    """INSERT INTO tbl_500_jobs (job_type, bot_id, chat_id, payload, status, priority, attempts, max_attempts, run_at)
+       SELECT 'process_queue', 1 + g % 50, 1000000 + g, '{}', CASE WHEN g % 100 = 0 THEN 'QUEUED' ELSE 'FAILED' END, 0, 0, 5, now()
+       FROM generate_series(1, 20000) g""",
+]
+
+SAMPLE_USER = {
+    'id': USER_ID, 'channel': 'TELEGRAM', 'is_bot': False, 'first_name': 'plan', 'last_name': '', 'username': '',
+    'language_code': '', 'is_premium': False, 'pk_bot': BOT_ID, 'chat_id': CHAT_ID,
+}
+
+SAMPLE_DEBIT = {
+    'channel': 'TELEGRAM', 'pk_bot': BOT_ID, 'user_id': USER_ID, 'chat_id': CHAT_ID,
+    'credits': Decimal('-1'), 'transaction_type': 'TEXT_GEN',
+}
+
+
+def hot_queries():
+    _, debit = credit_transaction_ctes(SAMPLE_DEBIT, refuse_negative=True)
+    return {
+        "bot config by short name": select(*bot_config_columns).where(TelegramConfig.bot_short_name == 'bot_7'),
+        "user context": load_user_context_query(SAMPLE_USER),
+        "latest ledger total": select(latest_ledger_total(USER_ID, BOT_ID)),
+        "current balance": select(current_balance(USER_ID, BOT_ID)),
+        "conditional debit": select(debit.c.total_credits),
+        "awaiting state": awaiting_state_query(BOT_ID, CHAT_ID),
+        "start generating": (
+            update(tbl_300_awaiting_user_input)
+            .where(tbl_300_awaiting_user_input.bot_id == BOT_ID, tbl_300_awaiting_user_input.chat_id == CHAT_ID,
+                   tbl_300_awaiting_user_input.status == "AWAITING", tbl_300_awaiting_user_input.awaiting_type == "AUDIO")
+            .values(status="GENERATING")
+        ),
+        "chat history": chat_history_query(BOT_ID, CHAT_ID, include_pending=True),
+        "unprocessed messages": unprocessed_messages_query(BOT_ID, CHAT_ID),
+        "release claimed messages": (
+            update(tbl_msg)
+            .where(tbl_msg.chat_id == CHAT_ID, tbl_msg.bot_id == BOT_ID, tbl_msg.is_processed == 'P')
+            .values(is_processed='N')
+        ),
+        "job claim": claim_statement("plan-check"),
+        "due re-engagements": claim_due_reengagements_statement(datetime.utcnow(), 100),
+        "next re-engagement": select(func.min(ChatActivity.reengage_due_at)),
+    }
+
+
+def seq_scans(plan: dict) -> list:
+    found = []
+    if plan.get("Node Type") == "Seq Scan":
+        found.append(plan.get("Relation Name"))
+    for child in plan.get("Plans", []):
+        found.extend(seq_scans(child))
+    return found
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--seed", action="store_true", help="insert synthetic rows and ANALYZE before checking")
+    args = parser.parse_args()
+
+    url = os.getenv("CHECK_DATABASE_URL")
+    if not url:
+        sys.exit("CHECK_DATABASE_URL is not set")
+
+    engine = create_async_engine(url)
+    failures = 0
+    async with engine.connect() as conn:
+        if args.seed:
+            for statement in SEED_SQL:
+                await conn.exec_driver_sql(statement)
+            await conn.commit()
+            await conn.exec_driver_sql("ANALYZE")
+
+        # EXPLAIN goes straight to asyncpg with the statement's positional binds, the same
+        # SQL and parameter types the application sends
+        raw = (await conn.get_raw_connection()).driver_connection
+        await raw.execute("SET enable_seqscan = off")
+        for name, statement in hot_queries().items():
+            compiled = statement.compile(dialect=engine.dialect)
+            params = compiled.construct_params()
+            plan = await raw.fetchval(f"EXPLAIN (FORMAT JSON) {compiled.string}",
+                                      *(params[key] for key in compiled.positiontup))
+            plan = json.loads(plan) if isinstance(plan, str) else plan
+            scans = seq_scans(plan[0]["Plan"])
+            if scans:
+                failures += 1
+                print(f"FAIL  {name}: sequential scan on {', '.join(sorted(set(scans)))}")
+            else:
+                print(f"ok    {name}")
+        await raw.execute("RESET enable_seqscan")
+    await engine.dispose()
+
+    if failures:
+        sys.exit(f"{failures} hot queries would scan a whole table")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
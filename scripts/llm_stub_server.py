@@ -0,0 +1,130 @@
+# scripts/llm_stub_server.py
+"""
+A local stand-in for an OpenAI-style /chat/completions endpoint, with adjustable latency
+and failure rate, to exercise the LLM router without network access or API keys.
+
+    python scripts/llm_stub_server.py --port 8101 --name fast --latency 0.2
+    python scripts/llm_stub_server.py --port 8102 --name slow --latency 2 --jitter 1 --error-rate 0.1
+    LLM_TARGETS='[{"name": "fast", "url": "http://127.0.0.1:8101/v1/chat/completions", "model": "stub"},
+                  {"name": "slow", "url": "http://127.0.0.1:8102/v1/chat/completions", "model": "stub"}]' ...
+
+Both plain and "stream": true requests are answered; streams are sent as server-sent
+events over chunked transfer encoding, like the real API. Only the standard library is used.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+REPLY = "Hello from {name}. This reply was made up by the stub server. It took {seconds:.2f} seconds!"
+
+
+class StubLLM:
+    def __init__(self, name: str, latency: float = 0.2, jitter: float = 0.0, error_rate: float = 0.0,
+                 error_status: int = 500, chunk_delay: float = 0.02):
+        # All of these may be changed while the server runs
+        self.name = name
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.chunk_delay = chunk_delay
+        self.requests = 0
+        self.server = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        """Starts listening and returns the port, which is picked by the OS for port 0."""
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            # Keep-alive: serve requests until the client closes the connection
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method = request_line.decode().split(" ")[0]
+                headers = {}
+                while True:
+                    line = (await reader.readline()).decode().strip()
+                    if not line:
+                        break
+                    key, _, value = line.partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", "0")))
+                if method == "HEAD":
+                    writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n")
+                else:
+                    await self.answer(writer, json.loads(body or b"{}"))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # Cancelled: the loop is shutting down with a request still sleeping
+            pass
+        finally:
+            writer.close()
+
+    async def answer(self, writer: asyncio.StreamWriter, payload: dict) -> None:
+        self.requests += 1
+        started = time.perf_counter()
+        await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+        if random.random() < self.error_rate:
+            body = json.dumps({"error": {"message": f"{self.name} failed on purpose", "code": self.error_status}}).encode()
+            writer.write(f"HTTP/1.1 {self.error_status} Error\r\nContent-Type: application/json\r\n"
+                         f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+            return
+        text = REPLY.format(name=self.name, seconds=time.perf_counter() - started)
+        model = payload.get("model", "stub")
+        if not payload.get("stream"):
+            body = json.dumps({
+                "id": f"stub-{self.requests}", "object": "chat.completion", "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(text.split()), "total_tokens": len(text.split())},
+            }).encode()
+            writer.write(f"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                         f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+            return
+
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nTransfer-Encoding: chunked\r\n\r\n")
+        events = [": OPENROUTER PROCESSING\n\n"]
+        for word in text.split(" "):
+            chunk = {"id": f"stub-{self.requests}", "model": model, "choices": [{"index": 0, "delta": {"content": word + " "}}]}
+            events.append(f"data: {json.dumps(chunk)}\n\n")
+        if (payload.get("stream_options") or {}).get("include_usage"):
+            usage = {"prompt_tokens": 0, "completion_tokens": len(text.split()), "total_tokens": len(text.split())}
+            events.append(f"data: {json.dumps({'id': f'stub-{self.requests}', 'model': model, 'choices': [], 'usage': usage})}\n\n")
+        events.append("data: [DONE]\n\n")
+        for event in events:
+            data = event.encode()
+            writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            await writer.drain()
+            await asyncio.sleep(self.chunk_delay)
+        writer.write(b"0\r\n\r\n")
+
+
+async def main(args) -> None:
+    stub = StubLLM(args.name, args.latency, args.jitter, args.error_rate, args.error_status, args.chunk_delay)
+    port = await stub.start(args.host, args.port)
+    print(f"{args.name} listening on http://{args.host}:{port}/v1/chat/completions")
+    await stub.server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8101)
+    parser.add_argument("--name", default="stub")
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds before the answer starts")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many seconds are added at random")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with --error-status")
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--chunk-delay", type=float, default=0.02, help="seconds between streamed events")
+    try:
+        asyncio.run(main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,117 @@
+# tests/test_history_cache.py
+from datetime import datetime, timedelta
+
+from app.utils.history_cache import HistoryCache, Turn, budget_turns
+
+START = datetime(2026, 1, 1)
+
+
+def turn(pk: int, content: str = "hello", role: str = "USER", is_processed: str = "Y") -> Turn:
+    return Turn(pk, START + timedelta(seconds=pk), role, content, is_processed)
+
+
+def turns(*pks: int):
+    return [turn(pk, role="USER" if pk % 2 else "ASSISTANT") for pk in pks]
+
+
+def test_budget_keeps_the_newest_turns_that_fit():
+    history = [turn(1, "a" * 10), turn(2, "b" * 10), turn(3, "c" * 10)]
+    kept, spent = budget_turns(reversed(history), budget_chars=25)
+    assert [t["content"] for t in kept] == ["b" * 10, "c" * 10]
+    assert spent
+
+
+def test_budget_always_keeps_the_newest_turn():
+    kept, spent = budget_turns([turn(1, "x" * 100)], budget_chars=10)
+    assert len(kept) == 1
+    assert spent
+
+
+def test_budget_skips_placeholders():
+    history = [turn(1, "question"), turn(2, "", role="ASSISTANT", is_processed="S")]
+    kept, spent = budget_turns(reversed(history), budget_chars=1000)
+    assert kept == [{"role": "user", "content": "question"}]
+    assert not spent
+
+
+def test_complete_history_answers_from_the_cache():
+    cache = HistoryCache(max_bytes=100_000, chat_turns=10)
+    cache.load(1, 100, turns(1, 2), complete=True)
+    assert [t["role"] for t in cache.get(1, 100, budget_chars=1000)] == ["user", "assistant"]
+    assert cache.get(1, 200, budget_chars=1000) is None
+    stats = cache.get_stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+
+
+def test_incomplete_history_misses_unless_the_budget_is_spent():
+    cache = HistoryCache(max_bytes=100_000, chat_turns=10)
+    cache.load(1, 100, turns(5, 6), complete=False)
+    # Older turns may exist in the database that would still fit
+    assert cache.get(1, 100, budget_chars=1000) is None
+    assert len(cache.get(1, 100, budget_chars=6)) == 1
+
+
+def test_append_keeps_date_order_and_the_turn_cap():
+    cache = HistoryCache(max_bytes=100_000, chat_turns=3)
+    cache.load(1, 100, turns(1, 3), complete=True)
+    cache.append(1, 100, turn(2, "late"))
+    cache.append(1, 100, turn(4, "new"))
+    history = cache._chats[(1, 100)]
+    assert [t.pk_messages for t in history.turns] == [2, 3, 4]
+    # The oldest turn fell off, so the database may know more than the cache
+    assert not history.complete
+    assert cache.get_stats()["turns"] == 3
+
+
+def test_append_ignores_chats_that_are_not_cached():
+    cache = HistoryCache(max_bytes=100_000, chat_turns=10)
+    cache.append(1, 100, turn(1))
+    assert cache.get_stats()["chats"] == 0
+
+
+def test_least_recently_used_chat_is_evicted_past_max_bytes():
+    size = turn(1).size
+    cache = HistoryCache(max_bytes=size * 4, chat_turns=10)
+    cache.load(1, 100, turns(1, 2), complete=True)
+    cache.load(1, 200, turns(3, 4), complete=True)
+    # Reading chat 100 makes chat 200 the least recently used
+    assert cache.get(1, 100, budget_chars=1000) is not None
+    cache.load(1, 300, turns(5), complete=True)
+    assert set(cache._chats) == {(1, 100), (1, 300)}
+    stats = cache.get_stats()
+    assert stats["evictions"] == 1
+    assert stats["bytes"] == size * 3 <= stats["max_bytes"]
+    assert stats["turns"] == 3
+
+
+def test_update_tracks_content_size_and_state():
+    cache = HistoryCache(max_bytes=100_000, chat_turns=10)
+    cache.load(1, 100, [turn(1, "question"), turn(2, "", role="ASSISTANT", is_processed="S")], complete=True)
+    before = cache.get_stats()["bytes"]
+    cache.update([2], content_text="a much longer answer", is_processed="Y")
+    assert cache.get(1, 100, budget_chars=1000)[-1] == {"role": "assistant", "content": "a much longer answer"}
+    assert cache.get_stats()["bytes"] == before + len("a much longer answer")
+
+
+def test_reset_leaves_an_empty_complete_chat():
+    cache = HistoryCache(max_bytes=100_000, chat_turns=10)
+    cache.load(1, 100, turns(1, 2), complete=True)
+    cache.reset(1, 100)
+    assert cache.get(1, 100, budget_chars=1000) == []
+    assert cache.get_stats()["bytes"] == 0
+
+
+def test_invalidate_drops_the_chat():
+    cache = HistoryCache(max_bytes=100_000, chat_turns=10)
+    cache.load(1, 100, turns(1), complete=True)
+    cache.invalidate(1, 100)
+    assert cache.get(1, 100, budget_chars=1000) is None
+    assert cache.get_stats()["turns"] == 0
+
+
+def test_disabled_cache_stores_nothing():
+    cache = HistoryCache(max_bytes=0, chat_turns=10)
+    assert not cache.enabled
+    cache.load(1, 100, turns(1), complete=True)
+    cache.reset(1, 200)
+    assert cache.get_stats()["chats"] == 0
@@ -0,0 +1,182 @@
+# tests/test_llm_router.py
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from app.utils import llm_router as llm_router_module
+from app.utils import resilience
+from app.utils.llm_router import LLMRouter, LLMTarget, MIN_SAMPLES
+from app.utils.resilience import RetryBudget, call_with_retries, OPEN, CLOSED
+
+PAYLOAD = {"model": "ignored", "messages": [{"role": "user", "content": "Hi"}]}
+
+
+def target(name: str) -> LLMTarget:
+    return LLMTarget(name, f"http://{name}.test/v1/chat/completions", f"model-{name}", None, f"client_{name}")
+
+
+def completion(name: str) -> dict:
+    return {"choices": [{"message": {"role": "assistant", "content": f"from {name}"}}]}
+
+
+@pytest.fixture(autouse=True)
+def budget(monkeypatch):
+    budget = RetryBudget(ratio=1.0, min_per_second=1.0)
+    monkeypatch.setattr(llm_router_module, "retry_budget", budget)
+    monkeypatch.setattr(resilience, "retry_budget", budget)
+    return budget
+
+
+@pytest.fixture
+def upstreams(monkeypatch):
+    """Answers requests by host: a (delay, status) per target name, 200 with a completion by default."""
+    behaviour = {}
+    requests = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        name = request.url.host.split(".")[0]
+        requests.append(name)
+        delay, status = behaviour.get(name, (0.0, 200))
+        await asyncio.sleep(delay)
+        if status != 200:
+            return httpx.Response(status, json={"error": {"message": "failed"}})
+        return httpx.Response(200, json=completion(name))
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(llm_router_module.http_clients, "get", lambda name: client)
+    return behaviour, requests
+
+
+def test_unmeasured_targets_come_first_then_fastest():
+    fast, slow, new = target("fast"), target("slow"), target("new")
+    router = LLMRouter([slow, fast, new], explore_rate=0.0, hedge=False)
+    for _ in range(MIN_SAMPLES):
+        router.record(fast, ok=True, latency=0.1)
+        router.record(slow, ok=True, latency=1.0)
+    assert router.ranked() == [new, fast, slow]
+    assert router.pick() == new
+
+
+def test_failing_target_cools_down_and_ranks_last():
+    broken, healthy = target("broken"), target("healthy")
+    router = LLMRouter([broken, healthy], explore_rate=0.0, max_error_rate=0.5, cooldown=60, hedge=False)
+    for _ in range(MIN_SAMPLES):
+        router.record(broken, ok=False)
+    assert router.health["broken"].cooldowns == 1
+    assert router.ranked() == [healthy, broken]
+
+
+def test_single_target_never_cools_down():
+    only = target("only")
+    router = LLMRouter([only], explore_rate=0.0, max_error_rate=0.5, hedge=False)
+    for _ in range(MIN_SAMPLES):
+        router.record(only, ok=False)
+    assert router.health["only"].cooldowns == 0
+
+
+def test_exploration_moves_another_target_first():
+    fast, slow = target("fast"), target("slow")
+    router = LLMRouter([fast, slow], explore_rate=1.0, hedge=False)
+    for _ in range(MIN_SAMPLES):
+        router.record(fast, ok=True, latency=0.1)
+        router.record(slow, ok=True, latency=1.0)
+    assert router.ranked() == [slow, fast]
+    assert router.get_stats()["explored"] == 1
+
+
+def test_hedge_delay_follows_p95():
+    slow = target("slow")
+    router = LLMRouter([slow], hedge_min_delay=0.2)
+    assert router.hedge_delay(slow) == 0.2
+    for latency in (1.0, 1.0, 1.0, 1.0, 2.0):
+        router.record(slow, ok=True, latency=latency)
+    assert router.hedge_delay(slow) == 2.0
+
+
+def test_stalled_request_is_won_by_the_hedge(upstreams):
+    behaviour, requests = upstreams
+    primary, backup = target("primary"), target("backup")
+    behaviour["primary"] = (2.0, 200)
+    router = LLMRouter([primary, backup], explore_rate=0.0, hedge=True, hedge_min_delay=0.05)
+
+    started = time.perf_counter()
+    result = asyncio.run(router.complete(PAYLOAD))
+    elapsed = time.perf_counter() - started
+
+    assert result == completion("backup")
+    assert elapsed < 1.0
+    stats = router.get_stats()
+    assert stats["hedged"] == 1
+    assert stats["hedges_won"] == 1
+    assert stats["hedges_cancelled"] == 1
+    assert requests == ["primary", "backup"]
+
+
+def test_fast_answer_is_not_hedged(upstreams):
+    behaviour, requests = upstreams
+    router = LLMRouter([target("primary"), target("backup")], explore_rate=0.0, hedge=True, hedge_min_delay=0.5)
+    assert asyncio.run(router.complete(PAYLOAD)) == completion("primary")
+    assert router.get_stats()["hedged"] == 0
+    assert requests == ["primary"]
+
+
+def test_transient_error_fails_over_to_the_next_target(upstreams):
+    behaviour, requests = upstreams
+    behaviour["broken"] = (0.0, 503)
+    router = LLMRouter([target("broken"), target("healthy")], explore_rate=0.0, hedge=False)
+    assert asyncio.run(router.complete(PAYLOAD)) == completion("healthy")
+    assert requests == ["broken", "healthy"]
+    assert router.get_stats()["failovers"] == 1
+
+
+def test_request_errors_are_not_failed_over(upstreams):
+    behaviour, requests = upstreams
+    behaviour["strict"] = (0.0, 400)
+    router = LLMRouter([target("strict"), target("other")], explore_rate=0.0, hedge=False)
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(router.complete(PAYLOAD))
+    assert requests == ["strict"]
+    # The target answered; its breaker does not count it
+    assert router.breakers["strict"].consecutive_failures == 0
+
+
+def test_breakers_are_kept_per_target(upstreams):
+    behaviour, requests = upstreams
+    behaviour["broken"] = (0.0, 500)
+    broken, healthy = target("broken"), target("healthy")
+    # No cooldown, so only the breaker keeps the broken target out
+    router = LLMRouter([broken, healthy], explore_rate=0.0, max_error_rate=1.0, hedge=False)
+    for _ in range(router.breakers["broken"].failure_threshold + 3):
+        assert asyncio.run(router.complete(PAYLOAD)) == completion("healthy")
+    assert router.breakers["broken"].state == OPEN
+    assert router.breakers["healthy"].state == CLOSED
+    assert requests.count("broken") == router.breakers["broken"].failure_threshold
+    assert router.ranked()[0] == healthy
+
+
+def test_last_error_is_raised_when_every_target_fails(upstreams):
+    behaviour, _ = upstreams
+    behaviour["one"] = (0.0, 502)
+    behaviour["two"] = (0.0, 503)
+    router = LLMRouter([target("one"), target("two")], explore_rate=0.0, hedge=False)
+    with pytest.raises(httpx.HTTPStatusError) as raised:
+        asyncio.run(router.complete(PAYLOAD))
+    assert raised.value.response.status_code == 503
+
+
+def test_one_deposit_per_completion_under_call_with_retries(upstreams, budget):
+    behaviour, requests = upstreams
+    behaviour["broken"] = (0.0, 503)
+    budget.ratio, budget.min_per_second, budget.tokens = 0.5, 0, 1
+    router = LLMRouter([target("broken"), target("healthy")], explore_rate=0.0, hedge=False)
+
+    async def completion_with_retries():
+        # As get_chat_completion calls it
+        return await call_with_retries("llm", lambda: router.complete(PAYLOAD), attempts=3, with_breaker=False)
+
+    assert asyncio.run(completion_with_retries()) == completion("healthy")
+    # 1 + 0.5 deposited once - 1 for the failover
+    assert budget.tokens == 0.5
+    assert budget.get_stats()["first_attempts"] == 1
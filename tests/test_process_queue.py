@@ -0,0 +1,107 @@
+# tests/test_process_queue.py
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+# message_processing imports the request classifier, which needs spacy and its model
+pytest.importorskip("spacy")
+
+from app.controllers import message_processing  # noqa: E402
+from app.controllers.message_processing import process_queue  # noqa: E402
+
+ENQUEUED_AT = datetime(2026, 1, 1, 12, 0)
+BOT = SimpleNamespace(bot_id=1, bot_token="token")
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def scalars(self):
+        return self
+
+    def all(self):
+        return self.rows
+
+
+class FakeSession:
+    def __init__(self):
+        self.rolled_back = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, statement):
+        return FakeResult([SimpleNamespace(pk_messages=10, message_date=ENQUEUED_AT)])
+
+    async def rollback(self):
+        self.rolled_back = True
+
+    async def close(self):
+        pass
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = {"released": 0, "notified": 0, "transitions": []}
+
+    async def release_claimed_messages(db, chat_id, bot_id):
+        calls["released"] += 1
+
+    async def send_error_notification(chat_id, bot_token, text):
+        calls["notified"] += 1
+
+    async def transition_messages(db, pks, from_status, to_status, content=None, batched=False):
+        calls["transitions"].append((list(pks), from_status, to_status, content))
+        return list(pks)
+
+    monkeypatch.setattr(message_processing, "release_claimed_messages", release_claimed_messages)
+    monkeypatch.setattr(message_processing, "send_error_notification", send_error_notification)
+    monkeypatch.setattr(message_processing, "transition_messages", transition_messages)
+    return calls
+
+
+def failing_process_message(monkeypatch, send_first: bool):
+    async def process_message(messages, db, chat_id, bot, user_id, ai_placeholder_pk, awaiting_type, progress, may_retry):
+        progress.message_pks = [message.pk_messages for message in messages]
+        if send_first:
+            progress.mark_sent("Hello there.")
+        # The batched transitions lost their connection
+        raise OperationalError("UPDATE", {}, ConnectionError("connection lost"))
+
+    monkeypatch.setattr(message_processing, "process_message", process_message)
+
+
+def run(may_retry: bool):
+    return asyncio.run(process_queue(
+        chat_id=100, bot=BOT, user_id=7, message_pk=10, ai_placeholder_pk=11, db=FakeSession(),
+        enqueued_at=ENQUEUED_AT.isoformat(), may_retry=may_retry,
+    ))
+
+
+def test_error_before_the_reply_is_retried(monkeypatch, calls):
+    failing_process_message(monkeypatch, send_first=False)
+    with pytest.raises(OperationalError):
+        run(may_retry=True)
+    assert calls["released"] == 1
+    assert calls["transitions"] == []
+
+
+def test_error_after_the_reply_finishes_the_batch(monkeypatch, calls):
+    failing_process_message(monkeypatch, send_first=True)
+    run(may_retry=True)
+    assert calls["released"] == 0
+    assert calls["notified"] == 0
+    assert calls["transitions"] == [([11], "S", "Y", "Hello there."), ([10], "P", "Y", None)]
+
+
+def test_last_attempt_notifies_the_user(monkeypatch, calls):
+    failing_process_message(monkeypatch, send_first=False)
+    run(may_retry=False)
+    assert (calls["released"], calls["notified"]) == (1, 1)
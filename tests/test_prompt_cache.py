@@ -0,0 +1,80 @@
+# tests/test_prompt_cache.py
+import pytest
+
+from app.utils import prompt_cache
+from app.utils.prompt_cache import MAX_BREAKPOINTS, PromptCacheStats, cacheable, message, prepare_payload
+
+CACHING_MODEL = "anthropic/claude-3-haiku"
+PLAIN_MODEL = "openai/gpt-4o-mini"
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    monkeypatch.setattr(prompt_cache, "PROMPT_CACHE_ENABLED", True)
+    monkeypatch.setattr(prompt_cache, "PROMPT_CACHE_BREAKPOINT_MODELS", ["anthropic/"])
+    monkeypatch.setattr(prompt_cache, "PROMPT_CACHE_MIN_CHARS", 100)
+
+
+def breakpoints(payload: dict) -> list:
+    return [part["text"] for msg in payload["messages"] if isinstance(msg["content"], list)
+            for part in msg["content"] if "cache_control" in part]
+
+
+def payload(*messages) -> dict:
+    return {"model": "placeholder", "temperature": 0.5, "messages": list(messages)}
+
+
+def test_long_prefix_keeps_its_breakpoint():
+    system = "s" * 150
+    prepared = prepare_payload(payload(message("system", cacheable(system)), {"role": "user", "content": "Hi"}), CACHING_MODEL)
+    assert prepared["model"] == CACHING_MODEL
+    assert prepared["temperature"] == 0.5
+    assert breakpoints(prepared) == [system]
+    assert prepared["messages"][1] == {"role": "user", "content": "Hi"}
+
+
+def test_short_prefix_loses_its_breakpoint():
+    prepared = prepare_payload(payload(message("system", cacheable("short"), "tail")), CACHING_MODEL)
+    assert breakpoints(prepared) == []
+    assert prepared["messages"][0]["content"] == [{"type": "text", "text": "short"}, {"type": "text", "text": "tail"}]
+
+
+def test_prefix_length_counts_earlier_messages():
+    # Neither message reaches the minimum alone; the second breakpoint caches both
+    first, second = "a" * 60, "b" * 60
+    prepared = prepare_payload(payload(message("system", cacheable(first)), message("user", cacheable(second))), CACHING_MODEL)
+    assert breakpoints(prepared) == [second]
+
+
+def test_at_most_max_breakpoints_are_kept():
+    marked = [message("user", cacheable(str(n) * 200)) for n in range(MAX_BREAKPOINTS + 2)]
+    assert len(breakpoints(prepare_payload(payload(*marked), CACHING_MODEL))) == MAX_BREAKPOINTS
+
+
+def test_other_models_get_plain_string_content():
+    prepared = prepare_payload(payload(message("system", cacheable("s" * 150), "tail")), PLAIN_MODEL)
+    assert prepared["messages"] == [{"role": "system", "content": "s" * 150 + "tail"}]
+
+
+def test_disabled_cache_strips_breakpoints(monkeypatch):
+    monkeypatch.setattr(prompt_cache, "PROMPT_CACHE_ENABLED", False)
+    prepared = prepare_payload(payload(message("system", cacheable("s" * 150))), CACHING_MODEL)
+    assert prepared["messages"] == [{"role": "system", "content": "s" * 150}]
+
+
+def test_payload_is_not_modified():
+    original = payload(message("system", cacheable("short")))
+    prepare_payload(original, CACHING_MODEL)
+    assert original["messages"][0]["content"][0]["cache_control"] == {"type": "ephemeral"}
+
+
+def test_stats_read_cached_tokens_of_either_usage_format():
+    stats = PromptCacheStats()
+    stats.record("a", {"prompt_tokens": 100, "prompt_tokens_details": {"cached_tokens": 80}}, latency=1.0)
+    stats.record("a", {"prompt_tokens": 100, "cache_read_input_tokens": 20}, latency=3.0)
+    stats.record("a", {"prompt_tokens": 100}, latency=2.0)
+    stats.record("a", None)
+    result = stats.get_stats()["a"]
+    assert (result["calls"], result["cache_hits"], result["cached_tokens"]) == (3, 2, 100)
+    assert result["cached_token_ratio"] == round(100 / 300, 3)
+    assert (result["avg_seconds_cache_hit"], result["avg_seconds_cache_miss"]) == (2.0, 2.0)
@@ -0,0 +1,219 @@
+# tests/test_resilience.py
+import asyncio
+
+import httpx
+import pytest
+
+from app.utils import resilience
+from app.utils.resilience import (
+    CircuitBreaker, CircuitOpenError, RetryBudget, call_with_retries, get_breaker, is_transient, CLOSED, OPEN, HALF_OPEN
+)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(resilience.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def budget(monkeypatch):
+    budget = RetryBudget(ratio=1.0, min_per_second=1.0)
+    monkeypatch.setattr(resilience, "retry_budget", budget)
+    return budget
+
+
+def status_error(status: int) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "http://upstream.test/")
+    return httpx.HTTPStatusError("failed", request=request, response=httpx.Response(status, request=request))
+
+
+def test_is_transient():
+    assert is_transient(httpx.ConnectTimeout("slow"))
+    assert is_transient(asyncio.TimeoutError())
+    assert is_transient(status_error(429))
+    assert is_transient(status_error(503))
+    assert not is_transient(status_error(400))
+    assert not is_transient(ValueError("bad"))
+
+
+def test_breaker_opens_after_threshold(clock):
+    breaker = CircuitBreaker("test", failure_threshold=3, recovery_seconds=30)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert not breaker.available()
+
+
+def test_success_resets_the_failure_count(clock):
+    breaker = CircuitBreaker("test", failure_threshold=2, recovery_seconds=30)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+
+
+def test_half_open_lets_one_trial_through(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, recovery_seconds=30)
+    breaker.record_failure()
+    clock.now += 31
+    assert breaker.available()
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.available()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+
+
+def test_failed_trial_opens_again(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, recovery_seconds=30)
+    breaker.record_failure()
+    clock.now += 31
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+
+
+def test_released_trial_frees_the_slot(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, recovery_seconds=30)
+    breaker.record_failure()
+    clock.now += 31
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+
+
+def test_retry_budget_spends_deposits(clock):
+    budget = RetryBudget(ratio=0.5, min_per_second=0.0)
+    budget.tokens = 0
+    budget.deposit()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert budget.withdraw()
+    assert not budget.withdraw()
+    assert budget.get_stats()["denied"] == 2
+
+
+def test_retry_budget_refills_with_time(clock):
+    budget = RetryBudget(ratio=0.0, min_per_second=1.0)
+    budget.tokens = 0
+    assert not budget.withdraw()
+    clock.now += 2
+    assert budget.withdraw()
+    # Never more than max_tokens saved up
+    clock.now += 1000
+    budget.get_stats()
+    assert budget.tokens == budget.max_tokens
+
+
+def test_call_with_retries_retries_transient_errors(budget):
+    calls = []
+
+    async def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise status_error(503)
+        return "ok"
+
+    result = asyncio.run(call_with_retries("test-retries", flaky, attempts=3, base_delay=0))
+    assert result == "ok"
+    assert len(calls) == 3
+    assert get_breaker("test-retries").state == CLOSED
+
+
+def test_call_with_retries_raises_other_errors_at_once(budget):
+    calls = []
+
+    async def bad_request():
+        calls.append(1)
+        raise status_error(400)
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(call_with_retries("test-bad-request", bad_request, attempts=3, base_delay=0))
+    assert len(calls) == 1
+    # The upstream answered, so the breaker does not count it
+    assert get_breaker("test-bad-request").consecutive_failures == 0
+
+
+def test_call_with_retries_stops_when_the_budget_is_empty(budget):
+    budget.tokens = 0
+    budget.ratio = budget.min_per_second = 0
+    calls = []
+
+    async def down():
+        calls.append(1)
+        raise status_error(503)
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(call_with_retries("test-budget", down, attempts=5, base_delay=0))
+    assert len(calls) == 1
+
+
+def test_call_with_retries_fails_fast_on_open_breaker(budget):
+    breaker = get_breaker("test-open")
+    breaker.state = OPEN
+    breaker.opened_at = resilience.time.monotonic()
+
+    async def never_called():
+        raise AssertionError("called through an open breaker")
+
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(call_with_retries("test-open", never_called))
+
+
+def test_call_with_retries_retries_unusable_results(budget):
+    answers = ["", "", "text"]
+
+    async def answer():
+        return answers.pop(0)
+
+    result = asyncio.run(call_with_retries("test-results", answer, attempts=3, base_delay=0, retry_result=lambda r: not r))
+    assert result == "text"
+
+
+def test_call_with_retries_without_breaker(budget):
+    calls = []
+
+    async def inner_breaker_open():
+        calls.append(1)
+        raise CircuitOpenError("llm:target")
+
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(call_with_retries("test-no-breaker", inner_breaker_open, attempts=3, base_delay=0, with_breaker=False))
+    assert len(calls) == 1
+    assert "test-no-breaker" not in resilience.breakers
+
+
+def test_nested_retry_layers_deposit_once(budget):
+    budget.ratio, budget.min_per_second, budget.tokens = 0.25, 0, 0
+
+    async def inner():
+        with budget.request():
+            return "ok"
+
+    async def outer():
+        return await call_with_retries("test-nested", inner, attempts=1)
+
+    assert asyncio.run(outer()) == "ok"
+    assert budget.tokens == 0.25
+    assert budget.get_stats()["first_attempts"] == 1
+    # The scope ends with the request; the next one deposits again
+    asyncio.run(outer())
+    assert budget.tokens == 0.5
@@ -0,0 +1,43 @@
+# tests/test_schemas.py
+import json
+
+import pytest
+
+from app.schemas import TelegramWebhookPayload, is_handled_update
+
+USER = {"id": 7, "is_bot": False, "first_name": "Ana"}
+CHAT = {"id": 7, "type": "private"}
+
+
+def body(update: dict) -> bytes:
+    return json.dumps(update).encode()
+
+
+@pytest.mark.parametrize("update", [
+    {"update_id": 1, "message": {"message_id": 1, "from": USER, "chat": CHAT, "date": 0, "text": "hi"}},
+    {"update_id": 2, "callback_query": {"id": "c", "from": USER, "data": "menu"}},
+    {"update_id": 3, "pre_checkout_query": {"id": "p", "from": USER, "currency": "XTR", "total_amount": 50,
+                                            "invoice_payload": "credits"}},
+])
+def test_handled_updates_pass_and_parse(update):
+    raw = body(update)
+    assert is_handled_update(raw)
+    assert TelegramWebhookPayload.model_validate_json(raw).update_id == update["update_id"]
+
+
+@pytest.mark.parametrize("update", [
+    {"update_id": 4, "edited_message": {"message_id": 1, "chat": CHAT, "date": 0, "text": "edit"}},
+    {"update_id": 5, "my_chat_member": {"chat": CHAT, "from": USER, "date": 0}},
+    {"update_id": 6, "channel_post": {"message_id": 1, "chat": CHAT, "date": 0}},
+])
+def test_other_updates_are_dropped(update):
+    assert not is_handled_update(body(update))
+
+
+def test_nested_key_is_a_false_positive_only():
+    # The scan matches a nested "message" key too; the parse then finds no handled update
+    raw = body({"update_id": 7, "edited_message": {"message_id": 2, "chat": CHAT, "date": 0,
+                                                    "pinned_message": {"message": "x"}}})
+    assert is_handled_update(raw)
+    payload = TelegramWebhookPayload.model_validate_json(raw)
+    assert payload.message is None and payload.callback_query is None and payload.pre_checkout_query is None
@@ -0,0 +1,52 @@
+# tests/test_sentence_stream.py
+import pytest
+
+# message_processing imports the request classifier, which needs spacy and its model
+pytest.importorskip("spacy")
+
+from app.controllers.message_processing import SentenceStream, humanize_response  # noqa: E402
+
+REPLY = "¡Hola! ¿Cómo estás? Todo bien por aquí...  Hasta luego. Adiós"
+
+
+def stream(deltas):
+    sentences = SentenceStream()
+    sent = []
+    for delta in deltas:
+        sent.extend(sentences.feed(delta))
+    return sentences, sent + sentences.flush()
+
+
+def test_nothing_is_sent_before_a_sentence_completes():
+    sentences = SentenceStream()
+    assert sentences.feed("Hello there") == []
+    # Neither the full stop nor the space ends it: "..." or more spaces may still be coming
+    assert sentences.feed(".") == []
+    assert sentences.feed(" ") == []
+    assert sentences.feed(" How") == ["Hello there."]
+    assert sentences.pending == "How"
+
+
+def test_flush_sends_the_rest():
+    sentences = SentenceStream()
+    sentences.feed("One. Two")
+    assert sentences.flush() == ["Two"]
+    assert sentences.flush() == []
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, len(REPLY)])
+def test_any_chunking_matches_the_whole_reply(size):
+    deltas = [REPLY[i:i + size] for i in range(0, len(REPLY), size)]
+    sentences, sent = stream(deltas)
+    assert sent == humanize_response(REPLY)
+    assert sentences.text == REPLY
+
+
+def test_several_sentences_in_one_delta():
+    sentences = SentenceStream()
+    assert sentences.feed("A. B! C? D") == ["A.", "B!", "C?"]
+    assert sentences.flush() == ["D"]
+
+
+def test_blank_stream_sends_nothing():
+    assert stream(["", "   "])[1] == []
@@ -0,0 +1,61 @@
+# tests/test_update_dedup.py
+from app.utils.update_dedup import (
+    RecentUpdateIds, UpdateProgress, forget_update, is_duplicate_update, recent_update_ids, SYNTHETIC_UPDATE_ID
+)
+
+
+def test_add_reports_known_keys():
+    ids = RecentUpdateIds(maxsize=10)
+    assert ids.add(("bot", 1))
+    assert not ids.add(("bot", 1))
+    assert ids.add(("other_bot", 1))
+    assert len(ids) == 2
+
+
+def test_oldest_key_is_evicted_past_maxsize():
+    ids = RecentUpdateIds(maxsize=2)
+    ids.add(1)
+    ids.add(2)
+    ids.add(3)
+    assert len(ids) == 2
+    assert ids.add(1)
+
+
+def test_seeing_a_key_again_keeps_it():
+    ids = RecentUpdateIds(maxsize=2)
+    ids.add(1)
+    ids.add(2)
+    ids.add(1)  # 1 is now the most recently seen, 2 goes first
+    ids.add(3)
+    assert not ids.add(1)
+    assert ids.add(2)
+
+
+def test_discard():
+    ids = RecentUpdateIds(maxsize=10)
+    ids.add(1)
+    ids.discard(1)
+    ids.discard(2)  # unknown keys are ignored
+    assert len(ids) == 0
+    assert ids.add(1)
+
+
+def test_synthetic_updates_are_never_duplicates():
+    assert not is_duplicate_update("dedup_test_bot", SYNTHETIC_UPDATE_ID)
+    assert not is_duplicate_update("dedup_test_bot", SYNTHETIC_UPDATE_ID)
+
+
+def test_forgotten_update_is_accepted_again():
+    assert not is_duplicate_update("dedup_test_bot", 1001)
+    assert is_duplicate_update("dedup_test_bot", 1001)
+    # A 503 from a full queue forgets the update so that Telegram's redelivery gets in
+    forget_update("dedup_test_bot", 1001)
+    assert not is_duplicate_update("dedup_test_bot", 1001)
+    recent_update_ids.discard(("dedup_test_bot", 1001))
+
+
+def test_update_progress():
+    progress = UpdateProgress()
+    assert not progress.written
+    progress.mark_written()
+    assert progress.written
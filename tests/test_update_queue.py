@@ -0,0 +1,90 @@
+# tests/test_update_queue.py
+import asyncio
+
+import pytest
+
+from app.schemas import TelegramWebhookPayload
+from app.utils.update_queue import (
+    UpdateQueue, classify_update, PRIORITY_PAYMENT, PRIORITY_COMMAND, PRIORITY_TEXT, PRIORITY_MEDIA
+)
+
+USER = {"id": 7, "is_bot": False, "first_name": "Ana"}
+CHAT = {"id": 7, "type": "private"}
+PAYMENT = {"currency": "XTR", "total_amount": 50, "invoice_payload": "credits",
+           "telegram_payment_charge_id": "t", "provider_payment_charge_id": "p"}
+VOICE = {"duration": 2, "mime_type": "audio/ogg", "file_id": "f", "file_size": 10}
+
+
+def update(**fields) -> TelegramWebhookPayload:
+    return TelegramWebhookPayload.model_validate({"update_id": 1, **fields})
+
+
+def message(**fields) -> dict:
+    return {"message_id": 1, "from": USER, "chat": CHAT, "date": 0, **fields}
+
+
+@pytest.mark.parametrize("payload, priority", [
+    (update(pre_checkout_query={"id": "q", "from": USER, "currency": "XTR", "total_amount": 50,
+                                "invoice_payload": "credits"}), PRIORITY_PAYMENT),
+    (update(message=message(successful_payment=PAYMENT)), PRIORITY_PAYMENT),
+    (update(callback_query={"id": "c", "from": USER, "data": "menu"}), PRIORITY_COMMAND),
+    (update(message=message(text="/start")), PRIORITY_COMMAND),
+    (update(message=message(text="hello")), PRIORITY_TEXT),
+    (update(message=message(voice=VOICE)), PRIORITY_MEDIA),
+    (update(message=message(photo=[], caption="look")), PRIORITY_MEDIA),
+])
+def test_classify_update(payload, priority):
+    assert classify_update(payload) == priority
+
+
+def test_higher_priorities_are_served_first():
+    queue = UpdateQueue(maxsize=10, workers=1)
+    served = []
+
+    async def run():
+        await queue.start()
+        gate = asyncio.Event()
+
+        async def blocker():
+            await gate.wait()
+
+        async def job(name):
+            served.append(name)
+
+        # The only worker is busy while the rest queue up
+        queue.submit(PRIORITY_TEXT, blocker)
+        await asyncio.sleep(0)
+        queue.submit(PRIORITY_MEDIA, lambda: job("media"))
+        queue.submit(PRIORITY_TEXT, lambda: job("text 1"))
+        queue.submit(PRIORITY_PAYMENT, lambda: job("payment"))
+        queue.submit(PRIORITY_TEXT, lambda: job("text 2"))
+        gate.set()
+        await queue.stop(timeout=1)
+
+    asyncio.run(run())
+    assert served == ["payment", "text 1", "text 2", "media"]
+
+
+def test_full_queue_rejects_and_failed_jobs_are_counted():
+    queue = UpdateQueue(maxsize=1, workers=1)
+
+    async def run():
+        await queue.start()
+        gate = asyncio.Event()
+
+        async def blocker():
+            await gate.wait()
+
+        async def broken():
+            raise ValueError("bad update")
+
+        assert queue.submit(PRIORITY_TEXT, blocker)
+        await asyncio.sleep(0)
+        assert queue.submit(PRIORITY_TEXT, broken)
+        assert not queue.submit(PRIORITY_PAYMENT, broken)
+        gate.set()
+        await queue.stop(timeout=1)
+
+    asyncio.run(run())
+    stats = queue.get_stats()
+    assert (stats["rejected"], stats["failed"]) == (1, 1)
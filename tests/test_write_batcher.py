@@ -0,0 +1,124 @@
+# tests/test_write_batcher.py
+import asyncio
+
+import pytest
+
+from app.utils.write_batcher import WriteBatcher
+
+
+class FakeSession:
+    def __init__(self, store):
+        self.store = store
+        self.rows = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def commit(self):
+        self.store.commits.append(list(self.rows))
+
+
+class FakeStore:
+    """Stands in for the session factory; each commit records the rows written in its transaction."""
+
+    def __init__(self):
+        self.commits = []
+
+    def __call__(self):
+        return FakeSession(self)
+
+
+async def insert(db, payloads):
+    if "bad" in payloads:
+        raise ValueError("constraint violated")
+    db.rows.extend(payloads)
+    return [f"id:{payload}" for payload in payloads]
+
+
+@pytest.fixture
+def store():
+    return FakeStore()
+
+
+def test_full_batch_is_flushed_in_one_transaction(store):
+    batcher = WriteBatcher(store, max_items=3, max_delay=10)
+    batcher.register("message", insert)
+
+    async def run():
+        results = await asyncio.gather(*(batcher.submit("message", n) for n in ("a", "b", "c")))
+        await batcher.stop()
+        return results
+
+    # max_delay is far away, so only max_items can have flushed them
+    assert asyncio.run(asyncio.wait_for(run(), 1)) == ["id:a", "id:b", "id:c"]
+    assert store.commits == [["a", "b", "c"]]
+    stats = batcher.get_stats()
+    assert (stats["flushes"], stats["flushed_items"], stats["flush_size_max"]) == (1, 3, 3)
+
+
+def test_partial_batch_is_flushed_after_max_delay(store):
+    batcher = WriteBatcher(store, max_items=100, max_delay=0.05)
+    batcher.register("message", insert)
+
+    async def run():
+        result = await asyncio.wait_for(batcher.submit("message", "a"), 1)
+        committed = list(store.commits)
+        await batcher.stop()
+        return result, committed
+
+    assert asyncio.run(run()) == ("id:a", [["a"]])
+
+
+def test_failed_batch_is_retried_one_by_one(store):
+    batcher = WriteBatcher(store, max_items=3, max_delay=10)
+    batcher.register("message", insert)
+
+    async def run():
+        results = await asyncio.gather(*(batcher.submit("message", n) for n in ("a", "bad", "c")), return_exceptions=True)
+        await batcher.stop()
+        return results
+
+    good, bad, other = asyncio.run(run())
+    assert (good, other) == ("id:a", "id:c")
+    assert isinstance(bad, ValueError)
+    assert store.commits == [["a"], ["c"]]
+    stats = batcher.get_stats()
+    assert (stats["split_batches"], stats["failed"]) == (1, 1)
+
+
+def test_kinds_share_the_transaction_and_after_commit_sees_results(store):
+    seen = []
+    batcher = WriteBatcher(store, max_items=2, max_delay=10)
+    batcher.register("message", insert)
+    batcher.register("event", insert, after_commit=lambda payloads, results: seen.append((payloads, results)))
+
+    async def run():
+        await asyncio.gather(batcher.submit("message", "m"), batcher.submit("event", "e"))
+        await batcher.stop()
+
+    asyncio.run(run())
+    assert store.commits == [["m", "e"]]
+    assert seen == [(["e"], ["id:e"])]
+
+
+def test_stop_drains_the_queue(store):
+    batcher = WriteBatcher(store, max_items=100, max_delay=10)
+    batcher.register("message", insert)
+
+    async def run():
+        waiting = [asyncio.create_task(batcher.submit("message", n)) for n in ("a", "b")]
+        await asyncio.sleep(0)
+        await asyncio.wait_for(batcher.stop(), 1)
+        return await asyncio.gather(*waiting)
+
+    assert asyncio.run(run()) == ["id:a", "id:b"]
+    assert store.commits == [["a", "b"]]
+
+
+def test_unknown_kind_is_refused(store):
+    batcher = WriteBatcher(store, max_items=1, max_delay=0)
+    with pytest.raises(RuntimeError):
+        asyncio.run(batcher.submit("missing", "a"))